@@ -0,0 +1,267 @@
+"""On-disk index of the public API and of what exposes each of its symbols.
+
+The index is written by ``doxxie --public-api-only --api-index`` and stores,
+for every symbol of the public API, the symbols referencing it (for instance
+the functions returning an internal class) in CSR form (see doxxie._symgraph).
+The mypy plugin writes the same index to the path in DOXXIE_INDEX_OUTFILE.
+Queries only load the index and don't analyze anything::
+
+    $ doxxie --impact pkg.internal.Foo
+    $ doxxie --why pkg.internal.Foo
+"""
+
+import argparse
+from array import array
+from collections import deque
+import contextlib
+import json
+import os
+import sys
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Tuple
+
+from ._symgraph import FLAG_ROOT
+from ._symgraph import SymbolGraph
+
+
+DEFAULT_API_INDEX = ".doxxie_api_index"
+
+# Version of the format of the index.
+INDEX_VERSION = 1
+
+
+class ApiIndex:
+    """The symbols of a public API and, for each of them, the ones exposing it.
+
+    >>> g = SymbolGraph()
+    >>> g.intern("pkg.f", FLAG_ROOT), g.intern("pkg.g", FLAG_ROOT)
+    (0, 1)
+    >>> g.expand([g.intern("pkg.internal.A")]), g.expand([])
+    (0, 1)
+    >>> g.expand([g.intern("pkg.internal.B")]), g.expand([])
+    (2, 3)
+    >>> index = ApiIndex.from_graphs([g])
+    >>> index.exposed_by("pkg.internal.B")
+    ['pkg.internal.A']
+    >>> index.impact("pkg.internal.B"), index.impact("pkg.f"), index.impact("pkg.g")
+    (['pkg.f'], ['pkg.f'], ['pkg.g'])
+    >>> index.why("pkg.internal.B")
+    [['pkg.f', 'pkg.internal.A', 'pkg.internal.B']]
+    """
+
+    def __init__(
+        self,
+        names: List[str],
+        flags: bytearray,
+        offsets: "array[int]",
+        exposers: "array[int]",
+    ) -> None:
+        self.names = names
+        self.flags = flags
+        # The ids of the symbols exposing the symbol i are
+        # exposers[offsets[i]:offsets[i + 1]].
+        self.offsets = offsets
+        self.exposers = exposers
+        self.ids = {name: i for i, name in enumerate(names)}
+
+    @classmethod
+    def from_graphs(cls, graphs: Iterable[SymbolGraph]) -> "ApiIndex":
+        """Merge the symbol graphs of a public API, eg. found by several shards."""
+        builder = _IndexBuilder()
+        for graph in graphs:
+            local = array("l")
+            for name, flag in zip(graph.names, graph.flags):
+                local.append(builder.add(name, flag))
+            for i, j in graph.edges():
+                builder.link(local[i], local[j])
+        return builder.build()
+
+    @classmethod
+    def from_edges(
+        cls, roots: Iterable[str], edges: Iterable[Tuple[str, str]]
+    ) -> "ApiIndex":
+        """Index a public API given by its roots and (source, target) references.
+
+        >>> index = ApiIndex.from_edges(["pkg.f"], [("pkg.f", "pkg.A")])
+        >>> index.names, index.exposed_by("pkg.A")
+        (['pkg.f', 'pkg.A'], ['pkg.f'])
+        """
+        builder = _IndexBuilder()
+        for name in roots:
+            builder.add(name, FLAG_ROOT)
+        for source, target in edges:
+            builder.link(builder.add(source), builder.add(target))
+        return builder.build()
+
+    def save(self, path: str) -> None:
+        data = {
+            "version": INDEX_VERSION,
+            "names": self.names,
+            "flags": list(self.flags),
+            "offsets": list(self.offsets),
+            "exposers": list(self.exposers),
+        }
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            with open(tmp, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp)
+            raise
+
+    @classmethod
+    def load(cls, path: str) -> "ApiIndex":
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("version") != INDEX_VERSION:
+            raise ValueError("unsupported index version %r" % data.get("version"))
+        return cls(
+            data["names"],
+            bytearray(data["flags"]),
+            array("l", data["offsets"]),
+            array("l", data["exposers"]),
+        )
+
+    def _exposers(self, i: int) -> "array[int]":
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.exposers[start:end]
+
+    def exposed_by(self, name: str) -> List[str]:
+        """Return the symbols referencing name directly."""
+        return sorted(self.names[i] for i in self._exposers(self.ids[name]))
+
+    def impact(self, name: str) -> List[str]:
+        """Return the entries of the public API exposing name, directly or not.
+
+        This includes name itself if it is an entry of the public API.
+        """
+        start = self.ids[name]
+        seen = {start}
+        todo = deque([start])
+        while todo:
+            for i in self._exposers(todo.popleft()):
+                if i not in seen:
+                    seen.add(i)
+                    todo.append(i)
+        return sorted(self.names[i] for i in seen if self.flags[i] & FLAG_ROOT)
+
+    def why(self, name: str) -> List[List[str]]:
+        """Return the shortest chains of references making name public.
+
+        There is one chain, from the entry to name, for each of the entries of
+        the public API closest to name.
+        """
+        start = self.ids[name]
+        # The next symbol towards name on a shortest chain.
+        towards = {start: start}
+        level = [start]
+        roots: List[int] = []
+        while level and not roots:
+            roots = [i for i in level if self.flags[i] & FLAG_ROOT]
+            next_level = []
+            for j in level:
+                for i in self._exposers(j):
+                    if i not in towards:
+                        towards[i] = j
+                        next_level.append(i)
+            level = next_level
+
+        chains = []
+        for i in roots:
+            chain = [self.names[i]]
+            while i != start:
+                i = towards[i]
+                chain.append(self.names[i])
+            chains.append(chain)
+        return sorted(chains)
+
+
+class _IndexBuilder:
+    """Accumulate symbols and references to build an ApiIndex."""
+
+    def __init__(self) -> None:
+        self.ids: Dict[str, int] = {}
+        self.names: List[str] = []
+        self.flags = bytearray()
+        self.sources = array("l")
+        self.targets = array("l")
+
+    def add(self, name: str, flags: int = 0) -> int:
+        i = self.ids.get(name)
+        if i is None:
+            i = self.ids[name] = len(self.names)
+            self.names.append(name)
+            self.flags.append(0)
+        self.flags[i] |= flags
+        return i
+
+    def link(self, source: int, target: int) -> None:
+        self.sources.append(source)
+        self.targets.append(target)
+
+    def build(self) -> ApiIndex:
+        # Group the sources by target (counting sort).
+        offsets = array("l", [0]) * (len(self.names) + 1)
+        for j in self.targets:
+            offsets[j + 1] += 1
+        for i in range(len(self.names)):
+            offsets[i + 1] += offsets[i]
+        fill = offsets[:-1]
+        exposers = array("l", [0]) * len(self.sources)
+        for i, j in zip(self.sources, self.targets):
+            exposers[fill[j]] = i
+            fill[j] += 1
+
+        # References may be given more than once, drop the duplicates.
+        unique_offsets, unique_exposers = array("l", [0]), array("l")
+        for start, end in zip(offsets, offsets[1:]):
+            unique_exposers.extend(dict.fromkeys(exposers[start:end]))
+            unique_offsets.append(len(unique_exposers))
+        return ApiIndex(self.names, self.flags, unique_offsets, unique_exposers)
+
+
+def main(args: List[str]) -> None:
+    """Run a query, eg. ``["--impact", "pkg.internal.Foo"]``."""
+    parser = argparse.ArgumentParser(
+        prog="doxxie", description="Query the public API index written by --api-index."
+    )
+    query = parser.add_mutually_exclusive_group(required=True)
+    query.add_argument(
+        "--impact",
+        metavar="NAME",
+        help="list the entries of the public API exposing the symbol NAME, "
+        "eg. pkg.internal.Foo",
+    )
+    query.add_argument(
+        "--why",
+        metavar="NAME",
+        help="show the shortest chains of references making the symbol NAME public",
+    )
+    parser.add_argument(
+        "--index",
+        metavar="PATH",
+        default=DEFAULT_API_INDEX,
+        help="public API index written by --api-index [default: %(default)s]",
+    )
+    ns = parser.parse_args(args)
+    name = ns.impact if ns.impact is not None else ns.why
+
+    try:
+        index = ApiIndex.load(ns.index)
+    except (OSError, ValueError) as e:
+        sys.exit(
+            "Cannot read the public API index %s (%s), generate it with "
+            "doxxie --public-api-only --api-index" % (ns.index, e)
+        )
+    if name not in index.ids:
+        sys.exit("%s is not part of the public API" % name)
+    if ns.impact is not None:
+        for entry in index.impact(name):
+            print(entry)
+    else:
+        for chain in index.why(name):
+            print(" -> ".join(chain))
@@ -0,0 +1,248 @@
+"""Resident doxxie process which keeps the analysis of a package in memory.
+
+Similar to ``dmypy``, the daemon listens on a local Unix socket and runs
+doxxie on behalf of its clients. The analyzed ASTs and the public API of the
+last run are kept in memory and reused for as long as the sources and the
+options stay the same, so repeated runs only pay for emitting the stubs.
+
+Usage::
+
+    $ doxxie --daemon start
+    $ doxxie --daemon run -- --public-api-only pkg --output public_api
+    $ doxxie --daemon stop
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+import time
+import traceback
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+from mypy.nodes import MypyFile
+from mypy.options import Options as MypyOptions
+
+from ._stubgen import DEFAULT_CACHE_DIR
+from ._stubgen import Options
+from ._stubgen import StubSource
+from ._stubgen import analyze_modules
+from ._stubgen import generate_stubs
+from ._stubgen import parse_options
+from ._stubgen import source_fingerprint
+
+
+DEFAULT_SOCKET = os.path.join(DEFAULT_CACHE_DIR, "daemon.sock")
+
+# Seconds to wait for a newly started daemon to accept connections.
+START_TIMEOUT = 10.0
+
+# Seconds to wait for a stopped daemon to remove its socket.
+STOP_TIMEOUT = 10.0
+
+
+class Daemon:
+    """Runs doxxie, reusing the analysis of the previous run when possible."""
+
+    def __init__(self) -> None:
+        self._fingerprint: Optional[str] = None
+        self._py_modules: List[StubSource] = []
+        self._files: Optional[Dict[str, MypyFile]] = None
+        self._public_api: Set[str] = set()
+
+    def analyze(
+        self, py_modules: List[StubSource], options: Options, mypy_opts: MypyOptions
+    ) -> Tuple[Optional[Dict[str, MypyFile]], Set[str]]:
+        fingerprint = source_fingerprint(py_modules, options)
+        if fingerprint == self._fingerprint:
+            if options.verbose:
+                print("Reusing the analysis of %d modules" % len(py_modules))
+            for mod, cached in zip(py_modules, self._py_modules):
+                mod.ast = cached.ast
+                mod.runtime_all = cached.runtime_all
+                mod.summary = cached.summary
+            return self._files, self._public_api
+
+        # Drop the previous analysis before building a new one.
+        self._fingerprint = None
+        self._py_modules, self._files, self._public_api = [], None, set()
+        files, public_api = analyze_modules(py_modules, options, mypy_opts)
+        self._fingerprint = fingerprint
+        self._py_modules, self._files, self._public_api = py_modules, files, public_api
+        return files, public_api
+
+    def run(self, args: List[str]) -> Tuple[int, str, str]:
+        """Run doxxie with the given command line arguments.
+
+        Return the exit status and the captured stdout and stderr.
+        """
+        out, err = io.StringIO(), io.StringIO()
+        status = 0
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            try:
+                options = parse_options(args)
+                # The point of the daemon is to be fast, so always make use of
+                # the analysis cache for the dependencies of the package.
+                options.incremental = True
+                generate_stubs(options, analyze=self.analyze)
+            except SystemExit as e:
+                if isinstance(e.code, int):
+                    status = e.code
+                elif e.code is not None:
+                    print(e.code, file=sys.stderr)
+                    status = 1
+            except Exception:
+                traceback.print_exc()
+                status = 2
+        return status, out.getvalue(), err.getvalue()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: "_Server"
+
+    def handle(self) -> None:
+        request = json.loads(self.rfile.read().decode("utf-8"))
+        response: Dict[str, Any]
+        if request["command"] == "run":
+            os.chdir(request["cwd"])
+            status, out, err = self.server.daemon.run(request["args"])
+            response = {"status": status, "out": out, "err": err}
+        elif request["command"] == "stop":
+            self.server.stopping = True
+            response = {"status": 0, "out": "", "err": ""}
+        else:
+            response = {"status": 2, "out": "", "err": "unknown command\n"}
+        self.wfile.write(json.dumps(response).encode("utf-8"))
+
+
+class _Server(socketserver.UnixStreamServer):
+    def __init__(self, path: str) -> None:
+        super().__init__(path, _Handler)
+        self.daemon = Daemon()
+        self.stopping = False
+
+
+def serve(path: str) -> None:
+    """Serve requests on the Unix socket at path until stopped."""
+    path = os.path.abspath(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        os.unlink(path)
+    # Make sure that the current directory of each request is in sys.path so
+    # that packages in it can be found, just like the doxxie command does.
+    if "" not in sys.path:
+        sys.path.insert(0, "")
+    with _Server(path) as server:
+        try:
+            while not server.stopping:
+                server.handle_request()
+        finally:
+            os.unlink(path)
+
+
+def request(path: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """Send a request to the daemon listening at path and return the response."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(json.dumps(data).encode("utf-8"))
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    response: Dict[str, Any] = json.loads(b"".join(chunks).decode("utf-8"))
+    return response
+
+
+def is_running(path: str) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except OSError:
+            return False
+    return True
+
+
+def start(path: str) -> None:
+    """Start a daemon in the background and wait for it to accept requests."""
+    subprocess.Popen(
+        [sys.executable, "-m", "doxxie._daemon", "--socket", path, "serve"],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    deadline = time.time() + START_TIMEOUT
+    while not is_running(path):
+        if time.time() > deadline:
+            sys.exit("doxxie daemon failed to start")
+        time.sleep(0.05)
+
+
+def stop(path: str) -> None:
+    """Stop the daemon listening at path and wait for it to remove its socket."""
+    request(path, {"command": "stop"})
+    deadline = time.time() + STOP_TIMEOUT
+    while os.path.exists(path):
+        if time.time() > deadline:
+            sys.exit("doxxie daemon failed to stop")
+        time.sleep(0.05)
+
+
+def main(args: List[str]) -> None:
+    parser = argparse.ArgumentParser(prog="doxxie --daemon")
+    parser.add_argument(
+        "--socket",
+        metavar="PATH",
+        default=DEFAULT_SOCKET,
+        help="Unix socket of the daemon [default: %(default)s]",
+    )
+    sub = parser.add_subparsers(dest="command", metavar="command")
+    sub.required = True
+    sub.add_parser("start", help="start a daemon in the background")
+    sub.add_parser("stop", help="stop the running daemon")
+    sub.add_parser("serve", help="run a daemon in the foreground")
+    run = sub.add_parser("run", help="run doxxie in the daemon, starting one if needed")
+    run.add_argument("args", nargs=argparse.REMAINDER, help="doxxie arguments")
+    ns = parser.parse_args(args)
+
+    if not hasattr(socket, "AF_UNIX"):
+        sys.exit("doxxie daemon is not supported on this platform")
+
+    path = os.path.abspath(ns.socket)
+    if ns.command == "serve":
+        serve(path)
+    elif ns.command == "start":
+        if is_running(path):
+            sys.exit("doxxie daemon is already running")
+        start(path)
+    elif ns.command == "stop":
+        if not is_running(path):
+            sys.exit("doxxie daemon is not running")
+        stop(path)
+    elif ns.command == "run":
+        if not is_running(path):
+            start(path)
+        doxxie_args = ns.args[1:] if ns.args[:1] == ["--"] else ns.args
+        response = request(
+            path, {"command": "run", "args": doxxie_args, "cwd": os.getcwd()}
+        )
+        sys.stdout.write(response["out"])
+        sys.stderr.write(response["err"])
+        sys.exit(response["status"])
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
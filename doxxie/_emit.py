@@ -0,0 +1,127 @@
+"""Stub emission split across forked worker processes (see ``--jobs``).
+
+Once the package is analyzed, rendering the stub of a module only reads the
+analyzed trees, the public API and the symbol tables. The workers are forked
+after the analysis and inherit all of these through copy-on-write memory
+instead of having them pickled: only module names are sent to the workers and
+only stubs are sent back.
+"""
+
+import multiprocessing
+import pickle
+import traceback
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from ._lookup import LookupCache
+from ._stubgen import Options
+from ._stubgen import PublicAPIIndex
+from ._stubgen import StubSource
+from ._stubgen import render_stub_from_ast
+
+
+# The stub of a module or the exception raised while rendering it.
+Rendered = Tuple[Optional[str], Optional[BaseException]]
+
+# What the forked workers inherit from the parent process.
+_Emission = Tuple[Dict[str, StubSource], Options, Optional[PublicAPIIndex], LookupCache]
+_emission: Optional[_Emission] = None
+
+
+def picklable(e: BaseException) -> BaseException:
+    """Return e, or a description of it if it can't be sent to another process."""
+    try:
+        pickle.dumps(e)
+    except Exception:
+        return RuntimeError("".join(traceback.format_exception_only(type(e), e)))
+    return e
+
+
+def deferred(rendered: Rendered) -> Callable[[], Optional[str]]:
+    """Return a function returning the stub or raising the error of rendered."""
+
+    def result() -> Optional[str]:
+        text, error = rendered
+        if error is not None:
+            raise error
+        return text
+
+    return result
+
+
+def can_fork() -> bool:
+    return "fork" in multiprocessing.get_all_start_methods()
+
+
+def _render(modules: List[str]) -> Tuple[Dict[str, Rendered], int, int]:
+    """Render the stubs of modules in a worker, along with the lookups done."""
+    assert _emission is not None, "Workers must be forked by render_forked"
+    mods, options, public_api, lookup = _emission
+    hits, misses = lookup.hits, lookup.misses
+    results: Dict[str, Rendered] = {}
+    for module in modules:
+        try:
+            text = render_stub_from_ast(
+                mods[module],
+                options.parse_only,
+                options.pyversion,
+                options.include_private,
+                options.export_less,
+                options.public_api_only,
+                public_api,
+                lookup,
+            )
+            results[module] = (text, None)
+        except Exception as e:
+            results[module] = (None, picklable(e))
+    return results, lookup.hits - hits, lookup.misses - misses
+
+
+def render_forked(
+    py_modules: List[StubSource],
+    options: Options,
+    public_api: Optional[PublicAPIIndex],
+    lookup: LookupCache,
+) -> Dict[str, Callable[[], Optional[str]]]:
+    """Render the stubs of the analyzed py_modules in options.jobs forked processes.
+
+    Return a function per module returning its stub (None if there is nothing
+    to stub) or raising the error encountered while rendering it. Modules which
+    weren't analyzed are left out. The lookups done by the workers are added to
+    the counters of lookup.
+
+    The workers need to inherit the analysis, which can't be pickled: where
+    processes can't be forked, the stubs are rendered in this process instead.
+    """
+    global _emission
+    mods = {mod.module: mod for mod in py_modules if mod.ast is not None}
+    modules = list(mods)
+    # A few chunks per worker balance the load while keeping the modules of
+    # a package, which tend to look up the same symbols, together.
+    size = max(1, len(modules) // (options.jobs * 4))
+    chunks = []
+    for start in range(0, len(modules), size):
+        end = start + size
+        chunks.append(modules[start:end])
+
+    results: Dict[str, Callable[[], Optional[str]]] = {}
+    _emission = (mods, options, public_api, lookup)
+    try:
+        if not can_fork():
+            # lookup counts the lookups done in this process itself.
+            rendered, _, _ = _render(modules)
+            for module, result in rendered.items():
+                results[module] = deferred(result)
+            return results
+        with multiprocessing.get_context("fork").Pool(options.jobs) as pool:
+            for rendered, hits, misses in pool.imap_unordered(_render, chunks):
+                for module, result in rendered.items():
+                    results[module] = deferred(result)
+                lookup.hits += hits
+                lookup.misses += misses
+    finally:
+        _emission = None
+    return results
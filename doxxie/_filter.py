@@ -0,0 +1,93 @@
+"""Matching of dotted names against include and exclude rules."""
+
+import re
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+
+
+# Marks the end of a prefix rule in the trie (can't be a name component).
+_END = "."
+
+
+def _glob_to_regex(glob: str) -> str:
+    """Translate a glob over dotted names to a regular expression.
+
+    ``*`` matches within a component, ``**`` matches any number of components.
+
+    >>> _glob_to_regex("pkg.*.tests")
+    'pkg\\\\.[^.]*\\\\.tests'
+    >>> _glob_to_regex("**.tests")
+    '(?:[^.]+\\\\.)*tests'
+    """
+    parts = glob.split(".")
+    regex = []
+    for i, part in enumerate(parts):
+        last = i == len(parts) - 1
+        if part == "**":
+            regex.append(".*" if last else r"(?:[^.]+\.)*")
+        else:
+            regex.append(re.escape(part).replace(r"\*", "[^.]*"))
+            if not last:
+                regex.append(r"\.")
+    return "".join(regex)
+
+
+class ModuleFilter:
+    """A set of rules matching dotted module and symbol names.
+
+    A rule matches a name if it matches the name itself or one of its parents.
+    Rules are either dotted prefixes, which are compiled into a trie of name
+    components, or globs (see _glob_to_regex), which are compiled into a single
+    regular expression. Prefixes are matched in time proportional to the
+    length of the name, regardless of their number. Globs are tried as one
+    alternation though, whose cost also grows with the number of globs.
+
+    >>> f = ModuleFilter(["pkg.internal", "pkg.*.tests"])
+    >>> "pkg.internal" in f, "pkg.internal.mod.Class" in f
+    (True, True)
+    >>> "pkg" in f, "pkg.internalx" in f, "pkg.other" in f
+    (False, False, False)
+    >>> "pkg.sub.tests" in f, "pkg.sub.tests.x" in f, "pkg.sub.testsx" in f
+    (True, True, False)
+    >>> "anything" in ModuleFilter([])
+    False
+    """
+
+    def __init__(self, rules: Iterable[str]) -> None:
+        self._rules: List[str] = []
+        self._trie: Dict[str, Any] = {}
+        globs = []
+        for rule in rules:
+            if not rule:
+                continue
+            self._rules.append(rule)
+            if "*" in rule:
+                globs.append(_glob_to_regex(rule))
+                continue
+            node = self._trie
+            for part in rule.split("."):
+                node = node.setdefault(part, {})
+            node[_END] = True
+        self._globs: Optional["re.Pattern[str]"] = None
+        if globs:
+            self._globs = re.compile(r"(?:%s)(?:\.|$)" % "|".join(globs))
+
+    def __contains__(self, name: str) -> bool:
+        node = self._trie
+        for part in name.split("."):
+            child = node.get(part)
+            if child is None:
+                break
+            if _END in child:
+                return True
+            node = child
+        return self._globs is not None and self._globs.match(name) is not None
+
+    def __bool__(self) -> bool:
+        return bool(self._rules)
+
+    def __repr__(self) -> str:
+        return "ModuleFilter(%r)" % self._rules
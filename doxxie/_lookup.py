@@ -0,0 +1,70 @@
+"""Memoized lookup of symbols by their full names."""
+
+from typing import Dict
+from typing import Mapping
+from typing import Optional
+
+from mypy.nodes import MypyFile
+from mypy.nodes import SymbolTableNode
+from mypy.nodes import TypeInfo
+
+
+_MISSING = object()
+
+
+class LookupCache:
+    """Memoized equivalent of mypy.lookup.lookup_fully_qualified.
+
+    The symbol tables must not change while the cache is in use, so one is
+    meant to be created per run, once the modules are analyzed. A name is
+    resolved from the cached lookup of its parent, which makes the members of
+    the same class cheap to look up. Hits and misses are counted.
+
+    >>> from mypy.nodes import Block, ClassDef, GDEF, MDEF, SymbolTable, Var
+    >>> cls = ClassDef("C", Block([]))
+    >>> cls.fullname = "pkg.C"
+    >>> info = TypeInfo(SymbolTable({"x": SymbolTableNode(MDEF, Var("x"))}), cls, "pkg")
+    >>> mod = MypyFile([], [])
+    >>> mod.names = SymbolTable({"C": SymbolTableNode(GDEF, info)})
+    >>> lookup = LookupCache({"pkg": mod})
+    >>> lookup("pkg.C.x").node.name, lookup("pkg.C.y"), lookup("pkg"), lookup("other.D")
+    ('x', None, None, None)
+    >>> lookup("pkg.C.x").node.name
+    'x'
+    >>> lookup
+    LookupCache(6 names, 2 hits, 6 misses)
+    """
+
+    def __init__(self, modules: Mapping[str, MypyFile]) -> None:
+        self.modules = modules
+        self.hits = 0
+        self.misses = 0
+        self._cache: Dict[str, Optional[SymbolTableNode]] = {}
+
+    def __call__(self, fullname: str) -> Optional[SymbolTableNode]:
+        cached = self._cache.get(fullname, _MISSING)
+        if cached is not _MISSING:
+            self.hits += 1
+            return cached  # type: ignore[return-value]
+        self.misses += 1
+        parent, _, name = fullname.rpartition(".")
+        node: Optional[SymbolTableNode] = None
+        if parent:
+            # Like mypy, look for the longest module prefix first and then
+            # for nested classes.
+            module = self.modules.get(parent)
+            if module is not None:
+                node = module.names.get(name)
+            else:
+                owner = self(parent)
+                if owner is not None and isinstance(owner.node, TypeInfo):
+                    node = owner.node.names.get(name)
+        self._cache[fullname] = node
+        return node
+
+    def __repr__(self) -> str:
+        return "LookupCache(%d names, %d hits, %d misses)" % (
+            len(self._cache),
+            self.hits,
+            self.misses,
+        )
@@ -0,0 +1,309 @@
+"""Semantic analysis split across worker processes (see ``--sharded``).
+
+The import graph of the package is split into its strongly connected
+components, which are grouped into one shard per worker. A worker analyzes the
+modules of its shard together with everything they import from the package,
+finds their part of the public API and, once the parts of all the workers have
+been merged, renders their stubs.
+
+Since a module is always analyzed along with all of its dependencies, its
+analysis, its part of the public API and its stub are the same as in a single
+build of the whole package. The flip side is that the dependencies shared by
+several shards are analyzed by each of their workers: the CPU time spent grows
+with the overlap of the dependency closures of the shards, and sharding only
+shortens a run when they are small compared to the package.
+"""
+
+import ast
+import contextlib
+import io
+import multiprocessing
+from multiprocessing.connection import Connection
+import os
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+from mypy.options import Options as MypyOptions
+from mypy.util import correct_relative_import
+
+from ._emit import Rendered
+from ._emit import deferred
+from ._emit import picklable
+from ._lookup import LookupCache
+from ._stubgen import Options
+from ._stubgen import PublicAPIIndex
+from ._stubgen import StubSource
+from ._stubgen import build_public_api_graph
+from ._stubgen import generate_asts_for_modules
+from ._stubgen import render_stub_from_ast
+from ._stubgen import write_api_index
+from ._symgraph import SymbolGraph
+
+
+def find_imports(mod: StubSource, modules: Set[str]) -> Set[str]:
+    """Return the modules among modules which mod may depend on.
+
+    Parent packages count as dependencies. Imports are found syntactically, so
+    conditional imports are included. If the module can't be parsed, it is
+    assumed to depend on every module.
+    """
+    deps: Set[str] = set()
+    parts = mod.module.split(".")
+    for i in range(1, len(parts)):
+        deps.add(".".join(parts[:i]))
+    if mod.path is None:
+        return deps & modules
+    is_package = mod.path.endswith("__init__.py")
+    try:
+        with open(mod.path, "rb") as f:
+            tree = ast.parse(f.read(), mod.path)
+    except (SyntaxError, ValueError):
+        return set(modules)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                deps.add(alias.name)
+        elif isinstance(node, ast.ImportFrom):
+            base, ok = correct_relative_import(
+                mod.module, node.level, node.module or "", is_package
+            )
+            deps.add(base)
+            for alias in node.names:
+                deps.add("%s.%s" % (base, alias.name))
+    # Importing a module also imports its parents.
+    for dep in list(deps):
+        parts = dep.split(".")
+        for i in range(1, len(parts)):
+            deps.add(".".join(parts[:i]))
+    deps.discard(mod.module)
+    return deps & modules
+
+
+def strongly_connected_components(graph: Dict[str, Set[str]]) -> List[Set[str]]:
+    """Return the strongly connected components of graph.
+
+    Components come after the ones they depend on.
+
+    >>> graph = {"a": {"b"}, "b": {"a", "c"}, "c": set(), "d": {"c"}}
+    >>> [sorted(scc) for scc in strongly_connected_components(graph)]
+    [['c'], ['a', 'b'], ['d']]
+    """
+    # Iterative version of Tarjan's algorithm.
+    index: Dict[str, int] = {}
+    lowlink: Dict[str, int] = {}
+    stack: List[str] = []
+    on_stack: Set[str] = set()
+    sccs: List[Set[str]] = []
+    for root in sorted(graph):
+        if root in index:
+            continue
+        work = [(root, iter(sorted(graph[root])))]
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, deps = work[-1]
+            for dep in deps:
+                if dep not in index:
+                    index[dep] = lowlink[dep] = len(index)
+                    stack.append(dep)
+                    on_stack.add(dep)
+                    work.append((dep, iter(sorted(graph[dep]))))
+                    break
+                elif dep in on_stack:
+                    lowlink[node] = min(lowlink[node], index[dep])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    scc: Set[str] = set()
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        scc.add(member)
+                        if member == node:
+                            break
+                    sccs.append(scc)
+    return sccs
+
+
+def dependency_closure(modules: Iterable[str], graph: Dict[str, Set[str]]) -> Set[str]:
+    """Return modules and everything they depend on, directly or not.
+
+    >>> sorted(dependency_closure(["d"], {"a": {"b"}, "b": set(), "d": {"a"}}))
+    ['a', 'b', 'd']
+    """
+    closure = set(modules)
+    todo = list(closure)
+    while todo:
+        for dep in graph[todo.pop()]:
+            if dep not in closure:
+                closure.add(dep)
+                todo.append(dep)
+    return closure
+
+
+def make_shards(
+    graph: Dict[str, Set[str]], sizes: Dict[str, int], count: int
+) -> List[Set[str]]:
+    """Group the modules of graph into at most count shards.
+
+    A strongly connected component is never split. Components are assigned
+    one at a time, largest closure first, to the shard whose analysis (the
+    total size of its dependency closure) stays the smallest.
+
+    >>> graph = {"a": set(), "b": {"a"}, "c": {"a"}, "d": set()}
+    >>> sizes = {"a": 10, "b": 1, "c": 1, "d": 1}
+    >>> [sorted(shard) for shard in make_shards(graph, sizes, 2)]
+    [['a', 'b', 'd'], ['c']]
+    """
+    closures = [
+        (scc, dependency_closure(scc, graph))
+        for scc in strongly_connected_components(graph)
+    ]
+    closures.sort(key=lambda c: -sum(sizes[m] for m in c[1]))
+    shards: List[Set[str]] = [set() for _ in range(count)]
+    shard_closures: List[Set[str]] = [set() for _ in range(count)]
+    for scc, closure in closures:
+
+        def cost(i: int) -> int:
+            return sum(sizes[m] for m in shard_closures[i] | closure)
+
+        best = min(range(count), key=cost)
+        shards[best] |= scc
+        shard_closures[best] |= closure
+    return [shard for shard in shards if shard]
+
+
+def _work(
+    conn: Connection,
+    py_modules: List[StubSource],
+    owned: Set[str],
+    options: Options,
+    mypy_opts: MypyOptions,
+    package_modules: List[str],
+) -> None:
+    """Analyze a shard, send the graph of its part of the public API and then its stubs."""
+    mods = [mod for mod in py_modules if mod.module in owned]
+    out = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(out):
+            files = generate_asts_for_modules(
+                py_modules, False, mypy_opts, False, options.prune_bodies
+            )
+            fragment = SymbolGraph()
+            if options.public_api_only:
+                fragment = build_public_api_graph(
+                    mods, options.public_api_excludes, files, modules=package_modules
+                )
+    except BaseException as e:
+        conn.send((SymbolGraph(), out.getvalue(), picklable(e)))
+        return
+    conn.send((fragment, out.getvalue(), None))
+
+    public_api = PublicAPIIndex(conn.recv(), package_modules)
+    lookup = LookupCache(files or {})
+    results: Dict[str, Rendered] = {}
+    for mod in mods:
+        try:
+            text = render_stub_from_ast(
+                mod,
+                False,
+                options.pyversion,
+                options.include_private,
+                options.export_less,
+                options.public_api_only,
+                public_api,
+                lookup,
+            )
+            results[mod.module] = (text, None)
+        except Exception as e:
+            results[mod.module] = (None, picklable(e))
+    conn.send(results)
+
+
+def render_sharded(
+    py_modules: List[StubSource], options: Options, mypy_opts: MypyOptions
+) -> Dict[str, Callable[[], Optional[str]]]:
+    """Analyze and render the stubs of py_modules in options.jobs processes.
+
+    Return a function per module returning its stub (None if there is nothing
+    to stub) or raising the error encountered while rendering it.
+    """
+    names = {mod.module for mod in py_modules}
+    graph = {mod.module: find_imports(mod, names) for mod in py_modules}
+    sizes = {
+        mod.module: os.path.getsize(mod.path) if mod.path else 0 for mod in py_modules
+    }
+    shards = make_shards(graph, sizes, options.jobs)
+    if options.verbose:
+        print(
+            "Analyzing %d modules in %d shards of %s modules"
+            % (
+                len(py_modules),
+                len(shards),
+                "/".join(str(len(dependency_closure(s, graph))) for s in shards),
+            )
+        )
+
+    package_modules = [mod.module for mod in py_modules]
+    workers: List[Tuple[multiprocessing.Process, Connection]] = []
+    try:
+        for shard in shards:
+            closure = dependency_closure(shard, graph)
+            conn, child_conn = multiprocessing.Pipe()
+            proc = multiprocessing.Process(
+                target=_work,
+                args=(
+                    child_conn,
+                    [mod for mod in py_modules if mod.module in closure],
+                    shard,
+                    options,
+                    mypy_opts,
+                    package_modules,
+                ),
+                daemon=True,
+            )
+            proc.start()
+            child_conn.close()
+            workers.append((proc, conn))
+
+        # Merge the parts of the public API and forward the whole of it to
+        # the workers so that they can render their stubs.
+        public_api: Set[str] = set()
+        fragments: List[SymbolGraph] = []
+        seen: Set[str] = set()
+        for _, conn in workers:
+            fragment, output, error = conn.recv()
+            for line in output.splitlines(True):
+                if line not in seen:
+                    seen.add(line)
+                    print(line, end="")
+            if error is not None:
+                raise error
+            public_api.update(fragment.names)
+            fragments.append(fragment)
+        write_api_index(options, fragments)
+        for _, conn in workers:
+            conn.send(public_api)
+
+        results: Dict[str, Callable[[], Optional[str]]] = {}
+        for _, conn in workers:
+            for module, rendered in conn.recv().items():
+                results[module] = deferred(rendered)
+        return results
+    except EOFError as e:
+        raise SystemExit("Critical error during semantic analysis: worker died") from e
+    finally:
+        for proc, conn in workers:
+            conn.close()
+            proc.join(1)
+            if proc.is_alive():
+                proc.terminate()
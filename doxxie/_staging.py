@@ -0,0 +1,204 @@
+"""Output directory updated all at once at the end of a run.
+
+The stubs of a run are written to a staging copy of the output directory,
+created next to it, which replaces the output directory with two renames once
+all the stubs are written. A run which fails or is interrupted leaves the
+output directory as it was, and readers see either all of the previous stubs
+or all of the new ones. The swap isn't atomic though: there is no portable way
+to exchange two directories, so the output directory is missing between the
+two renames.
+
+The files of the staging copy are hard links to the ones of the output
+directory (or copies where links aren't supported), so staging costs a link
+per file rather than a copy of the stubs. Unchanged stubs keep their
+modification time, but stubs must be replaced (eg. with os.replace) rather
+than written in place.
+
+The staging copies are named after the output directory and the process
+writing them, so that the ones left behind by a run which was killed or
+crashed are removed by the next one (see sweep_stale_staging).
+"""
+
+import contextlib
+import os
+import shutil
+import tempfile
+import time
+from types import TracebackType
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Type
+
+
+# Age in seconds after which a staging copy is removed even though the process
+# which created it seems to be running (its id may have been reused).
+STALE_STAGING_AGE = 24 * 60 * 60
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def can_stage(output_dir: str) -> bool:
+    """Can output_dir be replaced by renames?
+
+    Not if it's a symbolic link or a mount point, or if it contains the
+    current directory, which would be left in the replaced directory.
+    """
+    output_dir = os.path.abspath(output_dir)
+    if os.path.islink(output_dir) or os.path.ismount(output_dir):
+        return False
+    cwd = os.getcwd()
+    return os.path.commonpath([output_dir, cwd]) != output_dir
+
+
+def _staging_prefix(output_dir: str) -> Tuple[str, str]:
+    """Return where the staging copies of output_dir are and their name prefix."""
+    parent, name = os.path.split(os.path.abspath(output_dir))
+    return parent, ".%s.staging-" % name
+
+
+def _is_running(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    if os.name != "posix":
+        # There is no harmless way to check, rely on the age of the copy.
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def sweep_stale_staging(output_dir: str) -> List[str]:
+    """Remove the staging copies of output_dir left behind by other runs.
+
+    A copy is stale if the process which created it isn't running anymore or
+    if it is older than STALE_STAGING_AGE. If the run was interrupted between
+    the two renames of the swap, the previous output directory is moved back
+    first (unless the output directory was written to since). Return the
+    removed copies.
+    """
+    parent, prefix = _staging_prefix(output_dir)
+    try:
+        entries = os.listdir(parent)
+    except OSError:
+        return []
+    removed = []
+    for entry in sorted(entries):
+        if not entry.startswith(prefix):
+            continue
+        pid, sep, _ = entry.partition(prefix)[2].partition("-")
+        if not sep or not pid.isdigit():
+            continue
+        path = os.path.join(parent, entry)
+        try:
+            age = time.time() - os.stat(path).st_mtime
+        except OSError:
+            continue
+        if age < STALE_STAGING_AGE and _is_running(int(pid)):
+            continue
+        previous = os.path.join(path, "previous")
+        if os.path.isdir(previous):
+            # The output directory may have been created again, empty.
+            with contextlib.suppress(OSError):
+                os.rmdir(output_dir)
+            if not os.path.lexists(output_dir):
+                os.rename(previous, output_dir)
+        shutil.rmtree(path, ignore_errors=True)
+        removed.append(path)
+    return removed
+
+
+class StagedOutput:
+    """Context manager staging the changes to an output directory.
+
+    Files are written to path(target) for a target in the output directory.
+    If stage is False or the output directory can't be staged (see
+    can_stage), this is target itself and the files are updated one by one.
+    Stale staging copies of the output directory are removed before staging
+    (see sweep_stale_staging).
+
+    >>> import tempfile
+    >>> parent = tempfile.mkdtemp()
+    >>> out = os.path.join(parent, "out")
+    >>> os.mkdir(out)
+    >>> with StagedOutput(out) as output:
+    ...     with open(output.path(os.path.join(out, "a.pyi")), "w") as f:
+    ...         _ = f.write("x: int")
+    ...     os.listdir(out)
+    []
+    >>> os.listdir(out), sorted(os.listdir(parent))
+    (['a.pyi'], ['out'])
+    >>> shutil.rmtree(parent)
+    """
+
+    def __init__(self, output_dir: str, stage: bool = True) -> None:
+        self.output_dir = output_dir
+        self.stage = stage
+        # Temporary directory holding the staging copy, next to output_dir.
+        self._tmp: Optional[str] = None
+        self.staging_dir: Optional[str] = None
+
+    def __enter__(self) -> "StagedOutput":
+        if not self.stage or not can_stage(self.output_dir):
+            return self
+        sweep_stale_staging(self.output_dir)
+        parent, prefix = _staging_prefix(self.output_dir)
+        try:
+            self._tmp = tempfile.mkdtemp(
+                prefix="%s%d-" % (prefix, os.getpid()), dir=parent
+            )
+            staging_dir = os.path.join(self._tmp, os.path.basename(self.output_dir))
+            shutil.copytree(
+                self.output_dir, staging_dir, symlinks=True, copy_function=_link_or_copy
+            )
+        except OSError:
+            # Eg. the parent directory is read-only.
+            self._discard()
+            return self
+        self.staging_dir = staging_dir
+        return self
+
+    def path(self, target: str) -> str:
+        """Return where to write target, a path in the output directory."""
+        if self.staging_dir is None:
+            return target
+        return os.path.join(self.staging_dir, os.path.relpath(target, self.output_dir))
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        if self._tmp is None:
+            return
+        try:
+            if exc_type is None:
+                self._swap()
+        finally:
+            self._discard()
+
+    def _swap(self) -> None:
+        # The output directory is missing between the two renames.
+        assert self._tmp is not None and self.staging_dir is not None
+        previous = os.path.join(self._tmp, "previous")
+        os.rename(self.output_dir, previous)
+        try:
+            os.rename(self.staging_dir, self.output_dir)
+        except OSError:
+            os.rename(previous, self.output_dir)
+            raise
+
+    def _discard(self) -> None:
+        if self._tmp is not None:
+            shutil.rmtree(self._tmp, ignore_errors=True)
+        self._tmp = self.staging_dir = None
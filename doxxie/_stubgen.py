@@ -80,16 +80,26 @@ TODO:
  - we don't seem to always detect properties ('closed' in 'io', for example)
 """
 
+import difflib
 import glob
+import hashlib
+import json
 import os
 import os.path
+import queue
+import re
 import sys
+import tempfile
+import time
 import traceback
 import argparse
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import Process, Queue
 
 from typing import (
-    List, Dict, Tuple, Iterable, Mapping, Optional, Set, Sequence, cast,
+    Any, List, Dict, Tuple, Iterable, Iterator, Mapping, Optional, Set, Sequence, Callable, Union,
+    cast, Hashable,
 )
 from typing_extensions import Final
 
@@ -98,7 +108,9 @@ import mypy.parse
 import mypy.errors
 import mypy.traverser
 import mypy.mixedtraverser
+import mypy.typetraverser
 import mypy.util
+import mypy.version
 from mypy import defaults
 from mypy.modulefinder import (
     ModuleNotFoundReason, FindModuleCache, SearchPaths, BuildSource, default_lib_path
@@ -108,27 +120,35 @@ from mypy.nodes import (
     TupleExpr, ListExpr, ComparisonExpr, CallExpr, IndexExpr, EllipsisExpr,
     ClassDef, MypyFile, Decorator, AssignmentStmt, TypeInfo, Node, SymbolTableNode,
     IfStmt, ImportAll, ImportFrom, Import, FuncDef, FuncBase, TempNode, Block, Var,
-    Statement, OverloadedFuncDef, ARG_POS, ARG_STAR, ARG_STAR2, ARG_NAMED, ARG_NAMED_OPT
+    Statement, OverloadedFuncDef, ReturnStmt, PassStmt, RefExpr, SymbolNode,
+    ARG_POS, ARG_STAR, ARG_STAR2, ARG_NAMED, ARG_NAMED_OPT
 )
 from mypy.stubgenc import generate_stub_for_c_module
 from mypy.stubutil import (
     default_py2_interpreter, CantImport, generate_guarded,
-    walk_packages, find_module_path_and_all_py2, find_module_path_and_all_py3,
+    find_module_path_and_all_py2, find_module_path_using_sys_path, NOT_IMPORTABLE_MODULES,
     report_missing, fail_missing, remove_misplaced_type_comments, common_dir_prefix
 )
 from mypy.stubdoc import parse_all_signatures, find_unique_signatures, Sig
 from mypy.options import Options as MypyOptions
+from mypy.plugin import Plugin
 from mypy.types import (
     Type, TypeStrVisitor, CallableType, UnboundType, NoneType, TupleType, TypeList, Instance,
-    AnyType, UnionType
+    AnyType, UnionType, TypeOfAny, TypeVarType
 )
 from mypy.visitor import NodeVisitor
 from mypy.find_sources import create_source_list, InvalidSourceList
 from mypy.build import build
 from mypy.errors import CompileError, Errors
 from mypy.traverser import has_return_statement
-from mypy.moduleinspect import ModuleInspect
-from mypy.lookup import lookup_fully_qualified
+from mypy.moduleinspect import InspectError, ModuleProperties, get_package_properties
+
+from doxxie._apiindex import DEFAULT_API_INDEX, ApiIndex
+from doxxie._filter import ModuleFilter
+from doxxie._lookup import LookupCache
+from doxxie._staging import StagedOutput
+from doxxie._symgraph import FLAG_ROOT, SymbolGraph
+from doxxie._typerefs import TypeInfoCollector
 
 
 # Common ways of naming package containing vendored modules.
@@ -149,6 +169,8 @@ BLACKLIST = [
     '/_vendored_packages/',
 ]  # type: Final
 
+BLACKLIST_RE = re.compile('|'.join(map(re.escape, BLACKLIST)))  # type: Final
+
 # Special-cased names that are implicitly exported from the stub (from m import y as y).
 EXTRA_EXPORTED = {
     'pyasn1_modules.rfc2437.univ',
@@ -187,6 +209,27 @@ METHODS_WITH_RETURN_VALUE = {
     '__iter__',
 }  # type: Final
 
+# Default location of the doxxie cache (see --incremental).
+DEFAULT_CACHE_DIR = '.doxxie_cache'  # type: Final
+
+# Default number of differing stubs shown by --check.
+DEFAULT_CHECK_DIFFS = 5  # type: Final
+
+# Options that have no influence on the generated stubs.
+NON_OUTPUT_OPTIONS = {
+    'verbose',
+    'quiet',
+    'incremental',
+    'cache_dir',
+    'skip_unchanged',
+    'jobs',
+    'sharded',
+    'import_timeout',
+    'check',
+    'check_diffs',
+    'fail_fast',
+}  # type: Final
+
 
 class Options:
     """Represents stubgen options.
@@ -210,7 +253,19 @@ class Options:
                  quiet: bool,
                  export_less: bool,
                  public_api_only: bool,
-                 public_api_excludes: List[str]) -> None:
+                 public_api_excludes: List[str],
+                 incremental: bool = False,
+                 cache_dir: str = DEFAULT_CACHE_DIR,
+                 skip_unchanged: bool = False,
+                 prune_bodies: bool = False,
+                 lazy: bool = False,
+                 jobs: int = 1,
+                 sharded: bool = False,
+                 import_timeout: Optional[float] = None,
+                 api_index: Optional[str] = None,
+                 check: bool = False,
+                 check_diffs: int = DEFAULT_CHECK_DIFFS,
+                 fail_fast: bool = False) -> None:
         # See parse_options for descriptions of the flags.
         self.pyversion = pyversion
         self.no_import = no_import
@@ -230,6 +285,18 @@ class Options:
         self.export_less = export_less
         self.public_api_only = public_api_only
         self.public_api_excludes = public_api_excludes
+        self.incremental = incremental
+        self.cache_dir = cache_dir
+        self.skip_unchanged = skip_unchanged
+        self.prune_bodies = prune_bodies
+        self.lazy = lazy
+        self.jobs = jobs
+        self.sharded = sharded
+        self.import_timeout = import_timeout
+        self.api_index = api_index
+        self.check = check
+        self.check_diffs = check_diffs
+        self.fail_fast = fail_fast
         if self.public_api_only:
             self.export_less = True
 
@@ -245,6 +312,10 @@ class StubSource:
         self.source = BuildSource(path, module, None)
         self.runtime_all = runtime_all
         self.ast = None  # type: Optional[MypyFile]
+        # Names referenced in function bodies removed before semantic analysis.
+        self.pruned_refs = set()  # type: Set[str]
+        # Summary of the AST, cached for later renderings (see ModuleSummary).
+        self.summary = None  # type: Optional[ModuleSummary]
 
     @property
     def module(self) -> str:
@@ -288,15 +359,21 @@ class AnnotationPrinter(TypeStrVisitor):
     def __init__(self, stubgen: 'StubGenerator') -> None:
         super().__init__()
         self.stubgen = stubgen
+        # Names required by the printed annotation, in order
+        self.required_names = []  # type: List[str]
+
+    def require_name(self, name: str) -> None:
+        self.required_names.append(name)
+        self.stubgen.import_tracker.require_name(name)
 
     def visit_any(self, t: AnyType) -> str:
         s = super().visit_any(t)
-        self.stubgen.import_tracker.require_name(s)
+        self.require_name(s)
         return s
 
     def visit_unbound_type(self, t: UnboundType) -> str:
         s = t.name
-        self.stubgen.import_tracker.require_name(s)
+        self.require_name(s)
         if t.args:
             s += '[{}]'.format(self.list_str(t.args))
         return s
@@ -493,65 +570,236 @@ def _get_types(typ: Type) -> Sequence[Type]:
     return [typ]
 
 
-def find_public_api(mods, excludes, files) -> Set[str]:
+def annotation_key(t: Type) -> Optional[Hashable]:
+    """Return a key of a type which only equals the keys of types printed the same.
+
+    This covers the types making up most annotations (unbound types, instances,
+    unions, ...), None is returned for the others. Unlike the equality of mypy
+    types, the key tells apart type variables of different names and erased
+    instances, for instance.
+    """
+    if isinstance(t, UnboundType):
+        args = _annotation_keys(t.args)
+        return None if args is None else ('U', t.name, args)
+    elif isinstance(t, Instance):
+        if t.last_known_value is not None or t.erased:
+            return None
+        args = _annotation_keys(t.args)
+        return None if args is None else ('I', t.type.fullname, t.type.name, args)
+    elif isinstance(t, UnionType):
+        items = _annotation_keys(t.items)
+        return None if items is None else ('|', items)
+    elif isinstance(t, TypeList):
+        items = _annotation_keys(t.items)
+        return None if items is None else ('[]', items)
+    elif isinstance(t, TypeVarType):
+        return ('V', t.name, t.id)
+    elif isinstance(t, NoneType):
+        return 'None'
+    elif isinstance(t, AnyType):
+        return 'Any'
+    return None
+
+
+def _annotation_keys(types: Sequence[Type]) -> Optional[Tuple[Hashable, ...]]:
+    keys = []  # type: List[Hashable]
+    for t in types:
+        key = annotation_key(t)
+        if key is None:
+            return None
+        keys.append(key)
+    return tuple(keys)
+
+
+class MissingImportFinder(mypy.typetraverser.TypeTraverserVisitor):
+    """Find the names of unimported types (see follow_imports = skip).
+
+    Types accessed through an unimported module (import a.b; a.b.C) lose
+    their name, module is recorded for them instead.
+    """
+
+    def __init__(self, names: Set[str], module: str) -> None:
+        self.names = names
+        self.module = module
+
+    def visit_any(self, t: AnyType) -> None:
+        if t.missing_import_name:
+            self.names.add(t.missing_import_name)
+        elif t.type_of_any == TypeOfAny.from_unimported_type:
+            self.names.add(self.module)
+
+
+def find_public_api(mods, excludes, files, missing: Optional[Set[str]] = None,
+                    modules: Optional[List[str]] = None) -> Set[str]:
+    """Find the public API of the given modules, including the leaked items.
+
+    See build_public_api_graph for the arguments.
+    """
+    return set(build_public_api_graph(mods, excludes, files, missing, modules).names)
+
+
+def build_public_api_graph(mods, excludes, files, missing: Optional[Set[str]] = None,
+                           modules: Optional[List[str]] = None) -> SymbolGraph:
+    """Build the graph of the public API of the given modules.
+
+    Its roots are the public items of the public modules (see PublicAPIFinder)
+    and its edges lead to the items leaked by them. The graph is expanded in
+    id order, i.e. breadth-first; the items referenced by each item are found
+    from its node and interned by full name. Leaked items are looked for
+    in modules, which defaults to the given modules. If missing is given, the
+    names of the types used by the public API which couldn't be resolved since
+    their module was not part of the build are added to it (see
+    MissingImportFinder).
+    """
     initial_public_api: Set[str] = set()
 
+    lookup = LookupCache(files)
+    exclude_filter = ModuleFilter(excludes)
     for mod in mods:
         to_add: Set[str] = set()
-        finder = PublicAPIFinder(mods, excludes, to_add, files)
+        finder = PublicAPIFinder(mods, exclude_filter, to_add, lookup)
         mod.ast.accept(finder)
         initial_public_api |= to_add
 
-    modules = [mod.module for mod in mods]
+    included = ModuleFilter(modules if modules is not None else [mod.module for mod in mods])
     def _in_includes(name: str) -> bool:
-        return any(name.startswith(m) for m in modules)
+        return name in included
+
+    def _find_missing(typ: Type, fullname: str) -> None:
+        if missing is not None:
+            module = find_owner_module(fullname, files) or fullname
+            typ.accept(MissingImportFinder(missing, module))
+
+    graph = SymbolGraph()
+    for item in sorted(initial_public_api):
+        graph.intern(item, FLAG_ROOT)
+    # Nodes of the symbols found while expanding the graph, the others are
+    # looked up. They are dropped once expanded.
+    nodes = {}  # type: Dict[int, SymbolNode]
+    collect_type_infos = TypeInfoCollector()
+
+    def _add(fullname: str, node: Optional[SymbolNode]) -> int:
+        i = graph.ids.get(fullname)
+        if i is None:
+            i = graph.intern(fullname)
+            if node is not None:
+                nodes[i] = node
+        return i
+
+    def _add_types(typ: Type, targets: List[int]) -> None:
+        for info in collect_type_infos(typ):
+            if _in_includes(info.fullname):
+                targets.append(_add(info.fullname, info))
 
     # Expand the public API to include any leaked items.
-    public_api: Set[str] = set()
-    to_expand: List[str] = list(initial_public_api)
-    while to_expand:
-        item = to_expand.pop()
-        if item in public_api:
-            continue
-        else:
-            public_api.add(item)
-        node = lookup_fully_qualified(item, files)
-        if not node:
-            continue
-
-        if isinstance(node.node, (FuncDef, Decorator, OverloadedFuncDef)):
-            if node.type and isinstance(node.type, CallableType):
-                types = map(str, _get_types(node.type.ret_type))
-                for stype in types:
-                    if _in_includes(stype):
-                        to_expand.append(stype)
-
-                for argtype in node.type.arg_types:
-                    types = map(str, _get_types(argtype))
-                    for stype in types:
-                        if _in_includes(stype):
-                            to_expand.append(stype)
-        elif isinstance(node.node, TypeInfo):
-            clsfullname = node.fullname
-            for name, attr in node.node.names.items():
+    while not graph.is_complete():
+        i = graph.next_unexpanded()
+        item = graph.names[i]
+        targets = []  # type: List[int]
+        node = nodes.pop(i, None)
+        if node is None:
+            sym = lookup(item)
+            node = sym.node if sym else None
+
+        if node is None:
+            pass
+        elif isinstance(node, (FuncDef, Decorator, OverloadedFuncDef)):
+            typ = node.var.type if isinstance(node, Decorator) else node.type
+            if typ and isinstance(typ, CallableType):
+                _find_missing(typ, item)
+                _add_types(typ, targets)
+        elif isinstance(node, TypeInfo):
+            for name, attr in node.names.items():
                 if _is_private_name(name):
                     continue
-                fullname = f"{clsfullname}.{name}"
-                to_expand.append(fullname)
-            for n in node.node.mro:
+                targets.append(_add(_member_fullname(node.fullname, name, attr.node),
+                                    attr.node))
+            for n in node.mro[1:]:
                 if n.fullname and _in_includes(n.fullname):
-                    to_expand.append(n.fullname)
-        elif isinstance(node.node, Var):
-            if not node.type:
-                continue
-            types = map(str, _get_types(node.type))
-            for stype in list(types):
-                if _in_includes(stype):
-                    to_expand.append(stype)
+                    targets.append(_add(n.fullname, n))
+            # Unimported base classes are dropped from the MRO.
+            for base in node.defn.base_type_exprs:
+                if isinstance(base, IndexExpr):
+                    base = base.base
+                if isinstance(base, RefExpr) and isinstance(base.node, Var) and base.node.type:
+                    _find_missing(base.node.type, item)
+        elif isinstance(node, Var):
+            if node.type:
+                _find_missing(node.type, item)
+                _add_types(node.type, targets)
         else:
-            print("%r not yet supported" % node.node)
+            print("%r not yet supported" % node)
+        graph.expand(targets)
+
+    return graph
+
+
+def _member_fullname(cls: str, name: str, node: Optional[SymbolNode]) -> str:
+    """Return the full name of a class member, reusing the one of its node if possible.
+
+    >>> _member_fullname('pkg.C', 'x', None)
+    'pkg.C.x'
+    """
+    fullname = node.fullname if node is not None else None
+    if (fullname and len(fullname) == len(cls) + len(name) + 1
+            and fullname.startswith(cls) and fullname[len(cls)] == '.'
+            and fullname.endswith(name)):
+        return fullname
+    return f"{cls}.{name}"
+
+
+def is_public_api_module(module: str, excludes: ModuleFilter) -> bool:
+    """Is the module part of the public API (see PublicAPIFinder)?"""
+    return not (module in excludes or
+                _is_private_name(module.split('.')[-1]))
+
+
+class PublicAPIIndex:
+    """The public API bucketed by owning module and by scope.
+
+    Built once after find_public_api, it tells in constant time whether a
+    module needs a stub at all, which is the case of the modules containing
+    public items and of their parent packages, and hands each StubGenerator
+    the slice of the public API defined in its module.
+
+    >>> index = PublicAPIIndex({'pkg', 'pkg.sub', 'pkg.sub.C', 'pkg.sub.C.f'},
+    ...                        ['pkg', 'pkg.sub', 'pkg.other'])
+    >>> index.requires('pkg'), index.requires('pkg.other'), index.requires('pkg.su')
+    (True, False, False)
+    >>> sorted(index.slice('pkg.sub').items())
+    [('pkg.sub', {'C'}), ('pkg.sub.C', {'f'})]
+    >>> index.slice('pkg'), index.slice('pkg.other')
+    ({}, None)
+    """
+
+    def __init__(self, public_api: Iterable[str], modules: Iterable[str]) -> None:
+        modules = set(modules)
+        # The public items and all the names containing them.
+        self._prefixes = set()  # type: Set[str]
+        # Short names of the public items by owning module and scope (module or class).
+        self._scopes = {}  # type: Dict[str, Dict[str, Set[str]]]
+        for name in public_api:
+            parts = name.split('.')
+            for i in range(len(parts), 0, -1):
+                prefix = '.'.join(parts[:i])
+                if prefix in self._prefixes:
+                    break
+                self._prefixes.add(prefix)
+            owner = find_owner_module(name, modules)
+            if owner is None or owner == name:
+                continue
+            scope, _, short = name.rpartition('.')
+            self._scopes.setdefault(owner, {}).setdefault(scope, set()).add(short)
+
+    def requires(self, module: str) -> bool:
+        """Does the module contain part of the public API?"""
+        return module in self._prefixes
 
-    return public_api
+    def slice(self, module: str) -> Optional[Dict[str, Set[str]]]:
+        """Return the public items of the module by scope, None if it has no stub."""
+        if not self.requires(module):
+            return None
+        return self._scopes.get(module, {})
 
 
 def _is_private_name(name: str, fullname: Optional[str] = None) -> bool:
@@ -566,14 +814,14 @@ class SkipMypyFile(Exception):
 
 
 class PublicAPIFinder(mypy.traverser.TraverserVisitor):
-    def __init__(self, py_mods, excludes, public_api, mods) -> None:
+    def __init__(self, py_mods, excludes, public_api, lookup: LookupCache) -> None:
         self.py_mods = py_mods
         self.excludes = excludes
         self.public_api = public_api
-        self.mods: Dict[str, MypyFile] = mods
+        self._lookup = lookup
 
     def lookup(self, fullname: str) -> Optional[SymbolTableNode]:
-        return lookup_fully_qualified(fullname, self.mods)
+        return self._lookup(fullname)
 
     def visit_class_def(self, o: ClassDef) -> None:
         if o.name.startswith("_"):
@@ -584,7 +832,7 @@ class PublicAPIFinder(mypy.traverser.TraverserVisitor):
             super().visit_class_def(o)
 
     def visit_mypy_file(self, o: MypyFile) -> None:
-        if any(o.fullname.startswith(e) for e in self.excludes) or _is_private_name(o.name):
+        if not is_public_api_module(o.fullname, self.excludes):
             return
         self.public_api.add(o.fullname)
         super().visit_mypy_file(o)
@@ -688,6 +936,107 @@ class ReferenceFinder(mypy.mixedtraverser.MixedTraverserVisitor):
         self.refs.add(fullname.split('.')[-1])
 
 
+class ModuleSummary:
+    """What StubGenerator needs to know about a module before emitting its stub.
+
+    This is the names defined at the top level (see find_defined_names), the
+    referenced names (see find_referenced_names), the method names of the
+    classes (see find_method_names) and the attribute initializers of the
+    functions (see find_self_initializers), all found by a single traversal
+    of the module.
+    """
+    def __init__(self, file: MypyFile) -> None:
+        self.file = file
+        summarizer = ModuleSummarizer()
+        file.accept(summarizer)
+        self.defined_names = summarizer.names
+        self.referenced_names = summarizer.refs
+        # By id of ClassDef and FuncDef, the nodes are kept alive by file.
+        self._method_names = summarizer.method_names
+        self._self_inits = summarizer.self_inits
+
+    def method_names(self, cls: ClassDef) -> Set[str]:
+        names = self._method_names.get(id(cls))
+        return names if names is not None else find_method_names(cls.defs.body)
+
+    def self_initializers(self, fdef: FuncDef) -> List[Tuple[str, Expression]]:
+        inits = self._self_inits.get(id(fdef))
+        return inits if inits is not None else find_self_initializers(fdef)
+
+
+class ModuleSummarizer(ReferenceFinder):
+    """Collect a ModuleSummary.
+
+    Like ReferenceFinder, no references are collected from unreachable
+    blocks, which are still traversed for the other names like
+    DefinitionFinder and SelfTraverser do.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.names = set()  # type: Set[str]
+        self.method_names = {}  # type: Dict[int, Set[str]]
+        self.self_inits = {}  # type: Dict[int, List[Tuple[str, Expression]]]
+        # Number of classes and functions the traversal is in.
+        self._depth = 0
+        # Number of unreachable blocks the traversal is in.
+        self._unreachable = 0
+        # Attribute initializers of the functions the traversal is in.
+        self._funcs = []  # type: List[List[Tuple[str, Expression]]]
+
+    def visit_block(self, block: Block) -> None:
+        if block.is_unreachable:
+            self._unreachable += 1
+            mypy.traverser.TraverserVisitor.visit_block(self, block)
+            self._unreachable -= 1
+        else:
+            super().visit_block(block)
+
+    def visit_name_expr(self, e: NameExpr) -> None:
+        if not self._unreachable:
+            self.refs.add(e.name)
+
+    def add_ref(self, fullname: str) -> None:
+        if not self._unreachable:
+            self.refs.add(fullname.rpartition('.')[2])
+
+    def visit_instance(self, t: Instance) -> None:
+        # Instances are the most common types by far, hence the inlining.
+        if not self._unreachable:
+            self.refs.add(t.type.fullname.rpartition('.')[2])
+        for arg in t.args:
+            arg.accept(self)
+
+    def visit_class_def(self, o: ClassDef) -> None:
+        if not self._depth:
+            self.names.add(o.name)
+        self.method_names[id(o)] = find_method_names(o.defs.body)
+        self._depth += 1
+        super().visit_class_def(o)
+        self._depth -= 1
+
+    def visit_func_def(self, o: FuncDef) -> None:
+        if not self._depth:
+            self.names.add(o.name)
+        inits = []  # type: List[Tuple[str, Expression]]
+        self.self_inits[id(o)] = inits
+        self._funcs.append(inits)
+        self._depth += 1
+        super().visit_func_def(o)
+        self._depth -= 1
+        self._funcs.pop()
+
+    def visit_assignment_stmt(self, o: AssignmentStmt) -> None:
+        if self._funcs and is_self_initializer(o):
+            lvalue = o.lvalues[0]
+            assert isinstance(lvalue, MemberExpr)
+            # The initializers of nested functions are also found in the
+            # enclosing ones, as with find_self_initializers.
+            for inits in self._funcs:
+                inits.append((lvalue.name, o.rvalue))
+        super().visit_assignment_stmt(o)
+
+
 class StubGenerator(mypy.traverser.TraverserVisitor):
     """Generate stub text from a mypy AST."""
 
@@ -697,8 +1046,10 @@ class StubGenerator(mypy.traverser.TraverserVisitor):
                  analyzed: bool = False,
                  export_less: bool = False,
                  public_api_only: bool = False,
-                 public_api: Optional[Set[str]] = None,
-                 files: Optional[Dict[str, MypyFile]] = None) -> None:
+                 public_api: Optional[Dict[str, Set[str]]] = None,
+                 lookup: Optional[LookupCache] = None,
+                 pruned_refs: Optional[Set[str]] = None,
+                 summary: Optional[ModuleSummary] = None) -> None:
         # Best known value of __all__.
         self._all_ = _all_
         self._output = []  # type: List[str]
@@ -708,14 +1059,26 @@ class StubGenerator(mypy.traverser.TraverserVisitor):
         self._indent = ''
         # Stack of defined variables (per scope).
         self._vars = [[]]  # type: List[List[str]]
+        # Printed annotations and the names they require by annotation_key,
+        # types of the same shape are repeated throughout a module.
+        self._annotations = {}  # type: Dict[Hashable, Tuple[str, List[str]]]
+        # Imports needed by types by annotation_key (see add_type_imports)
+        self._type_imports = {}  # type: Dict[Hashable, List[str]]
         # What was generated previously in the stub file.
         self._state = EMPTY
         self._toplevel_names = []  # type: List[str]
         self._pyversion = pyversion
         self._include_private = include_private
         self._public_api_only = public_api_only
-        self._public_api: Set[str] = public_api if public_api else set()
-        self._files = files if files else {}
+        # Public items of the module by scope (see PublicAPIIndex.slice), None
+        # if there is nothing public in it.
+        self._public_api = public_api
+        # Lookup of symbols shared by all the modules of the run.
+        self._lookup = lookup if lookup is not None else LookupCache({})
+        # Names referenced in function bodies that were pruned before analysis.
+        self._pruned_refs = pruned_refs if pruned_refs else set()
+        # Summary of the module, computed by visit_mypy_file if not given.
+        self.summary = summary
         self.import_tracker = ImportTracker()
         # Was the tree semantically analysed before?
         self.analyzed = analyzed
@@ -730,23 +1093,29 @@ class StubGenerator(mypy.traverser.TraverserVisitor):
         self.defined_names = set()  # type: Set[str]
         # Short names of methods defined in the body of the current class
         self.method_names = set()  # type: Set[str]
+        # Types of the attributes of the current class by name (see
+        # get_attribute_types)
+        self.attribute_types = {}  # type: Dict[str, Optional[Type]]
 
     def _include(self, name: str) -> bool:
-        if self._public_api_only and name not in self._public_api:
-            return False
+        if self._public_api_only:
+            scope, _, name = name.rpartition('.')
+            return self._public_api is not None and name in self._public_api.get(scope, ())
         return True
 
     def lookup_fully_qualified(self, name: str) -> Optional[SymbolTableNode]:
-        return lookup_fully_qualified(name, self._files)
+        return self._lookup(name)
 
     def visit_mypy_file(self, o: MypyFile) -> None:
-        if not any(i.startswith(o.fullname) for i in self._public_api):
+        if self._public_api is None:
             raise SkipMypyFile
 
         self.module = o.fullname  # Current module being processed
         self.path = o.path
-        self.defined_names = find_defined_names(o)
-        self.referenced_names = find_referenced_names(o)
+        if self.summary is None or self.summary.file is not o:
+            self.summary = ModuleSummary(o)
+        self.defined_names = self.summary.defined_names
+        self.referenced_names = self.summary.referenced_names | self._pruned_refs
         typing_imports = ["Any", "Optional", "TypeVar"]
         for t in typing_imports:
             if t not in self.defined_names:
@@ -787,10 +1156,16 @@ class StubGenerator(mypy.traverser.TraverserVisitor):
                 self.clear_decorators()
 
     def add_type_imports(self, typ: Type):
-        for t in map(str, _get_types(typ)):
-            if t == "None":
-                continue
-            self.import_tracker.add_import(t)
+        key = annotation_key(typ)
+        imports = self._type_imports.get(key) if key is not None else None
+        if imports is None:
+            # Any (which unresolved types also turn into) comes from typing.
+            imports = [str(t) for t in _get_types(typ)
+                       if not isinstance(t, (NoneType, AnyType))]
+            if key is not None:
+                self._type_imports[key] = imports
+        for module in imports:
+            self.import_tracker.add_import(module)
 
     def visit_func_def(self, o: FuncDef, is_abstract: bool = False,
                        is_overload: bool = False) -> None:
@@ -803,27 +1178,12 @@ class StubGenerator(mypy.traverser.TraverserVisitor):
         if not self._indent and self._state not in (EMPTY, FUNC) and not o.is_awaitable_coroutine:
             self.add('\n')
         if not self.is_top_level():
-            self_inits = find_self_initializers(o)
-
-            cls_node: Optional[SymbolTableNode] = None
-            # Dirty hack because I don't see a way to get the current class
-            # if it exists.
-            split = o.fullname.split(".")
-            if len(split) > 1:
-                fullname = ".".join(split[0:-1])
-                cls_node = self.lookup_fully_qualified(fullname)
-
-            for init, value in self_inits:
+            assert self.summary is not None
+            for init, value in self.summary.self_initializers(o):
                 if init in self.method_names:
                     # Can't have both an attribute and a method/property with the same name.
                     continue
-
-                init_annotation = None
-                if cls_node and isinstance(cls_node.node, TypeInfo):
-                    if init in cls_node.node.names:
-                        attr_node = cls_node.node.names[init]
-                        init_annotation = attr_node.type
-
+                init_annotation = self.attribute_types.get(init)
                 init_code = self.get_init(init, value, init_annotation)
                 if init_code:
                     self.add(init_code)
@@ -1027,7 +1387,10 @@ class StubGenerator(mypy.traverser.TraverserVisitor):
         if not self._include(o.fullname):
             return
 
-        self.method_names = find_method_names(o.defs.body)
+        assert self.summary is not None
+        self.method_names = self.summary.method_names(o)
+        outer_attribute_types = self.attribute_types
+        self.attribute_types = self.get_attribute_types(o)
         sep = None  # type: Optional[int]
         if not self._indent and self._state != EMPTY:
             sep = len(self._output)
@@ -1063,6 +1426,24 @@ class StubGenerator(mypy.traverser.TraverserVisitor):
         else:
             self._state = CLASS
         self.method_names = set()
+        self.attribute_types = outer_attribute_types
+
+    def get_attribute_types(self, cdef: ClassDef) -> Dict[str, Optional[Type]]:
+        """Get the types of the attributes of a class by name.
+
+        The attributes initialized by the methods (self.x = ...) are emitted
+        along with the methods, they are all looked up in this index built once
+        per class.
+        """
+        info = cdef.info if self.analyzed else None  # type: Optional[TypeInfo]
+        if not info:
+            # Not analyzed (or a FakeInfo, which is falsy).
+            node = self.lookup_fully_qualified(cdef.fullname)
+            if node is None or not isinstance(node.node, TypeInfo):
+                return {}
+            info = node.node
+        return {name: node.type for name, node in info.names.items()
+                if name not in self.method_names}
 
     def get_base_types(self, cdef: ClassDef) -> List[str]:
         """Get list of base classes for a class."""
@@ -1403,8 +1784,18 @@ class StubGenerator(mypy.traverser.TraverserVisitor):
         return self.typing_name('Any')
 
     def print_annotation(self, t: Type) -> str:
-        printer = AnnotationPrinter(self)
-        return t.accept(printer)
+        key = annotation_key(t)
+        cached = self._annotations.get(key) if key is not None else None
+        if cached is None:
+            printer = AnnotationPrinter(self)
+            text = t.accept(printer)
+            if key is not None:
+                self._annotations[key] = (text, printer.required_names)
+            return text
+        text, names = cached
+        for name in names:
+            self.import_tracker.require_name(name)
+        return text
 
     def is_top_level(self) -> bool:
         """Are we processing the top level of a file?"""
@@ -1437,15 +1828,22 @@ def find_method_names(defs: List[Statement]) -> Set[str]:
     return result
 
 
+def is_self_initializer(o: AssignmentStmt) -> bool:
+    """Is this an assignment of the form self.x = ...?"""
+    lvalue = o.lvalues[0]
+    return (isinstance(lvalue, MemberExpr) and
+            isinstance(lvalue.expr, NameExpr) and
+            lvalue.expr.name == 'self')
+
+
 class SelfTraverser(mypy.traverser.TraverserVisitor):
     def __init__(self) -> None:
         self.results = []  # type: List[Tuple[str, Expression]]
 
     def visit_assignment_stmt(self, o: AssignmentStmt) -> None:
-        lvalue = o.lvalues[0]
-        if (isinstance(lvalue, MemberExpr) and
-                isinstance(lvalue.expr, NameExpr) and
-                lvalue.expr.name == 'self'):
+        if is_self_initializer(o):
+            lvalue = o.lvalues[0]
+            assert isinstance(lvalue, MemberExpr)
             self.results.append((lvalue.name, o.rvalue))
 
 
@@ -1459,6 +1857,130 @@ def find_self_initializers(fdef: FuncBase) -> List[Tuple[str, Expression]]:
     return traverser.results
 
 
+def is_kept_by_pruning(o: AssignmentStmt) -> bool:
+    """Is this assignment kept when pruning function bodies (see BodyPruner)?"""
+    return is_self_initializer(o) or o.type is not None
+
+
+class KeptStatementCollector(mypy.traverser.TraverserVisitor):
+    """Collect the statements of a function body kept by BodyPruner.
+
+    Nested functions are kept as a whole, their bodies are pruned separately.
+    """
+
+    def __init__(self) -> None:
+        self.stmts = []  # type: List[Statement]
+
+    def visit_assignment_stmt(self, o: AssignmentStmt) -> None:
+        if is_kept_by_pruning(o):
+            self.stmts.append(o)
+
+    def visit_func_def(self, o: FuncDef) -> None:
+        self.stmts.append(o)
+
+    def visit_decorator(self, o: Decorator) -> None:
+        self.stmts.append(o)
+
+    def visit_overloaded_func_def(self, o: OverloadedFuncDef) -> None:
+        self.stmts.append(o)
+
+
+class PrunedReferenceFinder(ReferenceFinder):
+    """Find names referenced by the statements removed from a function body.
+
+    Types aren't analyzed yet so all the names they mention are considered.
+    The statements kept by the pruning are analyzed later on, hence nested
+    functions and the annotations of kept assignments are skipped.
+    """
+
+    def visit_assignment_stmt(self, o: AssignmentStmt) -> None:
+        if is_kept_by_pruning(o):
+            mypy.traverser.TraverserVisitor.visit_assignment_stmt(self, o)
+        else:
+            super().visit_assignment_stmt(o)
+
+    def visit_func_def(self, o: FuncDef) -> None:
+        pass
+
+    def visit_decorator(self, o: Decorator) -> None:
+        pass
+
+    def visit_overloaded_func_def(self, o: OverloadedFuncDef) -> None:
+        pass
+
+    def visit_unbound_type(self, t: UnboundType) -> None:
+        super().visit_unbound_type(t)
+        for arg in t.args:
+            arg.accept(self)
+
+
+class BodyPruner(mypy.traverser.TraverserVisitor):
+    """Replace function bodies with the parts that matter to stub generation.
+
+    This runs on parsed files before semantic analysis. Stubs only depend on
+    the body of a function through its attribute initializers (see
+    find_self_initializers) and whether it has a return statement (see
+    has_return_statement). The body is replaced with the self.x = ...
+    assignments found anywhere in it, followed by 'return ...' if needed.
+
+    The names referenced in the original body decide which imported names are
+    considered to be used by the module (see find_referenced_names). The names
+    found in the removed statements are recorded in refs. Annotated
+    assignments (with their value replaced by '...') and nested functions are
+    kept so that the names in their types are found after semantic analysis,
+    like before.
+    """
+
+    def __init__(self) -> None:
+        self.refs = set()  # type: Set[str]
+
+    def visit_func_def(self, o: FuncDef) -> None:
+        finder = PrunedReferenceFinder()
+        o.body.accept(finder)
+        self.refs |= finder.refs
+
+        returns = has_return_statement(o)
+        collector = KeptStatementCollector()
+        o.body.accept(collector)
+        body = collector.stmts
+        for stmt in body:
+            if isinstance(stmt, AssignmentStmt) and not is_self_initializer(stmt):
+                stmt.rvalue = EllipsisExpr()
+                stmt.rvalue.set_line(stmt)
+        if returns:
+            ret = ReturnStmt(EllipsisExpr())
+            ret.set_line(o.body)
+            body.append(ret)
+        if not body:
+            stmt = PassStmt()
+            stmt.set_line(o.body)
+            body.append(stmt)
+        o.body.body = body
+        # Prune the nested functions.
+        super().visit_func_def(o)
+
+
+class BodyPruningPlugin(Plugin):
+    """mypy plugin which prunes function bodies of stub sources (see BodyPruner).
+
+    The plugin uses get_additional_deps since it is the only hook that is
+    called with the tree of a module after parsing and before its semantic
+    analysis.
+    """
+
+    def __init__(self, options: MypyOptions, py_modules: List[StubSource]) -> None:
+        super().__init__(options)
+        self._sources = {mod.module: mod for mod in py_modules}
+
+    def get_additional_deps(self, file: MypyFile) -> List[Tuple[int, str, int]]:
+        mod = self._sources.get(file.fullname)
+        if mod is not None:
+            pruner = BodyPruner()
+            file.accept(pruner)
+            mod.pruned_refs = pruner.refs
+        return []
+
+
 def get_qualified_name(o: Expression) -> str:
     if isinstance(o, NameExpr):
         return o.name
@@ -1474,8 +1996,7 @@ def remove_blacklisted_modules(modules: List[StubSource]) -> List[StubSource]:
 
 
 def is_blacklisted_path(path: str) -> bool:
-    return any(substr in (normalize_path_separators(path) + '\n')
-               for substr in BLACKLIST)
+    return BLACKLIST_RE.search(normalize_path_separators(path) + '\n') is not None
 
 
 def normalize_path_separators(path: str) -> str:
@@ -1499,12 +2020,21 @@ def collect_build_targets(options: Options, mypy_opts: MypyOptions) -> Tuple[Lis
             c_modules = []  # type: List[StubSource]
         else:
             # Using imports is the default, since we can also find C modules.
+            cache = None  # type: Optional[IntrospectionCache]
+            if options.incremental:
+                cache = IntrospectionCache(introspection_cache_path(options))
             py_modules, c_modules = find_module_paths_using_imports(options.modules,
                                                                     options.packages,
                                                                     options.interpreter,
                                                                     options.pyversion,
                                                                     options.verbose,
-                                                                    options.quiet)
+                                                                    options.quiet,
+                                                                    options.jobs,
+                                                                    options.import_timeout,
+                                                                    options.search_path,
+                                                                    cache)
+            if cache is not None:
+                cache.save()
     else:
         # Use mypy native source collection for files and directories.
         try:
@@ -1519,70 +2049,422 @@ def collect_build_targets(options: Options, mypy_opts: MypyOptions) -> Tuple[Lis
     return py_modules, c_modules
 
 
+class IntrospectionCache:
+    """Results of runtime introspection kept across runs (see --incremental).
+
+    The path and runtime __all__ of a Python module are reused for as long as
+    its file is unchanged: same size and modification time, or else the same
+    content. The submodules of a package are reused for as long as the names
+    of the files in its directory stay the same. C modules are not cached.
+
+    Note that __all__ is assumed to only depend on the module itself.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.modules = {}  # type: Dict[str, Dict[str, Any]]
+        self.packages = {}  # type: Dict[str, Dict[str, Any]]
+        self.changed = False
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            self.modules = data['modules']
+            self.packages = data['packages']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def get_module(self, module: str) -> Optional[StubSource]:
+        entry = self.modules.get(module)
+        if entry is None:
+            return None
+        try:
+            st = os.stat(entry['path'])
+        except OSError:
+            return None
+        if [st.st_mtime_ns, st.st_size] != entry['stat']:
+            if hash_file(entry['path']) != entry['hash']:
+                return None
+            entry['stat'] = [st.st_mtime_ns, st.st_size]
+            self.changed = True
+        return StubSource(module, entry['path'], entry['all'])
+
+    def put_module(self, source: StubSource) -> None:
+        assert source.path is not None
+        st = os.stat(source.path)
+        self.modules[source.module] = {
+            'path': source.path,
+            'all': source.runtime_all,
+            'stat': [st.st_mtime_ns, st.st_size],
+            'hash': hash_file(source.path),
+        }
+        self.changed = True
+
+    def get_package(self, package: str) -> Optional[List[str]]:
+        """Return the package and its submodules, as found by walk_packages."""
+        entry = self.packages.get(package)
+        if entry is None or package_listing_hash(entry['dir']) != entry['listing']:
+            return None
+        return cast(List[str], entry['modules'])
+
+    def put_package(self, package: str, path: str, modules: List[str]) -> None:
+        directory = os.path.dirname(path)
+        self.packages[package] = {
+            'dir': directory,
+            'listing': package_listing_hash(directory),
+            'modules': modules,
+        }
+        self.changed = True
+
+    def save(self) -> None:
+        if not self.changed:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump({'modules': self.modules, 'packages': self.packages}, f)
+        os.replace(tmp, self.path)
+        self.changed = False
+
+
+def package_listing_hash(directory: str) -> Optional[str]:
+    """Return a hash of the names of the files below directory."""
+    if not os.path.isdir(directory):
+        return None
+    names = []  # type: List[str]
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [d for d in dirs if d != '__pycache__']
+        rel = os.path.relpath(root, directory)
+        names.extend(os.path.join(rel, name) for name in dirs + files)
+    return hashlib.sha256('\n'.join(sorted(names)).encode('utf-8')).hexdigest()
+
+
+def introspection_cache_path(stubgen_options: Options) -> str:
+    """Return the path of the introspection cache for the given options.
+
+    Runtime introspection depends on the interpreter and where it finds the
+    modules, so each gets its own cache.
+    """
+    key = json.dumps([
+        doxxie_version(),
+        stubgen_options.interpreter,
+        sys.version,
+        stubgen_options.pyversion,
+        [os.path.abspath(p) for p in sys.path],
+    ])
+    digest = hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(stubgen_options.cache_dir, 'introspection', digest + '.json')
+
+
+class ImportTimeout(Exception):
+    """Raised when the import of a module takes too long."""
+
+
+def inspect_modules(tasks: 'Queue[str]',
+                    results: 'Queue[Tuple[str, Union[ModuleProperties, str, None]]]',
+                    sys_path: List[str]) -> None:
+    """The main loop of a ModuleInspector process.
+
+    Report when the import of each module starts and then its properties or
+    the import error.
+    """
+    sys.path = sys_path
+    while True:
+        mod = tasks.get()
+        results.put(('started', None))
+        try:
+            prop = get_package_properties(mod)
+        except InspectError as e:
+            results.put(('error', str(e)))
+            continue
+        results.put(('done', prop))
+
+
+class ModuleInspector:
+    """Perform runtime introspection of modules in a separate process.
+
+    Like mypy's ModuleInspect, except that the import of a module is given up
+    after timeout seconds (if not None) by raising ImportTimeout. The clock of
+    a module starts when the process starts importing it, so the restart of
+    the process after a timeout doesn't count against the next module.
+    """
+
+    def __init__(self, timeout: Optional[float] = None) -> None:
+        self.timeout = timeout
+        self._start()
+
+    def _start(self) -> None:
+        self.tasks = Queue()  # type: Queue[str]
+        self.results = Queue()  # type: Queue[Tuple[str, Union[ModuleProperties, str, None]]]
+        self.proc = Process(target=inspect_modules, args=(self.tasks, self.results, sys.path))
+        self.proc.start()
+        self.counter = 0  # Number of successful roundtrips
+
+    def _restart(self) -> None:
+        self.close()
+        self._start()
+
+    def close(self) -> None:
+        """Free any resources used."""
+        self.proc.terminate()
+        self.proc.join()
+
+    def get_package_properties(self, package_id: str) -> ModuleProperties:
+        """Return some properties of a module/package using runtime introspection.
+
+        Raise InspectError if the target couldn't be imported and
+        ImportTimeout if importing it took too long.
+        """
+        self.tasks.put(package_id)
+        if self._get_from_queue(None) is None:
+            self._restart()
+            raise InspectError('Process died when importing %r' % package_id)
+        res = self._get_from_queue(self.timeout)
+        if res is None:
+            self._restart()
+            raise InspectError('Process died when importing %r' % package_id)
+        kind, value = res
+        if kind == 'timeout':
+            self._restart()
+            raise ImportTimeout('Timeout importing %r' % package_id)
+        if isinstance(value, str):
+            # Error importing module
+            if self.counter > 0:
+                # Also try with a fresh process. Maybe one of the previous imports has
+                # corrupted some global state.
+                self._restart()
+                return self.get_package_properties(package_id)
+            raise InspectError(value)
+        assert isinstance(value, ModuleProperties)
+        self.counter += 1
+        return value
+
+    def _get_from_queue(self, timeout: Optional[float]
+                        ) -> Optional[Tuple[str, Union[ModuleProperties, str, None]]]:
+        """Get the next value from the queue.
+
+        Return ('timeout', None) if there is none after timeout seconds, or
+        None if the process unexpectedly died.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                return self.results.get(timeout=0.05)
+            except queue.Empty:
+                if not self.proc.is_alive():
+                    return None
+            if deadline is not None and time.monotonic() > deadline:
+                return ('timeout', None)
+
+    def __enter__(self) -> 'ModuleInspector':
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+
+def walk_packages(inspect: ModuleInspector,
+                  packages: List[str],
+                  verbose: bool = False) -> Iterator[str]:
+    """Iterate through all packages and sub-packages in the given list.
+
+    Same as mypy.stubutil.walk_packages, using a ModuleInspector.
+    """
+    for package_name in packages:
+        if package_name in NOT_IMPORTABLE_MODULES:
+            print('%s: Skipped (blacklisted)' % package_name)
+            continue
+        if verbose:
+            print('Trying to import %r for runtime introspection' % package_name)
+        try:
+            prop = inspect.get_package_properties(package_name)
+        except InspectError:
+            report_missing(package_name)
+            continue
+        yield prop.name
+        if prop.is_c_module:
+            # Recursively iterate through the subpackages
+            for submodule in walk_packages(inspect, prop.subpackages, verbose):
+                yield submodule
+        else:
+            for submodule in prop.subpackages:
+                yield submodule
+
+
+def find_module_path_and_all_py3(inspect: ModuleInspector,
+                                 module: str,
+                                 verbose: bool) -> Optional[Tuple[Optional[str],
+                                                                  Optional[List[str]]]]:
+    """Find module and determine __all__ for a Python 3 module.
+
+    Same as mypy.stubutil.find_module_path_and_all_py3, using a
+    ModuleInspector.
+    """
+    if module in NOT_IMPORTABLE_MODULES:
+        raise CantImport(module, '')
+
+    if verbose:
+        print('Trying to import %r for runtime introspection' % module)
+    try:
+        mod = inspect.get_package_properties(module)
+    except InspectError as e:
+        # Fall back to finding the module using sys.path.
+        path = find_module_path_using_sys_path(module, sys.path)
+        if path is None:
+            raise CantImport(module, str(e)) from e
+        return path, None
+    if mod.is_c_module:
+        return None
+    return mod.file, mod.all
+
+
+def report_import_timeout(mod: str, timeout: Optional[float]) -> None:
+    """Warn that the import of mod timed out and what that means for its stub."""
+    sys.stderr.write('warning: %s: Import took longer than %s seconds (--import-timeout), '
+                     'searching for it instead; its runtime __all__ and any names it '
+                     're-exports at runtime are missing from the stubs\n' % (mod, timeout))
+
+
 def find_module_paths_using_imports(modules: List[str],
                                     packages: List[str],
                                     interpreter: str,
                                     pyversion: Tuple[int, int],
                                     verbose: bool,
-                                    quiet: bool) -> Tuple[List[StubSource],
-                                                          List[StubSource]]:
+                                    quiet: bool,
+                                    jobs: int = 1,
+                                    timeout: Optional[float] = None,
+                                    search_path: Sequence[str] = (),
+                                    cache: Optional[IntrospectionCache] = None
+                                    ) -> Tuple[List[StubSource], List[StubSource]]:
     """Find path and runtime value of __all__ (if possible) for modules and packages.
 
-    This function uses runtime Python imports to get the information.
+    This function uses runtime Python imports to get the information. Modules
+    are imported concurrently by jobs processes. If timeout is given and the
+    import of a module takes longer than timeout seconds, its path is looked
+    for in the file system instead (see find_module_paths_using_search), with
+    a warning since its runtime __all__ is then unknown.
+
+    If cache is given, the results it holds for unchanged modules are used
+    instead of importing them, and new results are added to it.
     """
-    with ModuleInspect() as inspect:
-        py_modules = []  # type: List[StubSource]
-        c_modules = []  # type: List[StubSource]
-        found = list(walk_packages(inspect, packages, verbose))
+    inspectors = queue.Queue()  # type: queue.Queue[ModuleInspector]
+    for _ in range(jobs):
+        inspectors.put(ModuleInspector(timeout))
+
+    def find(mod: str) -> Optional[StubSource]:
+        if cache is not None:
+            source = cache.get_module(mod)
+            if source is not None:
+                if verbose:
+                    print('Using cached runtime introspection of %r' % mod)
+                return source
+        inspect = inspectors.get()
+        try:
+            if pyversion[0] == 2:
+                result = find_module_path_and_all_py2(mod, interpreter)
+            else:
+                result = find_module_path_and_all_py3(inspect, mod, verbose)
+        except ImportTimeout:
+            report_import_timeout(mod, timeout)
+            path = find_module_path_using_search(mod, search_path, pyversion)
+            if path is None:
+                report_missing(mod)
+                return None
+            return StubSource(mod, path)
+        except CantImport as e:
+            tb = traceback.format_exc()
+            if verbose:
+                sys.stdout.write(tb)
+            if not quiet:
+                report_missing(mod, e.message, tb)
+            return None
+        finally:
+            inspectors.put(inspect)
+        if not result:
+            return StubSource(mod)
+        path, runtime_all = result
+        source = StubSource(mod, path, runtime_all)
+        if cache is not None and path is not None:
+            cache.put_module(source)
+        return source
+
+    try:
+        found = []  # type: List[str]
+        walked = {}  # type: Dict[str, List[str]]
+        inspect = inspectors.get()
+        try:
+            for package in packages:
+                cached = cache.get_package(package) if cache is not None else None
+                if cached is not None:
+                    found += cached
+                    continue
+                try:
+                    walked[package] = list(walk_packages(inspect, [package], verbose))
+                    found += walked[package]
+                except ImportTimeout:
+                    report_import_timeout(package, timeout)
+                    search = search_module_cache(search_path, pyversion)
+                    found += [m.module for m in search.find_modules_recursive(package)]
+        finally:
+            inspectors.put(inspect)
         modules = modules + found
         modules = [mod
                    for mod in modules
                    if not is_non_library_module(mod)]  # We don't want to run any tests or scripts
-        for mod in modules:
-            try:
-                if pyversion[0] == 2:
-                    result = find_module_path_and_all_py2(mod, interpreter)
+        py_modules = []  # type: List[StubSource]
+        c_modules = []  # type: List[StubSource]
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for source in executor.map(find, modules):
+                if source is None:
+                    continue
+                elif source.path is None:
+                    c_modules.append(source)
                 else:
-                    result = find_module_path_and_all_py3(inspect, mod, verbose)
-            except CantImport as e:
-                tb = traceback.format_exc()
-                if verbose:
-                    sys.stdout.write(tb)
-                if not quiet:
-                    report_missing(mod, e.message, tb)
-                continue
-            if not result:
-                c_modules.append(StubSource(mod))
-            else:
-                path, runtime_all = result
-                py_modules.append(StubSource(mod, path, runtime_all))
+                    py_modules.append(source)
+        if cache is not None:
+            for source in py_modules:
+                if (source.module in walked and source.path is not None
+                        and source.path.endswith('__init__.py')):
+                    cache.put_package(source.module, source.path, walked[source.module])
         return py_modules, c_modules
+    finally:
+        while not inspectors.empty():
+            inspectors.get().close()
+
+
+NON_LIBRARY_SUFFIXES = (
+    '.tests',
+    '.test',
+    '.testing',
+    '_tests',
+    '_test_suite',
+    'test_util',
+    'test_utils',
+    'test_base',
+    '.__main__',
+    '.conftest',  # Used by pytest
+    '.setup',  # Typically an install script
+)  # type: Final
+
+NON_LIBRARY_PACKAGES = ('tests', 'test', 'testing', 'SelfTest')  # type: Final
+
+# Matches the module names of the above, as well as modules named test_*.
+NON_LIBRARY_RE = re.compile(
+    r'(?:%s)$|(?:^|\.)test_[^.]*$|\.(?:%s)\.' % (
+        '|'.join(map(re.escape, NON_LIBRARY_SUFFIXES)),
+        '|'.join(map(re.escape, NON_LIBRARY_PACKAGES)),
+    )
+)  # type: Final
 
 
 def is_non_library_module(module: str) -> bool:
-    """Does module look like a test module or a script?"""
-    if module.endswith((
-            '.tests',
-            '.test',
-            '.testing',
-            '_tests',
-            '_test_suite',
-            'test_util',
-            'test_utils',
-            'test_base',
-            '.__main__',
-            '.conftest',  # Used by pytest
-            '.setup',  # Typically an install script
-    )):
-        return True
-    if module.split('.')[-1].startswith('test_'):
-        return True
-    if ('.tests.' in module
-            or '.test.' in module
-            or '.testing.' in module
-            or '.SelfTest.' in module):
-        return True
-    return False
+    """Does module look like a test module or a script?
+
+    >>> [is_non_library_module(m) for m in ['a.tests', 'a.tests.b', 'a.test_b', 'test_a']]
+    [True, True, True, True]
+    >>> [is_non_library_module(m) for m in ['tests.a', 'a.testsb', 'a.b_test', 'a.contest']]
+    [False, False, False, False]
+    """
+    return NON_LIBRARY_RE.search(module) is not None
 
 
 def translate_module_name(module: str, relative: int) -> Tuple[str, int]:
@@ -1597,6 +2479,25 @@ def translate_module_name(module: str, relative: int) -> Tuple[str, int]:
     return module, relative
 
 
+def search_module_cache(search_path: Sequence[str],
+                        pyversion: Tuple[int, int]) -> FindModuleCache:
+    typeshed_path = default_lib_path(mypy.build.default_data_dir(), pyversion, None)
+    search_paths = SearchPaths(('.',) + tuple(search_path), (), (), tuple(typeshed_path))
+    return FindModuleCache(search_paths, fscache=None, options=None)
+
+
+def find_module_path_using_search(module: str, search_path: Sequence[str],
+                                  pyversion: Tuple[int, int]) -> Optional[str]:
+    """Find the source of a module at the file system level, without importing it.
+
+    The search path of find_module_paths_using_search is tried first, then sys.path.
+    """
+    m_result = search_module_cache(search_path, pyversion).find_module(module)
+    if isinstance(m_result, ModuleNotFoundReason):
+        return find_module_path_using_sys_path(module, sys.path)
+    return m_result
+
+
 def find_module_paths_using_search(modules: List[str], packages: List[str],
                                    search_path: List[str],
                                    pyversion: Tuple[int, int]) -> List[StubSource]:
@@ -1607,9 +2508,7 @@ def find_module_paths_using_search(modules: List[str], packages: List[str],
     Exit if some of the modules or packages can't be found.
     """
     result = []  # type: List[StubSource]
-    typeshed_path = default_lib_path(mypy.build.default_data_dir(), pyversion, None)
-    search_paths = SearchPaths(('.',) + tuple(search_path), (), (), tuple(typeshed_path))
-    cache = FindModuleCache(search_paths, fscache=None, options=None)
+    cache = search_module_cache(search_path, pyversion)
     for module in modules:
         m_result = cache.find_module(module)
         if isinstance(m_result, ModuleNotFoundReason):
@@ -1620,7 +2519,7 @@ def find_module_paths_using_search(modules: List[str], packages: List[str],
         result.append(StubSource(module, module_path))
     for package in packages:
         p_result = cache.find_modules_recursive(package)
-        if p_result:
+        if not p_result:
             fail_missing(package, ModuleNotFoundReason.NOT_FOUND)
         sources = [StubSource(m.module, m.path) for m in p_result]
         result.extend(sources)
@@ -1630,21 +2529,64 @@ def find_module_paths_using_search(modules: List[str], packages: List[str],
     return result
 
 
+def doxxie_version() -> str:
+    """Return the installed version of doxxie (or 'unknown')."""
+    try:
+        from importlib.metadata import version, PackageNotFoundError  # type: ignore
+    except ImportError:  # Python < 3.8
+        return 'unknown'
+    try:
+        return version('doxxie')
+    except PackageNotFoundError:
+        return 'unknown'
+
+
+def incremental_cache_dir(stubgen_options: Options) -> str:
+    """Return the directory holding the mypy cache for the given options.
+
+    mypy validates the cached data of a module against the module source hash,
+    the mypy version and the mypy options itself. The cache is additionally
+    keyed on the doxxie and mypy versions (development builds of mypy share a
+    version string) and the doxxie options that affect analysis so that
+    unrelated configurations never share or invalidate each other's data.
+    """
+    key = json.dumps([
+        doxxie_version(),
+        mypy.version.__version__,
+        os.path.dirname(os.path.abspath(mypy.__file__)),
+        stubgen_options.pyversion,
+    ])
+    digest = hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(stubgen_options.cache_dir, 'mypy', digest)
+
+
 def mypy_options(stubgen_options: Options) -> MypyOptions:
     """Generate mypy options using the flag passed by user."""
     options = MypyOptions()
     options.follow_imports = 'skip'
-    options.incremental = False
+    if stubgen_options.incremental:
+        options.incremental = True
+        options.cache_dir = incremental_cache_dir(stubgen_options)
+    else:
+        options.incremental = False
     options.ignore_errors = True
     options.semantic_analysis_only = True
     options.python_version = stubgen_options.pyversion
     options.show_traceback = True
     options.transform_source = remove_misplaced_type_comments
-    if stubgen_options.public_api_only:
-        options.export_types = True
+    # Note that export_types is not needed: the public API and the stubs only
+    # use the declared types found in the symbol tables, never the types of
+    # individual expressions.
     return options
 
 
+def read_source_file(path: str, mypy_options: MypyOptions) -> str:
+    """Read and decode the source of a Python file."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    return mypy.util.decode_python_encoding(data, mypy_options.python_version)
+
+
 def parse_source_file(mod: StubSource, mypy_options: MypyOptions) -> None:
     """Parse a source file.
 
@@ -1652,9 +2594,7 @@ def parse_source_file(mod: StubSource, mypy_options: MypyOptions) -> None:
     If there are syntax errors, print them and exit.
     """
     assert mod.path is not None, "Not found module was not skipped"
-    with open(mod.path, 'rb') as f:
-        data = f.read()
-    source = mypy.util.decode_python_encoding(data, mypy_options.python_version)
+    source = read_source_file(mod.path, mypy_options)
     errors = Errors()
     mod.ast = mypy.parse.parse(source, fnam=mod.path, module=mod.module,
                                errors=errors, options=mypy_options)
@@ -1669,7 +2609,8 @@ def parse_source_file(mod: StubSource, mypy_options: MypyOptions) -> None:
 def generate_asts_for_modules(py_modules: List[StubSource],
                               parse_only: bool,
                               mypy_options: MypyOptions,
-                              verbose: bool) -> Optional[Dict[str, MypyFile]]:
+                              verbose: bool,
+                              prune_bodies: bool = False) -> Optional[Dict[str, MypyFile]]:
     """Use mypy to parse (and optionally analyze) source files."""
     if not py_modules:
         return None  # Nothing to do here, but there may be C modules
@@ -1679,9 +2620,21 @@ def generate_asts_for_modules(py_modules: List[StubSource],
         for mod in py_modules:
             parse_source_file(mod, mypy_options)
         return None
+    if mypy_options.incremental:
+        # mypy only keeps the symbol tables of modules loaded from its cache,
+        # but stubs are generated from the complete trees. Passing the source
+        # text makes mypy analyze the modules of the package from scratch while
+        # their dependencies (builtins, typing, ...) are loaded from the cache.
+        sources = [BuildSource(module.path, module.module,
+                               read_source_file(module.path, mypy_options))
+                   if module.path else module.source
+                   for module in py_modules]
+    else:
+        sources = [module.source for module in py_modules]
+    plugins = [BodyPruningPlugin(mypy_options, py_modules)] if prune_bodies else []
     # Perform full semantic analysis of the source set.
     try:
-        res = build([module.source for module in py_modules], mypy_options)
+        res = build(sources, mypy_options, extra_plugins=plugins)
     except CompileError as e:
         raise SystemExit("Critical error during semantic analysis: {}".format(e)) from e
 
@@ -1693,19 +2646,17 @@ def generate_asts_for_modules(py_modules: List[StubSource],
     return res.files
 
 
-def generate_stub_from_ast(mod: StubSource,
-                           target: str,
-                           parse_only: bool = False,
-                           pyversion: Tuple[int, int] = defaults.PYTHON3_VERSION,
-                           include_private: bool = False,
-                           export_less: bool = False,
-                           public_api_only: bool = False,
-                           public_api: Optional[Set[str]] = None,
-                           files: Optional[Dict[str, MypyFile]] = None) -> None:
-    """Use analysed (or just parsed) AST to generate type stub for single file.
+def render_stub_from_ast(mod: StubSource,
+                         parse_only: bool = False,
+                         pyversion: Tuple[int, int] = defaults.PYTHON3_VERSION,
+                         include_private: bool = False,
+                         export_less: bool = False,
+                         public_api_only: bool = False,
+                         public_api: Optional[PublicAPIIndex] = None,
+                         lookup: Optional[LookupCache] = None) -> Optional[str]:
+    """Use analysed (or just parsed) AST to generate the type stub of a single file.
 
-    If directory for target doesn't exist it will created. Existing stub
-    will be overwritten.
+    Return None if there is nothing to stub in the file.
     """
     gen = StubGenerator(mod.runtime_all,
                         pyversion=pyversion,
@@ -1713,21 +2664,197 @@ def generate_stub_from_ast(mod: StubSource,
                         analyzed=not parse_only,
                         export_less=export_less,
                         public_api_only=public_api_only,
-                        public_api=public_api,
-                        files=files)
+                        public_api=(public_api.slice(mod.module)
+                                    if public_api is not None else None),
+                        lookup=lookup,
+                        pruned_refs=mod.pruned_refs,
+                        summary=mod.summary)
     assert mod.ast is not None, "This function must be used only with analyzed modules"
 
     try:
         mod.ast.accept(gen)
     except SkipMypyFile:
-        return
+        return None
+    # Keep the summary for later renderings of the same AST (eg. by the daemon).
+    mod.summary = gen.summary
+    return ''.join(gen.output())
+
 
-    # Write output to file.
+# What write_stub did to the stub file.
+STUB_WRITTEN = 'written'  # type: Final
+STUB_UNCHANGED = 'unchanged'  # type: Final
+STUB_REMOVED = 'removed'  # type: Final
+
+
+def read_stub(target: str) -> Optional[str]:
+    """Return the content of the stub at target, None if there is none."""
+    try:
+        with open(target) as file:
+            return file.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+def write_stub(text: Optional[str], target: str) -> Optional[str]:
+    """Write a stub rendered by render_stub_from_ast to target.
+
+    If directory for target doesn't exist it will created. An existing stub
+    is only overwritten if its content changed, so that its modification
+    time is preserved otherwise, and is removed if there is nothing to stub.
+    Return what was done (see STUB_WRITTEN and co.), None if nothing.
+    """
+    current = read_stub(target)
+    if text is None:
+        if current is None:
+            return None
+        os.remove(target)
+        return STUB_REMOVED
+    if text == current:
+        return STUB_UNCHANGED
     subdir = os.path.dirname(target)
     if subdir and not os.path.isdir(subdir):
         os.makedirs(subdir)
-    with open(target, 'w') as file:
-        file.write(''.join(gen.output()))
+    # Replace the stub rather than writing it in place, so that it is never
+    # seen half written (see also doxxie._staging).
+    tmp = '%s.%d.tmp' % (target, os.getpid())
+    with open(tmp, 'w') as file:
+        file.write(text)
+    os.replace(tmp, target)
+    return STUB_WRITTEN
+
+
+def swept_packages(options: Options, py_modules: List[StubSource]) -> List[str]:
+    """Return the packages all the stubs of which are generated by a run.
+
+    These are the packages given with -p and the ones given as directories.
+    """
+    packages = list(options.packages)
+    dirs = {os.path.abspath(path) for path in options.files if os.path.isdir(path)}
+    for mod in py_modules:
+        if (mod.path is not None and os.path.basename(mod.path) == '__init__.py' and
+                os.path.dirname(os.path.abspath(mod.path)) in dirs):
+            packages.append(mod.module)
+    return packages
+
+
+def find_stale_stubs(output_dir: str, packages: List[str], outputs: List[str]) -> List[str]:
+    """Return the stubs of the modules of packages which are not in outputs."""
+    keep = {os.path.normpath(path) for path in outputs}
+    stale = []
+    for package in packages:
+        for dirpath, _, filenames in os.walk(os.path.join(output_dir, *package.split('.'))):
+            for name in filenames:
+                path = os.path.normpath(os.path.join(dirpath, name))
+                if name.endswith('.pyi') and path not in keep:
+                    stale.append(path)
+    return stale
+
+
+def remove_stale_stubs(output_dir: str, packages: List[str], outputs: List[str]) -> int:
+    """Remove the stale stubs (see find_stale_stubs).
+
+    Directories left empty are removed as well. Return the number of stubs removed.
+    """
+    stale = find_stale_stubs(output_dir, packages, outputs)
+    for path in stale:
+        os.remove(path)
+    for package in packages:
+        for dirpath, _, _ in os.walk(os.path.join(output_dir, *package.split('.')),
+                                     topdown=False):
+            if not os.listdir(dirpath):
+                os.rmdir(dirpath)
+    return len(stale)
+
+
+def pluralize(count: int, noun: str) -> str:
+    """Return count followed by noun, in the plural unless count is 1.
+
+    >>> pluralize(1, 'stub'), pluralize(0, 'stub'), pluralize(2, 'stub')
+    ('1 stub', '0 stubs', '2 stubs')
+    """
+    return '%d %s%s' % (count, noun, '' if count == 1 else 's')
+
+
+class StubChecker:
+    """Compare stubs with the ones in the output directory (see --check).
+
+    The differences of the first max_diffs differing stubs are kept.
+    """
+    def __init__(self, max_diffs: int) -> None:
+        self.max_diffs = max_diffs
+        self.checked = 0
+        self.differing = []  # type: List[str]
+        self.diffs = []  # type: List[str]
+
+    def check(self, text: Optional[str], target: str) -> bool:
+        """Compare the stub text (None if there is nothing to stub) with target.
+
+        Return whether they match.
+        """
+        self.checked += 1
+        current = read_stub(target)
+        if text == current:
+            return True
+        self.differing.append(target)
+        if len(self.diffs) < self.max_diffs:
+            fromfile = target if current is not None else '/dev/null'
+            tofile = target if text is not None else '/dev/null'
+            diff = ''.join(difflib.unified_diff(
+                (current or '').splitlines(True), (text or '').splitlines(True),
+                fromfile, tofile))
+            # An empty stub to add or remove has no lines to show.
+            self.diffs.append(diff or '--- %s\n+++ %s\n' % (fromfile, tofile))
+        return False
+
+    def report(self) -> None:
+        """Print the differences, if any, and exit with an error then."""
+        if not self.differing:
+            return
+        for diff in self.diffs:
+            print(diff, end='' if diff.endswith('\n') else '\n')
+        shown = ''
+        if len(self.differing) > len(self.diffs):
+            shown = ' (differences shown for the first %d)' % len(self.diffs)
+        raise SystemExit('Stubs not up to date: %d%s' % (len(self.differing), shown))
+
+
+def render_c_stub(module: str,
+                  sigs: Optional[Dict[str, str]],
+                  class_sigs: Optional[Dict[str, str]]) -> str:
+    """Generate the stub of a C module in memory."""
+    with tempfile.TemporaryDirectory() as tmp:
+        target = os.path.join(tmp, 'stub.pyi')
+        generate_stub_for_c_module(module, target, sigs=sigs, class_sigs=class_sigs)
+        with open(target) as file:
+            return file.read()
+
+
+def generate_stub_from_ast(mod: StubSource,
+                           target: str,
+                           parse_only: bool = False,
+                           pyversion: Tuple[int, int] = defaults.PYTHON3_VERSION,
+                           include_private: bool = False,
+                           export_less: bool = False,
+                           public_api_only: bool = False,
+                           public_api: Optional[PublicAPIIndex] = None,
+                           lookup: Optional[LookupCache] = None) -> None:
+    """Use analysed (or just parsed) AST to generate type stub for single file.
+
+    The stub is written to target by write_stub.
+    """
+    text = render_stub_from_ast(mod, parse_only, pyversion, include_private, export_less,
+                                public_api_only, public_api, lookup)
+    write_stub(text, target)
+
+
+def parse_and_render_stub(mod: StubSource,
+                          mypy_options: MypyOptions,
+                          pyversion: Tuple[int, int],
+                          include_private: bool,
+                          export_less: bool) -> Optional[str]:
+    """Parse a module and render its stub (see --jobs with --parse-only)."""
+    parse_source_file(mod, mypy_options)
+    return render_stub_from_ast(mod, True, pyversion, include_private, export_less)
 
 
 def collect_docs_signatures(doc_dir: str) -> Tuple[Dict[str, str], Dict[str, str]]:
@@ -1748,58 +2875,330 @@ def collect_docs_signatures(doc_dir: str) -> Tuple[Dict[str, str], Dict[str, str
     return sigs, class_sigs
 
 
-def generate_stubs(options: Options) -> None:
-    """Main entry point for the program."""
-    mypy_opts = mypy_options(options)
-    py_modules, c_modules = collect_build_targets(options, mypy_opts)
+def source_fingerprint(py_modules: List[StubSource], options: Options) -> str:
+    """Return a fingerprint of everything stubs for Python modules are generated from.
+
+    This covers the path, content and runtime __all__ of every module, the
+    doxxie and mypy versions and the options.
+    """
+    h = hashlib.sha256()
+    opts = {k: v for k, v in vars(options).items() if k not in NON_OUTPUT_OPTIONS}
+    h.update(json.dumps([doxxie_version(), mypy.version.__version__, opts],
+                        sort_keys=True).encode('utf-8'))
+    for mod in py_modules:
+        h.update(json.dumps([mod.module, mod.path, mod.runtime_all]).encode('utf-8'))
+        if mod.path is not None:
+            with open(mod.path, 'rb') as f:
+                h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()
 
-    # Collect info from docs (if given):
-    sigs = class_sigs = None  # type: Optional[Dict[str, str]]
-    if options.doc_dir:
-        sigs, class_sigs = collect_docs_signatures(options.doc_dir)
 
+def fingerprint_path(output_dir: str) -> str:
+    """Return the path of the fingerprint file stored next to output_dir."""
+    head, tail = os.path.split(os.path.normpath(os.path.abspath(output_dir)))
+    return os.path.join(head, '.%s.fingerprint' % tail)
 
-    # Use parsed sources to generate stubs for Python modules.
-    mypy_files = generate_asts_for_modules(py_modules, options.parse_only, mypy_opts, options.verbose)
+
+def hash_file(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def is_unchanged(output_dir: str, fingerprint: str, packages: List[str]) -> bool:
+    """Are the stubs in output_dir up to date with respect to fingerprint?
+
+    This is the case if the fingerprint of the last run matches, all the
+    stubs it generated are still present and unmodified and there are no
+    other stubs in the given packages (see swept_packages), which a run would
+    remove.
+    """
+    try:
+        with open(fingerprint_path(output_dir)) as f:
+            data = json.load(f)
+        outputs = [os.path.join(output_dir, path) for path in data['outputs']]
+        return (data['fingerprint'] == fingerprint and
+                all(hash_file(os.path.join(output_dir, path)) == digest
+                    for path, digest in data['outputs'].items()) and
+                not find_stale_stubs(output_dir, packages, outputs))
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def write_fingerprint(output_dir: str, fingerprint: str, outputs: List[str]) -> None:
+    """Record the fingerprint of a run which generated the given stubs."""
+    data = {
+        'fingerprint': fingerprint,
+        'outputs': {os.path.relpath(path, output_dir): hash_file(path)
+                    for path in outputs if os.path.isfile(path)},
+    }
+    with open(fingerprint_path(output_dir), 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+
+
+# Parses (and optionally analyzes) Python modules and finds their public API.
+Analyzer = Callable[[List[StubSource], Options, MypyOptions],
+                    Tuple[Optional[Dict[str, MypyFile]], Set[str]]]
+
+
+def analyze_modules(py_modules: List[StubSource],
+                    options: Options,
+                    mypy_opts: MypyOptions) -> Tuple[Optional[Dict[str, MypyFile]], Set[str]]:
+    """Generate the ASTs of Python modules and find the public API (if requested)."""
+    if options.lazy and options.public_api_only and not options.parse_only:
+        return analyze_modules_lazily(py_modules, options, mypy_opts)
+    mypy_files = generate_asts_for_modules(py_modules, options.parse_only, mypy_opts, options.verbose,
+                                           options.prune_bodies)
 
     if options.public_api_only:
-        public_api = find_public_api(py_modules, options.public_api_excludes, mypy_files)
+        graph = build_public_api_graph(py_modules, options.public_api_excludes, mypy_files)
+        write_api_index(options, [graph])
+        public_api = set(graph.names)
     else:
         public_api = set()
+    return mypy_files, public_api
+
+
+def write_api_index(options: Options, graphs: List[SymbolGraph]) -> None:
+    """Write the index of the public API found in graphs if requested (see --api-index)."""
+    if options.api_index:
+        ApiIndex.from_graphs(graphs).save(options.api_index)
+        if options.verbose:
+            print('Wrote the public API index to %s' % options.api_index)
+
+
+def find_owner_module(name: str, modules: Iterable[str]) -> Optional[str]:
+    """Return the module among modules which defines name, if any.
+
+    >>> find_owner_module('pkg.internal.Foo.bar', ['pkg', 'pkg.internal'])
+    'pkg.internal'
+    >>> find_owner_module('pkg.internal', ['pkg', 'pkg.internal'])
+    'pkg.internal'
+    >>> find_owner_module('other.Foo', ['pkg'])
+    """
+    parts = name.split('.')
+    for i in range(len(parts), 0, -1):
+        module = '.'.join(parts[:i])
+        if module in modules:
+            return module
+    return None
+
+
+def find_imported_names(file: MypyFile) -> Dict[str, str]:
+    """Map the names bound by the imports of a module to what they refer to."""
+    names = {}  # type: Dict[str, str]
+    for imp in file.imports:
+        if isinstance(imp, ImportFrom):
+            module, ok = mypy.util.correct_relative_import(
+                file.fullname, imp.relative, imp.id, file.is_package_init_file())
+            for name, alias in imp.names:
+                names[alias or name] = '%s.%s' % (module, name)
+        elif isinstance(imp, Import):
+            for module, alias in imp.ids:
+                if alias:
+                    names[alias] = module
+    return names
+
+
+def analyze_modules_lazily(py_modules: List[StubSource],
+                           options: Options,
+                           mypy_opts: MypyOptions) -> Tuple[Optional[Dict[str, MypyFile]],
+                                                            Set[str]]:
+    """Like analyze_modules but only analyze the modules the public API depends on.
+
+    The analysis starts from the public modules (see is_public_api_module).
+    Internal modules are left out of the build until the public API uses a
+    type they define, in which case they are added and the build is repeated.
+    Modules which are not analyzed are left without an AST.
+    """
+    excludes = options.public_api_excludes
+    exclude_filter = ModuleFilter(excludes)
+    loaded = {mod.module for mod in py_modules
+              if is_public_api_module(mod.module, exclude_filter)}
+    pending = {mod.module for mod in py_modules} - loaded
+    while True:
+        mods = [mod for mod in py_modules if mod.module in loaded]
+        mypy_files = generate_asts_for_modules(mods, False, mypy_opts, options.verbose,
+                                               options.prune_bodies)
+        missing = set()  # type: Set[str]
+        graph = build_public_api_graph(mods, excludes, mypy_files, missing)
+        public_api = set(graph.names)
+        # Internal modules get a stub as soon as something in them is public,
+        # which is also the case of the packages containing them.
+        index = PublicAPIIndex(public_api, loaded)
+        required = {module for module in pending if index.requires(module)}
+        # Unimported names refer to the name bound by the import statement.
+        imported = {}  # type: Dict[str, Dict[str, str]]
+        for name in missing:
+            if mypy_files and name in mypy_files:
+                # Any module imported by name may be the culprit.
+                for imp in mypy_files[name].imports:
+                    if isinstance(imp, Import):
+                        for module_id, _ in imp.ids:
+                            module = find_owner_module(module_id, pending)
+                            if module is not None:
+                                required.add(module)
+                continue
+            importer, _, local = name.rpartition('.')
+            if mypy_files and importer in mypy_files:
+                if importer not in imported:
+                    imported[importer] = find_imported_names(mypy_files[importer])
+                name = imported[importer].get(local, name)
+            module = find_owner_module(name, pending)
+            if module is not None:
+                required.add(module)
+        if not required:
+            write_api_index(options, [graph])
+            return mypy_files, public_api
+        if options.verbose:
+            print('Adding %d internal modules used by the public API' % len(required))
+        loaded |= required
+        pending -= required
+        # Release the previous build before starting the next one.
+        mypy_files = None
+        for mod in mods:
+            mod.ast = None
+
+
+def generate_stubs(options: Options, analyze: Analyzer = analyze_modules) -> None:
+    """Main entry point for the program.
+
+    The analysis of the Python modules can be customized with analyze, which
+    allows long-lived processes (see doxxie._daemon) to reuse previous results.
+    """
+    mypy_opts = mypy_options(options)
+    py_modules, c_modules = collect_build_targets(options, mypy_opts)
+
+    # Stubs for C modules are generated by runtime introspection which can't
+    # be fingerprinted. With --check, the stubs in the output directory are
+    # compared whatever the fingerprint says.
+    fingerprint = None  # type: Optional[str]
+    if options.skip_unchanged and not c_modules and not options.check:
+        fingerprint = source_fingerprint(py_modules, options)
+        if is_unchanged(options.output_dir, fingerprint,
+                        swept_packages(options, py_modules)):
+            if not options.quiet:
+                print('No changes in %d modules, skipping' % len(py_modules))
+            return
+
+    # Collect info from docs (if given):
+    sigs = class_sigs = None  # type: Optional[Dict[str, str]]
+    if options.doc_dir:
+        sigs, class_sigs = collect_docs_signatures(options.doc_dir)
 
     files = []
-    for mod in py_modules:
-        assert mod.path is not None, "Not found module was not skipped"
-        target = mod.module.replace('.', '/')
-        if os.path.basename(mod.path) == '__init__.py':
-            target += '/__init__.pyi'
-        else:
-            target += '.pyi'
-        target = os.path.join(options.output_dir, target)
-        files.append(target)
-        with generate_guarded(mod.module, target, options.ignore_errors, options.verbose):
-            generate_stub_from_ast(mod, target,
-                                   options.parse_only, options.pyversion,
-                                   options.include_private,
-                                   options.export_less,
-                                   options.public_api_only,
-                                   public_api,
-                                   mypy_files)
-
-    # Separately analyse C modules using different logic.
-    for mod in c_modules:
-        if any(py_mod.module.startswith(mod.module + '.')
-               for py_mod in py_modules + c_modules):
-            target = mod.module.replace('.', '/') + '/__init__.pyi'
+    num_generated = 0
+    # Number of stubs by what was done to them (see write_stub).
+    num_stubs = defaultdict(int)  # type: Dict[Optional[str], int]
+    pool = None  # type: Optional[ProcessPoolExecutor]
+    # Stubs rendered by worker processes, by module. They are written below,
+    # in order.
+    rendered = None  # type: Optional[Dict[str, Callable[[], Optional[str]]]]
+    lookup = None  # type: Optional[LookupCache]
+    if options.parse_only and options.jobs > 1 and not options.public_api_only:
+        # Modules are parsed independently of each other, so both parsing and
+        # rendering are done by the workers.
+        pool = ProcessPoolExecutor(max_workers=options.jobs)
+        rendered = {mod.module: pool.submit(parse_and_render_stub, mod, mypy_opts,
+                                            options.pyversion, options.include_private,
+                                            options.export_less).result
+                    for mod in py_modules}
+    elif options.sharded and options.jobs > 1 and not options.parse_only:
+        from doxxie._sharded import render_sharded
+        rendered = render_sharded(py_modules, options, mypy_opts)
+    else:
+        # Use parsed sources to generate stubs for Python modules.
+        mypy_files, public_api = analyze(py_modules, options, mypy_opts)
+        index = PublicAPIIndex(public_api, [mod.module for mod in py_modules])
+        lookup = LookupCache(mypy_files or {})
+        if options.jobs > 1 and len(py_modules) > 1:
+            from doxxie._emit import render_forked
+            rendered = render_forked(py_modules, options, index, lookup)
+
+    # With --check, stubs are compared with the ones in the output directory
+    # and nothing is written.
+    checker = StubChecker(options.check_diffs) if options.check else None
+    # Stubs are written to a staging copy of the output directory which
+    # replaces it once they are all written (see doxxie._staging).
+    with StagedOutput(options.output_dir, stage=checker is None) as output:
+        try:
+            for mod in py_modules:
+                assert mod.path is not None, "Not found module was not skipped"
+                if mod.ast is None and (rendered is None or mod.module not in rendered):
+                    # Left out by the lazy analysis, nothing in it is public.
+                    continue
+                target = mod.module.replace('.', '/')
+                if os.path.basename(mod.path) == '__init__.py':
+                    target += '/__init__.pyi'
+                else:
+                    target += '.pyi'
+                target = os.path.join(options.output_dir, target)
+                files.append(target)
+                with generate_guarded(mod.module, target, options.ignore_errors,
+                                      options.verbose):
+                    if rendered is not None:
+                        text = rendered[mod.module]()
+                    else:
+                        text = render_stub_from_ast(mod,
+                                                    options.parse_only, options.pyversion,
+                                                    options.include_private,
+                                                    options.export_less,
+                                                    options.public_api_only,
+                                                    index,
+                                                    lookup)
+                    num_generated += 1
+                    if checker is None:
+                        num_stubs[write_stub(text, output.path(target))] += 1
+                    elif not checker.check(text, target) and options.fail_fast:
+                        break
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        if options.verbose and lookup is not None:
+            print('Symbol lookups: %d hits, %d misses' % (lookup.hits, lookup.misses))
+
+        # Separately analyse C modules using different logic.
+        for mod in c_modules:
+            if checker is not None and checker.differing and options.fail_fast:
+                break
+            if any(py_mod.module.startswith(mod.module + '.')
+                   for py_mod in py_modules + c_modules):
+                target = mod.module.replace('.', '/') + '/__init__.pyi'
+            else:
+                target = mod.module.replace('.', '/') + '.pyi'
+            target = os.path.join(options.output_dir, target)
+            files.append(target)
+            with generate_guarded(mod.module, target, options.ignore_errors, options.verbose):
+                if checker is not None:
+                    checker.check(render_c_stub(mod.module, sigs, class_sigs), target)
+                    continue
+                staged = output.path(target)
+                if staged != target and os.path.isfile(staged):
+                    # Don't write through a link to the current stub.
+                    os.remove(staged)
+                generate_stub_for_c_module(mod.module, staged, sigs=sigs, class_sigs=class_sigs)
+        if checker is not None:
+            if not (checker.differing and options.fail_fast):
+                for path in find_stale_stubs(options.output_dir,
+                                             swept_packages(options, py_modules), files):
+                    checker.check(None, path)
         else:
-            target = mod.module.replace('.', '/') + '.pyi'
-        target = os.path.join(options.output_dir, target)
-        files.append(target)
-        with generate_guarded(mod.module, target, options.ignore_errors, options.verbose):
-            generate_stub_for_c_module(mod.module, target, sigs=sigs, class_sigs=class_sigs)
+            num_stubs[STUB_WRITTEN] += len(c_modules)
+            num_stubs[STUB_REMOVED] += remove_stale_stubs(output.path(options.output_dir),
+                                                          swept_packages(options, py_modules),
+                                                          [output.path(path) for path in files])
+    if checker is not None:
+        checker.report()
+        if not options.quiet:
+            print('Checked %s, all up to date' % pluralize(checker.checked, 'stub'))
+        return
+    if fingerprint is not None and num_generated == len(files):
+        write_fingerprint(options.output_dir, fingerprint, files)
     num_modules = len(py_modules) + len(c_modules)
     if not options.quiet and num_modules > 0:
         print('Processed %d modules' % num_modules)
+        print('Wrote %s, %d unchanged, %d removed' % (pluralize(num_stubs[STUB_WRITTEN], 'stub'),
+                                                     num_stubs[STUB_UNCHANGED],
+                                                     num_stubs[STUB_REMOVED]))
         if len(files) == 1:
             print('Generated %s' % files[0])
         else:
@@ -1854,7 +3253,10 @@ def parse_options(args: List[str]) -> Options:
                         help="use Python interpreter at PATH (only works for "
                              "Python 2 right now)")
     parser.add_argument('-o', '--output', metavar='PATH', dest='output_dir', default='out',
-                        help="change the output directory [default: %(default)s]")
+                        help="change the output directory; stubs are written to a copy of "
+                             "it (hard links) which replaces it with two renames at the end "
+                             "of a successful run, it is missing between the renames "
+                             "[default: %(default)s]")
     parser.add_argument('-m', '--module', action='append', metavar='MODULE',
                         dest='modules', default=[],
                         help="generate stub for module; can repeat for more modules")
@@ -1866,6 +3268,64 @@ def parse_options(args: List[str]) -> Options:
     parser.add_argument('-e', '--public-api-exclude',  action='append', dest='public_api_excludes',
                         default=[],
                         help="only generate the public API")
+    parser.add_argument('-j', '--jobs', type=int, metavar='N', default=1,
+                        help="number of workers of each stage: N modules given with -m/-p "
+                             "are imported at a time, then N processes parse and render "
+                             "the modules with --parse-only, analyze and render shards of "
+                             "the package with --sharded, or render the stubs of the "
+                             "analyzed package otherwise (forked, where supported) "
+                             "[default: %(default)s]")
+    parser.add_argument('--import-timeout', type=float, metavar='SECONDS',
+                        help="look for a module in the file system instead, with a warning, "
+                             "if importing it takes longer than SECONDS; its runtime __all__ "
+                             "is then unknown [default: no timeout]")
+    parser.add_argument('--sharded', action='store_true',
+                        help="split the semantic analysis between the --jobs workers along "
+                             "the import graph of the package; each worker also analyzes "
+                             "what its modules import, so this only saves time on loosely "
+                             "coupled packages")
+    parser.add_argument('--lazy', action='store_true',
+                        help="with --public-api-only, only analyze the internal modules "
+                             "which define types used by the public API")
+    parser.add_argument('--incremental', action='store_true',
+                        help="cache the analysis of dependencies (builtins, typing, ...) "
+                             "and the runtime introspection of modules across runs; the "
+                             "package itself is always analyzed")
+    parser.add_argument('--cache-dir', metavar='PATH', default=DEFAULT_CACHE_DIR,
+                        help="store the incremental cache in PATH [default: %(default)s]")
+    parser.add_argument('--prune-bodies', action='store_true',
+                        help="strip function bodies down to their attribute initializers "
+                             "before semantic analysis (faster, uses less memory)")
+    parser.add_argument('--skip-unchanged', action='store_true',
+                        help="don't generate stubs if neither the sources nor the options "
+                             "changed since the last run (tracked in a fingerprint file "
+                             "next to the output directory)")
+    parser.add_argument('--check', action='store_true',
+                        help="don't write anything, exit with an error and show the "
+                             "differences if the stubs in the output directory are not up to "
+                             "date")
+    parser.add_argument('--check-diffs', type=int, metavar='N', default=DEFAULT_CHECK_DIFFS,
+                        help="with --check, show the differences of the first N stubs which "
+                             "are not up to date [default: %(default)s]")
+    parser.add_argument('--fail-fast', action='store_true',
+                        help="with --check, stop at the first stub which is not up to date")
+    parser.add_argument('--api-index', action='store_true',
+                        help="with --public-api-only, also write an index of what exposes "
+                             "each symbol of the public API, for use by --impact and --why")
+    parser.add_argument('--api-index-path', metavar='PATH',
+                        help="write the public API index to PATH, implies --api-index "
+                             "[default: %s]" % DEFAULT_API_INDEX)
+    commands = parser.add_argument_group(
+        'commands', "given as the first argument, these run instead of generating stubs")
+    commands.add_argument('--daemon', metavar='COMMAND', nargs=argparse.REMAINDER,
+                          help="run a daemon command: start, stop or run -- [doxxie "
+                               "arguments] (see --daemon -h)")
+    commands.add_argument('--impact', metavar='NAME',
+                          help="list the entries of the public API exposing NAME, from the "
+                               "index written by --api-index")
+    commands.add_argument('--why', metavar='NAME',
+                          help="show the shortest chains of references making NAME public, "
+                               "from the index written by --api-index")
     parser.add_argument(metavar='files', nargs='*', dest='files',
                         help="generate stubs for given files or directories")
 
@@ -1874,13 +3334,31 @@ def parse_options(args: List[str]) -> Options:
     pyversion = defaults.PYTHON2_VERSION if ns.py2 else defaults.PYTHON3_VERSION
     if not ns.interpreter:
         ns.interpreter = sys.executable if pyversion[0] == 3 else default_py2_interpreter()
+    for command in ('daemon', 'impact', 'why'):
+        if getattr(ns, command) is not None:
+            parser.error('--%s must be the first argument' % command)
     if ns.modules + ns.packages and ns.files:
         parser.error("May only specify one of: modules/packages or files.")
     if ns.quiet and ns.verbose:
         parser.error('Cannot specify both quiet and verbose messages')
+    if ns.jobs < 1:
+        parser.error('The number of jobs must be at least 1')
+    if ns.sharded and ns.lazy:
+        parser.error('Cannot specify both sharded and lazy analysis')
+    if ns.api_index_path is not None:
+        ns.api_index = True
+    api_index = (ns.api_index_path or DEFAULT_API_INDEX) if ns.api_index else None
+    if api_index is not None and not ns.public_api_only:
+        parser.error('The public API index requires --public-api-only')
+    if api_index is not None and os.path.isdir(api_index):
+        parser.error('The public API index %s is a directory' % api_index)
+    if ns.fail_fast and not ns.check:
+        parser.error('--fail-fast requires --check')
+    if ns.check_diffs < 0:
+        parser.error('The number of differences to show must not be negative')
 
     # Create the output folder if it doesn't already exist.
-    if not os.path.exists(ns.output_dir):
+    if not os.path.exists(ns.output_dir) and not ns.check:
         os.makedirs(ns.output_dir)
 
     return Options(pyversion=pyversion,
@@ -1899,11 +3377,34 @@ def parse_options(args: List[str]) -> Options:
                    quiet=ns.quiet,
                    export_less=ns.export_less,
                    public_api_only=ns.public_api_only,
-                   public_api_excludes=ns.public_api_excludes)
+                   public_api_excludes=ns.public_api_excludes,
+                   incremental=ns.incremental,
+                   cache_dir=ns.cache_dir,
+                   skip_unchanged=ns.skip_unchanged,
+                   prune_bodies=ns.prune_bodies,
+                   lazy=ns.lazy,
+                   jobs=ns.jobs,
+                   sharded=ns.sharded,
+                   import_timeout=ns.import_timeout,
+                   api_index=api_index,
+                   check=ns.check,
+                   check_diffs=ns.check_diffs,
+                   fail_fast=ns.fail_fast)
 
 
 def main() -> None:
     mypy.util.check_python_version('stubgen')
+    # The commands are options rather than positional arguments, which could
+    # be the name of a file or package (see parse_options).
+    if sys.argv[1:2] == ['--daemon']:
+        from doxxie._daemon import main as daemon_main
+        daemon_main(sys.argv[2:])
+        return
+    if sys.argv[1:2] in (['--impact'], ['--why']):
+        from doxxie._apiindex import main as index_main
+        index_main(sys.argv[1:])
+        return
+
     # Make sure that the current directory is in sys.path so that
     # stubgen can be run on packages in the current directory.
     if not ('' in sys.path or '.' in sys.path):
@@ -0,0 +1,89 @@
+"""Compact graph of the symbols of a public API and of the references between them.
+
+Symbols are interned as consecutive integer ids and the references are stored
+in compressed sparse row (CSR) form: the successors of the symbol ``i`` are
+``targets[offsets[i]:offsets[i + 1]]``. Ids are handed out in breadth-first
+order from the roots and symbols are expanded in id order, which lets the
+edges be appended as the graph is discovered.
+
+The graph only stores what was found: the symbols referenced by a symbol are
+discovered by whoever expands it (see build_public_api_graph), by name, and
+the ids and the CSR edges then keep the public API and the references for
+the API index (see doxxie._apiindex) without a string per reference.
+"""
+
+from array import array
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Tuple
+
+
+# The symbol is part of the initial public API.
+FLAG_ROOT = 1
+
+
+class SymbolGraph:
+    """Interned symbols with their references to each other.
+
+    >>> g = SymbolGraph()
+    >>> g.intern("pkg.f", FLAG_ROOT), g.intern("pkg.C"), g.intern("pkg.f")
+    (0, 1, 0)
+    >>> g.expand([1, 1])  # pkg.f references pkg.C
+    0
+    >>> g.expand([g.intern("pkg.C.m"), 0])
+    1
+    >>> g.expand([])
+    2
+    >>> g.is_complete()
+    True
+    >>> [g.names[i] for i in g.successors(1)], g.is_root(0), g.is_root(1)
+    (['pkg.C.m', 'pkg.f'], True, False)
+    """
+
+    def __init__(self) -> None:
+        self.ids: Dict[str, int] = {}
+        self.names: List[str] = []
+        self.flags = bytearray()
+        self.offsets = array("l", [0])
+        self.targets = array("l")
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def intern(self, name: str, flags: int = 0) -> int:
+        """Return the id of the symbol name, adding it if needed."""
+        i = self.ids.get(name)
+        if i is None:
+            i = self.ids[name] = len(self.names)
+            self.names.append(name)
+            self.flags.append(flags)
+        return i
+
+    def next_unexpanded(self) -> int:
+        """Return the id of the next symbol to expand (len(self) if none)."""
+        return len(self.offsets) - 1
+
+    def is_complete(self) -> bool:
+        return self.next_unexpanded() == len(self.names)
+
+    def expand(self, targets: Iterable[int]) -> int:
+        """Record the references of the next symbol to expand and return its id."""
+        i = self.next_unexpanded()
+        self.targets.extend(dict.fromkeys(targets))
+        self.offsets.append(len(self.targets))
+        return i
+
+    def edges(self) -> Iterator[Tuple[int, int]]:
+        """Yield the references of the expanded symbols as (source, target) ids."""
+        for i in range(self.next_unexpanded()):
+            for j in self.successors(i):
+                yield i, j
+
+    def successors(self, i: int) -> "array[int]":
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.targets[start:end]
+
+    def is_root(self, i: int) -> bool:
+        return bool(self.flags[i] & FLAG_ROOT)
@@ -0,0 +1,72 @@
+"""Collection of the classes referenced by types."""
+
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Tuple
+
+from mypy.nodes import TypeInfo
+from mypy.type_visitor import TypeQuery
+from mypy.types import Instance
+from mypy.types import TupleType
+from mypy.types import Type
+from mypy.types import TypedDictType
+
+
+def _concat(results: Iterable[List[TypeInfo]]) -> List[TypeInfo]:
+    return [info for result in results for info in result]
+
+
+class _TypeInfoQuery(TypeQuery[List[TypeInfo]]):
+    """Find the classes of all the instances in a type, at any depth."""
+
+    def __init__(self) -> None:
+        super().__init__(_concat)
+
+    def visit_instance(self, t: Instance) -> List[TypeInfo]:
+        return [t.type] + self.query_types(t.args)
+
+    def visit_tuple_type(self, t: TupleType) -> List[TypeInfo]:
+        # The fallback of a named tuple is its class.
+        return self.query_types(t.items) + [t.partial_fallback.type]
+
+    def visit_typeddict_type(self, t: TypedDictType) -> List[TypeInfo]:
+        # The fallback of a class-based TypedDict is its class.
+        return [t.fallback.type] + self.query_types(t.items.values())
+
+
+class TypeInfoCollector:
+    """Return the classes referenced by a type, in order and without duplicates.
+
+    Unlike str(), this goes through unions, generics, callables, tuples,
+    type aliases and TypedDicts at any depth and yields the classes
+    themselves, so there is nothing to look up again. Results are cached by
+    type object since the same types tend to be shared by many symbols.
+
+    >>> from mypy.nodes import Block, ClassDef, SymbolTable
+    >>> from mypy.types import UnionType
+    >>> def info(name):
+    ...     cls = ClassDef(name, Block([]))
+    ...     cls.fullname = "pkg." + name
+    ...     return TypeInfo(SymbolTable(), cls, "pkg")
+    >>> a, b = info("A"), info("B")
+    >>> typ = UnionType([Instance(a, [Instance(b, [])]), Instance(b, [])])
+    >>> collect = TypeInfoCollector()
+    >>> [i.fullname for i in collect(typ)]
+    ['pkg.A', 'pkg.B']
+    >>> collect(typ) is collect(typ)
+    True
+    """
+
+    def __init__(self) -> None:
+        # The type is kept alive so that its id can't be reused.
+        self._cache: Dict[int, Tuple[Type, List[TypeInfo]]] = {}
+
+    def __call__(self, typ: Type) -> List[TypeInfo]:
+        cached = self._cache.get(id(typ))
+        if cached is not None:
+            return cached[1]
+        found: List[TypeInfo] = typ.accept(_TypeInfoQuery())
+        infos = list(dict.fromkeys(found))
+        self._cache[id(typ)] = (typ, infos)
+        return infos
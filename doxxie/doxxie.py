@@ -1,13 +1,14 @@
 import atexit
+from collections import deque
 from collections.abc import Collection
 from collections.abc import Mapping
 import logging
 import os
 import pprint
+from typing import Deque
 from typing import Dict
 from typing import List
 from typing import Optional
-from typing import Sequence
 from typing import Set
 from typing import Tuple
 from typing import Type
@@ -23,12 +24,11 @@ from mypy.nodes import Var
 from mypy.options import Options
 from mypy.plugin import Plugin
 from mypy.types import CallableType
-from mypy.types import Instance
-from mypy.types import NoneType  # noqa used doctest
-from mypy.types import TupleType
-from mypy.types import Type as MypyType
-from mypy.types import TypeList
-from mypy.types import UnionType
+
+from ._apiindex import ApiIndex
+from ._filter import ModuleFilter
+from ._lookup import LookupCache
+from ._typerefs import TypeInfoCollector
 
 
 log = logging.getLogger(__name__)
@@ -37,6 +37,33 @@ log = logging.getLogger(__name__)
 _ALL = object()
 
 
+# A member of the public API and the name of the member it was derived from
+# (None for the members of the initial public API).
+_Derivation = Tuple[SymbolTableNode, Optional[str]]
+
+
+def _derivation(public_api: Dict[str, _Derivation], fullname: str) -> List[str]:
+    """Return the chain of members leading to fullname from the initial API.
+
+    The chain stops short of a member already in it, should the parents form
+    a cycle.
+
+    >>> node = SymbolTableNode(0, None)
+    >>> api = {"a": (node, None), "b": (node, "a"), "c": (node, "b")}
+    >>> _derivation(api, "c"), _derivation(api, "a")
+    (['a', 'b', 'c'], ['a'])
+    """
+    chain = []
+    seen = set()
+    name: Optional[str] = fullname
+    while name is not None and name not in seen:
+        seen.add(name)
+        chain.append(name)
+        name = public_api[name][1]
+    chain.reverse()
+    return chain
+
+
 def _pick(base: Mapping, pick: Collection) -> Mapping:
     """Pick the elements of `pick` that are in `base` recursively.
     >>> _pick({"a": {"b": 3, "c": 4}}, {"a": {"b"}})
@@ -87,22 +114,32 @@ class MypyPlugin(Plugin):
         self._deriv_outfile: Optional[str] = os.environ.get(
             "DOXXIE_DERIVE_OUTFILE", None
         )
+        # Index of the references of the public API for `doxxie --why/--impact`.
+        self._index_outfile: Optional[str] = os.environ.get(
+            "DOXXIE_INDEX_OUTFILE", None
+        )
 
         includes = os.environ.get("DOXXIE_INCLUDES", includes)
         self._includes: List[str] = includes.split(",") if includes else []
+        self._include_filter = ModuleFilter(self._includes)
 
         excludes = os.environ.get("DOXXIE_EXCLUDES", excludes)
         self._excludes: List[str] = excludes.split(",") if excludes else []
+        self._exclude_filter = ModuleFilter(self._excludes)
         self._outfile = os.environ.get("DOXXIE_OUTFILE", out)
         log.debug(
-            "doxxie initialized with includes=%r, excludes=%r, outfile=%r, derivfile=%r",
+            "doxxie initialized with includes=%r, excludes=%r, outfile=%r, "
+            "derivfile=%r, indexfile=%r",
             self._includes,
             self._excludes,
             self._outfile,
             self._deriv_outfile,
+            self._index_outfile,
         )
 
         self._api_hints: Set[str] = set()
+        # Lookups are only cached once all the modules are analyzed (see _done).
+        self._lookup_cache: Optional[LookupCache] = None
 
         # A bit of a hack since mypy plugins don't get a hook for when all the
         # checking is complete.
@@ -116,8 +153,10 @@ class MypyPlugin(Plugin):
         True
         >>> MypyPlugin(Options(), includes="mod")._in_includes("mod._internal")
         True
+        >>> MypyPlugin(Options(), includes="mod")._in_includes("module.fn")
+        False
         """
-        return any(name.startswith(i) for i in self._includes)
+        return name in self._include_filter
 
     @staticmethod
     def _is_private_mod(fullname: str) -> bool:
@@ -210,24 +249,12 @@ class MypyPlugin(Plugin):
         True
         >>> MypyPlugin(Options(), excludes="mod.internal")._in_excluded("mod.internal.x")
         True
+        >>> MypyPlugin(Options(), excludes="mod.internal")._in_excluded("mod.internals")
+        False
+        >>> MypyPlugin(Options(), excludes="mod.*.tests")._in_excluded("mod.sub.tests.x")
+        True
         """
-        return any(fullname.startswith(e) for e in self._excludes)
-
-    @staticmethod
-    def _get_types(typ: MypyType) -> Sequence[MypyType]:
-        """Get all possible types that are used in a type.
-        >>> MypyPlugin._get_types(UnionType(items=[NoneType(), NoneType()]))
-        [None, None]
-        """
-        if isinstance(typ, (UnionType, TypeList, TupleType)):
-            return typ.items
-        # Handle Dict, List, etc
-        elif isinstance(typ, Instance):
-            # Note that typ is included as well since we don't know if the type
-            # is a user defined type.
-            # eg. InternalType[OtherInternalType]
-            return [typ, *typ.args]
-        return [typ]
+        return fullname in self._exclude_filter
 
     def _initial_public_api(self) -> Dict[str, SymbolTableNode]:
         """Generate the initial public API.
@@ -242,7 +269,7 @@ class MypyPlugin(Plugin):
         hints = [h for h in self._api_hints if not self._in_excluded(h)]
         api = {}
         for name in hints:
-            node = self.lookup_fully_qualified(name)
+            node = self._lookup(name)
             if not node or not node.fullname:
                 continue
             if isinstance(node.node, TypeInfo):
@@ -269,47 +296,46 @@ class MypyPlugin(Plugin):
         return api
 
     def _expand_api(
-        self, api: Dict[str, SymbolTableNode]
-    ) -> Dict[str, List[SymbolTableNode]]:
-        """Expand the given API to include all exposed types."""
-        # The resulting public API. The derivation of each member is stored so
-        # that it can also be output. The last node in the list is the node
-        # associated with the key.
-        public_api: Dict[str, List[SymbolTableNode]] = {}
-
-        # List of nodes to process, starting with the initial API.
-        to_add: List[Tuple[List[SymbolTableNode], Optional[SymbolTableNode]]] = [
-            ([], node) for node in api.values()
-        ]
+        self,
+        api: Dict[str, SymbolTableNode],
+        edges: Optional[List[Tuple[str, str]]] = None,
+    ) -> Dict[str, _Derivation]:
+        """Expand the given API to include all exposed types.
+
+        If given, edges is filled with all the references between the members
+        as (source, target) pairs, not only the ones of the derivations.
+        """
+        # The resulting public API. The member each member is derived from is
+        # stored so that derivations can also be output (see _derivation).
+        public_api: Dict[str, _Derivation] = {}
+        collect_type_infos = TypeInfoCollector()
+
+        # Nodes to process along with the member they are derived from,
+        # starting with the initial API.
+        to_add: Deque[Tuple[Optional[str], Optional[SymbolTableNode]]] = deque(
+            (None, node) for node in api.values()
+        )
         while to_add:
-            chain, node = to_add.pop(0)
+            parent, node = to_add.popleft()
 
+            if not node or not node.fullname:
+                continue
+            if edges is not None and parent is not None:
+                edges.append((parent, node.fullname))
             # Shortcut already seen items.
-            if not node or not node.fullname or node.fullname in public_api:
+            if node.fullname in public_api:
                 continue
 
-            # Ensure to make a copy of the chain else it could be mutated later on.
-            chain = chain.copy()
-            chain.append(node)
-            public_api[node.fullname] = chain
+            public_api[node.fullname] = (node, parent)
+            parent = node.fullname
             # TODO: probably have to use mypy.nodes.SYMBOL_FUNCBASE_TYPES here
             # to be safe.
             if isinstance(node.node, (FuncDef, Decorator)):
                 if node.type and isinstance(node.type, CallableType):
-                    # Handle the return type.
-                    types = map(str, self._get_types(node.type.ret_type))
-                    for stype in types:
-                        if self._in_includes(stype):
-                            to_add.append((chain, self.lookup_fully_qualified(stype)))
-
-                    # Handle argument types.
-                    for argtype in node.type.arg_types:
-                        types = map(str, self._get_types(argtype))
-                        for stype in types:
-                            if self._in_includes(stype):
-                                to_add.append(
-                                    (chain, self.lookup_fully_qualified(stype))
-                                )
+                    # Handle the return and argument types.
+                    for info in collect_type_infos(node.type):
+                        if self._in_includes(info.fullname):
+                            to_add.append((parent, self._lookup(info.fullname)))
             # TypeInfo is used for classes.
             elif isinstance(node.node, TypeInfo):
                 clsfullname = node.fullname
@@ -317,33 +343,38 @@ class MypyPlugin(Plugin):
                     fullname = f"{clsfullname}.{name}"
                     if self._is_private_attr(fullname):
                         continue
-                    to_add.append((chain, self.lookup_fully_qualified(fullname)))
+                    to_add.append((parent, self._lookup(fullname)))
                 for n in node.node.mro:
                     if n.fullname and self._in_includes(n.fullname):
-                        to_add.append((chain, self.lookup_fully_qualified(n.fullname)))
+                        to_add.append((parent, self._lookup(n.fullname)))
 
             elif isinstance(node.node, Var):
                 if not node.type:
                     continue
-                types = map(str, self._get_types(node.type))
-                for stype in list(types):
-                    if self._in_includes(stype):
-                        to_add.append((chain, self.lookup_fully_qualified(stype)))
+                for info in collect_type_infos(node.type):
+                    if self._in_includes(info.fullname):
+                        to_add.append((parent, self._lookup(info.fullname)))
             else:
                 # TODO: anything to handle here?
                 log.debug("%r not yet supported", node.node)
         return public_api
 
+    def _lookup(self, fullname: str) -> Optional[SymbolTableNode]:
+        if self._lookup_cache is None:
+            return self.lookup_fully_qualified(fullname)
+        return self._lookup_cache(fullname)
+
     def _done(self) -> None:
+        # No modules are set if mypy didn't get to run the plugin.
+        self._lookup_cache = LookupCache(self._modules or {})
         initial_api = self._initial_public_api()
         log.debug("initial public api %r", initial_api)
-        public_api = self._expand_api(initial_api)
+        edges: Optional[List[Tuple[str, str]]] = [] if self._index_outfile else None
+        public_api = self._expand_api(initial_api, edges)
 
         # Generate the public API output.
         public_api_output = {}
-        for k, c in public_api.items():
-            # Last element is the actual node.
-            node = c[-1]
+        for k, (node, _) in public_api.items():
             fullname = node.fullname
             if not fullname:
                 continue
@@ -396,14 +427,18 @@ class MypyPlugin(Plugin):
                 public_api_output[k] = out["node"]
 
         log.debug("public api %r", public_api_output)
+        log.debug("symbol lookups %r", self._lookup_cache)
         with open(self._outfile, "w") as f:
             pprint.pprint(public_api_output, stream=f, width=80)
 
+        if self._index_outfile:
+            assert edges is not None
+            roots = [node.fullname for node in initial_api.values() if node.fullname]
+            ApiIndex.from_edges(roots, edges).save(self._index_outfile)
+
         if self._deriv_outfile:
             with open(self._deriv_outfile, "w") as f:
-                derived_public_api = {
-                    k: [_.fullname for _ in c] for k, c in public_api.items()
-                }
+                derived_public_api = {k: _derivation(public_api, k) for k in public_api}
                 pprint.pprint(derived_public_api, stream=f, width=80)
         return
 
@@ -1,7 +1,5 @@
-from mypy.nodes import SymbolTableNode as SymbolTableNode
 from mypy.options import Options as Options
 from mypy.plugin import Plugin
-from mypy.types import NoneType as NoneType
 from typing import Any, Type
 
 log: Any
@@ -1,5 +1,6 @@
 from typing import Callable
 from typing import Dict
+from typing import List
 from typing import Union
 
 from pkg.internal import ExposedClass2
@@ -12,6 +13,8 @@ from pkg.internal import ExposedClass9
 from pkg.internal import ExposedClass10
 from pkg.internal import ExposedClass11
 from pkg.internal import ExposedClass12
+from pkg.internal import ExposedClass13
+from pkg.internal import ExposedClass14
 from pkg.internal import InternalClass
 from pkg.internal import _InternalClass
 
@@ -66,6 +69,12 @@ def fn_takes_fn(fn: Callable[[int, int], float]) -> float:
     return fn(1, 2)
 
 
+def public_function_nested_internal_types(
+    fn: Callable[[ExposedClass13], None],
+) -> Dict[str, List[ExposedClass14]]:
+    return {}
+
+
 var = ExposedClass8()
 
 pub_var1 = pub_var2 = ExposedClass12()
@@ -109,3 +109,13 @@ class ExposedClass11:
 
 class ExposedClass12:
     pass
+
+
+class ExposedClass13:
+    def public_method(self):
+        pass
+
+
+class ExposedClass14:
+    def public_method(self):
+        pass
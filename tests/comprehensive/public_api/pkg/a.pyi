@@ -1,5 +1,5 @@
-from pkg.internal import ExposedClass10, ExposedClass3, ExposedClass5, ExposedClass6, ExposedClass7, ExposedClass9
-from typing import Any, Callable, Union
+from pkg.internal import ExposedClass10, ExposedClass13, ExposedClass14, ExposedClass3, ExposedClass5, ExposedClass6, ExposedClass7, ExposedClass9
+from typing import Any, Callable, Dict, List, Union
 
 class A:
     a: Any = ...
@@ -16,6 +16,7 @@ class A:
 def hello() -> int: ...
 def public_function_internal_return() -> ExposedClass9: ...
 def fn_takes_fn(fn: Callable[[int, int], float]) -> float: ...
+def public_function_nested_internal_types(fn: Callable[[ExposedClass13], None]) -> Dict[str, List[ExposedClass14]]: ...
 
 var: Any
 pub_var1: Any
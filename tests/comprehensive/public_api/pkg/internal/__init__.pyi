@@ -28,3 +28,9 @@ class ExposedClass10:
 
 class ExposedClass11:
     def public_method(self) -> None: ...
+
+class ExposedClass13:
+    def public_method(self) -> None: ...
+
+class ExposedClass14:
+    def public_method(self) -> None: ...
@@ -0,0 +1,102 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from doxxie._apiindex import ApiIndex
+from doxxie._apiindex import DEFAULT_API_INDEX
+from doxxie._apiindex import main
+from doxxie._stubgen import parse_options
+
+from .utils import read_file
+from .utils import run_doxxie
+from .utils import write_files
+
+
+def test_api_index_option(tmp_path: Path) -> None:
+    out = str(tmp_path / "out")
+    options = parse_options(["--public-api-only", "-o", out, "--api-index", "pkg"])
+    assert options.api_index == DEFAULT_API_INDEX
+    assert options.files == ["pkg"]
+
+    path = str(tmp_path / "index")
+    options = parse_options(["--public-api-only", "-o", out, "--api-index-path", path])
+    assert options.api_index == path
+
+    options = parse_options(["--public-api-only", "-o", out, "pkg"])
+    assert options.api_index is None
+
+    with pytest.raises(SystemExit):
+        parse_options(["-o", out, "--api-index", "pkg"])
+    with pytest.raises(SystemExit):
+        parse_options(
+            ["--public-api-only", "-o", out, "--api-index-path", str(tmp_path), "pkg"]
+        )
+
+
+def test_save_failure_leaves_no_temporary_file(tmp_path: Path) -> None:
+    index = ApiIndex.from_edges(["pkg.f"], [("pkg.f", "pkg.A")])
+    path = str(tmp_path / "index")
+    os.mkdir(path)
+    with pytest.raises(OSError):
+        index.save(path)
+    assert os.listdir(str(tmp_path)) == ["index"]
+
+    os.rmdir(path)
+    index.save(path)
+    assert ApiIndex.load(path).exposed_by("pkg.A") == ["pkg.f"]
+    assert os.listdir(str(tmp_path)) == ["index"]
+
+
+def test_why(tmp_path: Path, capsys: "pytest.CaptureFixture[str]") -> None:
+    index = ApiIndex.from_edges(
+        ["pkg.f", "pkg.g"],
+        [
+            ("pkg.f", "pkg.A"),
+            ("pkg.A", "pkg.B"),
+            ("pkg.B", "pkg.A"),
+            ("pkg.g", "pkg.B"),
+            ("pkg.C", "pkg.D"),
+        ],
+    )
+    # References going around in circles don't make chains longer.
+    assert index.why("pkg.A") == [["pkg.f", "pkg.A"]]
+    assert index.why("pkg.B") == [["pkg.g", "pkg.B"]]
+    assert index.why("pkg.f") == [["pkg.f"]]
+    # Symbols which no entry of the public API reaches have no chains.
+    assert index.why("pkg.D") == []
+    with pytest.raises(KeyError):
+        index.why("pkg.missing")
+
+    path = str(tmp_path / "index")
+    index.save(path)
+    main(["--why", "pkg.A", "--index", path])
+    assert capsys.readouterr().out == "pkg.f -> pkg.A\n"
+    with pytest.raises(SystemExit) as e:
+        main(["--why", "pkg.missing", "--index", path])
+    assert e.value.code == "pkg.missing is not part of the public API"
+
+
+def test_packages_named_like_commands(tmp_path: Path) -> None:
+    # The commands are options, so packages can have their names.
+    root = str(tmp_path)
+    write_files(
+        root,
+        {
+            "daemon/__init__.py": "def d() -> int:\n    return 0\n",
+            "why/__init__.py": "def w() -> int:\n    return 0\n",
+        },
+    )
+    for package in ("daemon", "why"):
+        proc = run_doxxie(root, package, "--public-api-only", "-o", "out")
+        assert proc.returncode == 0, proc.stderr
+    assert read_file(os.path.join(root, "out", "daemon", "__init__.pyi")) == (
+        "def d() -> int: ...\n"
+    )
+    assert read_file(os.path.join(root, "out", "why", "__init__.pyi")) == (
+        "def w() -> int: ...\n"
+    )
+
+    proc = run_doxxie(root, "-v", "--why", "why.w")
+    assert proc.returncode == 2
+    assert "--why must be the first argument" in proc.stderr
@@ -0,0 +1,55 @@
+import os
+from pathlib import Path
+import socket
+
+import pytest
+
+from .utils import read_file
+from .utils import run_doxxie
+from .utils import write_files
+
+
+pytestmark = pytest.mark.skipif(
+    not hasattr(socket, "AF_UNIX"), reason="the daemon needs Unix sockets"
+)
+
+
+def test_daemon(tmp_path: Path) -> None:
+    root = str(tmp_path)
+    sock = os.path.join(root, "d.sock")
+    write_files(root, {"pkg/__init__.py": "def f(x: int) -> int:\n    return x\n"})
+    args = ("--daemon", "--socket", sock, "run", "--")
+    stub = os.path.join(root, "out", "pkg", "__init__.pyi")
+
+    try:
+        # The first run starts a daemon.
+        proc = run_doxxie(root, *args, "--public-api-only", "pkg", "-o", "out", "-v")
+        assert proc.returncode == 0, proc.stderr
+        assert os.path.exists(sock)
+        assert "Reusing the analysis" not in proc.stdout
+        assert read_file(stub) == "def f(x: int) -> int: ...\n"
+
+        # Unchanged sources reuse the analysis of the running daemon.
+        proc = run_doxxie(root, *args, "--public-api-only", "pkg", "-o", "out", "-v")
+        assert proc.returncode == 0, proc.stderr
+        assert "Reusing the analysis of 1 modules" in proc.stdout
+
+        # Bad arguments are reported without stopping the daemon.
+        proc = run_doxxie(root, *args, "--no-such-option")
+        assert proc.returncode == 2
+        assert "unrecognized arguments: --no-such-option" in proc.stderr
+
+        # An edit is picked up by the next run.
+        write_files(root, {"pkg/__init__.py": "def f(x: str) -> str:\n    return x\n"})
+        proc = run_doxxie(root, *args, "--public-api-only", "pkg", "-o", "out", "-v")
+        assert proc.returncode == 0, proc.stderr
+        assert "Reusing the analysis" not in proc.stdout
+        assert read_file(stub) == "def f(x: str) -> str: ...\n"
+    finally:
+        proc = run_doxxie(root, "--daemon", "--socket", sock, "stop")
+    assert proc.returncode == 0, proc.stderr
+    assert not os.path.exists(sock)
+
+    proc = run_doxxie(root, "--daemon", "--socket", sock, "stop")
+    assert proc.returncode == 1
+    assert "doxxie daemon is not running" in proc.stderr
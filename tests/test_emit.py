@@ -0,0 +1,38 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from doxxie import _emit
+from doxxie._stubgen import generate_stubs
+from doxxie._stubgen import parse_options
+
+from .utils import copy_comprehensive
+from .utils import read_tree
+from .utils import stub_tree
+
+
+def test_parallel_output_is_the_same(tmp_path: Path) -> None:
+    root = str(tmp_path)
+    copy_comprehensive(root)
+    expected = stub_tree(root)
+    assert len(expected) > 2
+    assert stub_tree(root, "-j", "2") == expected
+
+
+def test_serial_fallback(tmp_path: Path, monkeypatch: "pytest.MonkeyPatch") -> None:
+    # Without fork, the stubs are rendered in this process.
+    root = str(tmp_path)
+    copy_comprehensive(root)
+    expected = stub_tree(root)
+
+    def no_pool(*args: object) -> None:
+        raise AssertionError("no workers can be started")
+
+    monkeypatch.setattr(_emit, "can_fork", lambda: False)
+    monkeypatch.setattr(_emit.multiprocessing, "get_context", no_pool)
+    out = os.path.join(root, "out")
+    args = ["--public-api-only", "--public-api-exclude", "pkg.internal", "-q"]
+    args += [os.path.join(root, "pkg"), "-o", out, "-j", "2"]
+    generate_stubs(parse_options(args))
+    assert read_tree(out) == expected
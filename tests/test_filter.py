@@ -0,0 +1,85 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from doxxie._filter import ModuleFilter
+
+from .utils import read_file
+from .utils import run_doxxie
+from .utils import write_files
+
+
+@pytest.mark.parametrize(
+    "name,matched",
+    [
+        ("pkg", False),
+        ("pkg.internal", True),
+        ("pkg.internal.mod.Class.method", True),
+        ("pkg.internals", False),
+        ("pkg.sub.tests", True),
+        ("pkg.sub.tests.test_x", True),
+        ("pkg.sub.testsuite", False),
+        ("pkg.sub.deeper.tests", False),
+        ("pkg.a._vendor.six", True),
+        ("_vendor", True),
+        ("other", True),
+        ("other.x", True),
+        ("otherwise", False),
+    ],
+)
+def test_mixed_rules(name: str, matched: bool) -> None:
+    f = ModuleFilter(["pkg.internal", "pkg.*.tests", "**._vendor", "other"])
+    assert (name in f) is matched
+
+
+def test_prefix_of_a_longer_name() -> None:
+    f = ModuleFilter(["pkg.a"])
+    assert "pkg.a" in f
+    assert "pkg.a.b" in f
+    assert "pkg.ab" not in f
+    assert "pkg" not in f
+    assert "pkg.b.a" not in f
+    # A glob can match within a component.
+    assert "pkg.ab" in ModuleFilter(["pkg.a*"])
+    assert "pkg.ab.c" in ModuleFilter(["pkg.a*"])
+    assert "pkg.ba" not in ModuleFilter(["pkg.a*"])
+
+
+def test_nested_and_duplicate_rules() -> None:
+    f = ModuleFilter(["pkg.a.b", "pkg.a", "pkg.a.b", ""])
+    assert "pkg.a.c" in f
+    assert "pkg.a.b.c" in f
+    assert "pkg.ab" not in f
+    assert bool(f)
+    assert not ModuleFilter(["", ""])
+
+
+def test_excluded_items_are_included_when_leaked(tmp_path: Path) -> None:
+    # Exclusion takes precedence for the initial public API, but the items of
+    # an excluded module are still part of it when a public item leaks them.
+    root = str(tmp_path)
+    write_files(
+        root,
+        {
+            "pkg/__init__.py": (
+                "from pkg.internal import Leaked\n"
+                "def f() -> Leaked:\n"
+                "    return Leaked()\n"
+            ),
+            "pkg/internal/__init__.py": "class Leaked: ...\nclass Hidden: ...\n",
+            "pkg/internal/tests.py": "class Test:\n    pass\n",
+        },
+    )
+    args = ["--public-api-only", "pkg", "-o", "out", "-q"]
+    proc = run_doxxie(root, *args, "-e", "pkg.internal", "-e", "pkg.*.tests")
+    assert proc.returncode == 0, proc.stderr
+    internal = read_file(os.path.join(root, "out", "pkg", "internal", "__init__.pyi"))
+    assert internal == "class Leaked: ...\n"
+    assert read_file(os.path.join(root, "out", "pkg", "internal", "tests.pyi")) is None
+
+    # Without the exclusion, the whole internal package is public.
+    proc = run_doxxie(root, *args)
+    assert proc.returncode == 0, proc.stderr
+    internal = read_file(os.path.join(root, "out", "pkg", "internal", "__init__.pyi"))
+    assert internal == "class Leaked: ...\nclass Hidden: ...\n"
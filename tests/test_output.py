@@ -0,0 +1,213 @@
+import os
+from pathlib import Path
+import subprocess
+import sys
+import time
+from typing import Any
+from typing import Optional
+
+import pytest
+
+from doxxie import _stubgen
+from doxxie._staging import STALE_STAGING_AGE
+from doxxie._stubgen import StubSource
+from doxxie._stubgen import generate_stubs
+from doxxie._stubgen import parse_options
+
+from .utils import read_file
+from .utils import read_tree
+from .utils import run_doxxie
+from .utils import write_files
+
+
+PACKAGE = {
+    "pkg/__init__.py": "",
+    "pkg/a.py": "def a() -> int:\n    return 0\n",
+    "pkg/b.py": "def b() -> int:\n    return 0\n",
+    "pkg/sub/__init__.py": "",
+    "pkg/sub/c.py": "def c() -> int:\n    return 0\n",
+}
+
+
+def test_stale_stubs_are_removed(tmp_path: Path) -> None:
+    root = str(tmp_path)
+    out = os.path.join(root, "out")
+    write_files(root, PACKAGE)
+    proc = run_doxxie(root, "--public-api-only", "pkg", "-o", "out")
+    assert proc.returncode == 0, proc.stderr
+    assert "Wrote 5 stubs, 0 unchanged, 0 removed" in proc.stdout
+    # Files which aren't stubs of the package are left alone.
+    write_files(out, {"pkg/notes.txt": "notes", "other/x.pyi": "x: int\n"})
+    # Unchanged stubs aren't written again.
+    stub_a = os.path.join(out, "pkg", "a.pyi")
+    os.utime(stub_a, (0, 0))
+
+    os.remove(os.path.join(root, "pkg", "b.py"))
+    os.remove(os.path.join(root, "pkg", "sub", "c.py"))
+    os.remove(os.path.join(root, "pkg", "sub", "__init__.py"))
+    proc = run_doxxie(root, "--public-api-only", "pkg", "-o", "out")
+    assert proc.returncode == 0, proc.stderr
+    assert "Wrote 0 stubs, 2 unchanged, 3 removed" in proc.stdout
+    assert sorted(os.listdir(os.path.join(out, "pkg"))) == [
+        "__init__.pyi",
+        "a.pyi",
+        "notes.txt",
+    ]
+    assert os.stat(stub_a).st_mtime == 0
+    assert read_file(os.path.join(out, "pkg", "notes.txt")) == "notes"
+    assert read_file(os.path.join(out, "other", "x.pyi")) == "x: int\n"
+
+
+def test_skip_unchanged(tmp_path: Path) -> None:
+    root = str(tmp_path)
+    out = os.path.join(root, "out")
+    write_files(root, PACKAGE)
+    args = ("--public-api-only", "pkg", "-o", "out", "--skip-unchanged")
+    proc = run_doxxie(root, *args)
+    assert proc.returncode == 0, proc.stderr
+    assert "Wrote 5 stubs" in proc.stdout
+    proc = run_doxxie(root, *args)
+    assert proc.returncode == 0, proc.stderr
+    assert "No changes in 5 modules, skipping" in proc.stdout
+
+    # An edited source is regenerated.
+    write_files(root, {"pkg/a.py": "def a() -> str:\n    return ''\n"})
+    proc = run_doxxie(root, *args)
+    assert proc.returncode == 0, proc.stderr
+    assert "Wrote 1 stub, 4 unchanged, 0 removed" in proc.stdout
+    assert read_file(os.path.join(out, "pkg", "a.pyi")) == "def a() -> str: ...\n"
+
+    # So is an edited stub.
+    write_files(out, {"pkg/b.pyi": ""})
+    proc = run_doxxie(root, *args)
+    assert proc.returncode == 0, proc.stderr
+    assert "Wrote 1 stub, 4 unchanged, 0 removed" in proc.stdout
+    assert read_file(os.path.join(out, "pkg", "b.pyi")) == "def b() -> int: ...\n"
+
+    # Stale stubs are removed even though the sources are unchanged.
+    write_files(out, {"pkg/sub/d.pyi": ""})
+    proc = run_doxxie(root, *args)
+    assert proc.returncode == 0, proc.stderr
+    assert "Wrote 0 stubs, 5 unchanged, 1 removed" in proc.stdout
+    assert read_file(os.path.join(out, "pkg", "sub", "d.pyi")) is None
+    proc = run_doxxie(root, *args)
+    assert "No changes in 5 modules, skipping" in proc.stdout
+
+
+def test_failed_run_leaves_output_untouched(
+    tmp_path: Path, monkeypatch: "pytest.MonkeyPatch"
+) -> None:
+    root = str(tmp_path)
+    out = os.path.join(root, "out")
+    write_files(root, PACKAGE)
+    args = ["--public-api-only", os.path.join(root, "pkg"), "-o", out, "-q"]
+    generate_stubs(parse_options(args))
+    before = read_tree(out)
+    assert before["pkg/a.pyi"] == "def a() -> int: ...\n"
+
+    # The stub of pkg.a changes but the run fails at pkg.b, after it.
+    write_files(root, {"pkg/a.py": "def a() -> str:\n    return ''\n"})
+    render = _stubgen.render_stub_from_ast
+
+    def failing_render(mod: StubSource, *args: Any) -> Optional[str]:
+        if mod.module == "pkg.b":
+            raise RuntimeError("failed to render pkg.b")
+        return render(mod, *args)
+
+    monkeypatch.setattr(_stubgen, "render_stub_from_ast", failing_render)
+    with pytest.raises(RuntimeError):
+        generate_stubs(parse_options(args))
+    assert read_tree(out) == before
+    # The staging copy is removed.
+    assert sorted(os.listdir(root)) == ["out", "pkg"]
+
+
+def test_stale_staging_copies_are_removed(tmp_path: Path) -> None:
+    root = str(tmp_path)
+    out = os.path.join(root, "out")
+    write_files(root, PACKAGE)
+    args = ["--public-api-only", os.path.join(root, "pkg"), "-o", out, "-q"]
+    generate_stubs(parse_options(args))
+    expected = read_tree(out)
+
+    # Copies left behind by runs which were killed, by a running process and
+    # by some other program.
+    dead = subprocess.Popen([sys.executable, "-c", ""])
+    dead.wait()
+    alive = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+    try:
+        write_files(
+            root,
+            {
+                ".out.staging-%d-a/out/pkg/a.pyi" % dead.pid: "",
+                ".out.staging-%d-b/out/pkg/a.pyi" % alive.pid: "",
+                ".out.staging-%d-c/out/pkg/a.pyi" % alive.pid: "",
+                ".out.staging-x/notes.txt": "",
+                ".out.other/notes.txt": "",
+            },
+        )
+        old = time.time() - STALE_STAGING_AGE - 60
+        os.utime(os.path.join(root, ".out.staging-%d-c" % alive.pid), (old, old))
+        generate_stubs(parse_options(args))
+        assert read_tree(out) == expected
+        assert sorted(os.listdir(root)) == [
+            ".out.other",
+            ".out.staging-%d-b" % alive.pid,
+            ".out.staging-x",
+            "out",
+            "pkg",
+        ]
+    finally:
+        alive.kill()
+        alive.wait()
+
+    # A run killed between the two renames of the swap left the output
+    # directory in its staging copy, which is moved back.
+    write_files(out, {"notes.txt": "notes"})
+    staging = os.path.join(root, ".out.staging-%d-d" % alive.pid)
+    os.makedirs(os.path.join(staging, "out"))
+    os.rename(out, os.path.join(staging, "previous"))
+    generate_stubs(parse_options(args))
+    assert read_tree(out) == dict(expected, **{"notes.txt": "notes"})
+    assert not os.path.exists(staging)
+
+
+def test_check(tmp_path: Path) -> None:
+    root = str(tmp_path)
+    out = os.path.join(root, "out")
+    write_files(root, PACKAGE)
+    args = ("--public-api-only", "pkg", "-o", "out", "--skip-unchanged")
+    proc = run_doxxie(root, *args)
+    assert proc.returncode == 0, proc.stderr
+    before = read_tree(out)
+
+    proc = run_doxxie(root, *args, "--check")
+    assert proc.returncode == 0, proc.stderr
+    assert "Checked 5 stubs, all up to date" in proc.stdout
+
+    # Edited and added stubs are reported even though the fingerprint of the
+    # sources matches.
+    write_files(out, {"pkg/a.pyi": "def a() -> str: ...\n", "pkg/d.pyi": ""})
+    proc = run_doxxie(root, *args, "--check")
+    assert proc.returncode == 1
+    assert "Stubs not up to date: 2\n" in proc.stderr
+    assert (
+        "--- out/pkg/a.pyi\n"
+        "+++ out/pkg/a.pyi\n"
+        "@@ -1 +1 @@\n"
+        "-def a() -> str: ...\n"
+        "+def a() -> int: ...\n"
+    ) in proc.stdout
+    assert "--- out/pkg/d.pyi\n+++ /dev/null\n" in proc.stdout
+
+    # Nothing is written.
+    assert read_tree(out)["pkg/a.pyi"] == "def a() -> str: ...\n"
+    os.remove(os.path.join(out, "pkg", "d.pyi"))
+    assert read_tree(out) != before
+
+    proc = run_doxxie(root, *args, "--check", "--check-diffs", "0")
+    assert proc.returncode == 1
+    assert proc.stdout == ""
+    assert (
+        proc.stderr == "Stubs not up to date: 1 (differences shown for the first 0)\n"
+    )
@@ -0,0 +1,198 @@
+import ast
+import atexit
+from collections import deque
+import os
+from pathlib import Path
+import subprocess
+import sys
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from mypy.nodes import Block
+from mypy.nodes import ClassDef
+from mypy.nodes import GDEF
+from mypy.nodes import MDEF
+from mypy.nodes import MypyFile
+from mypy.nodes import SymbolTable
+from mypy.nodes import SymbolTableNode
+from mypy.nodes import TypeInfo
+from mypy.nodes import Var
+from mypy.options import Options
+from mypy.types import Instance
+import pytest
+
+from doxxie import doxxie
+from doxxie._lookup import LookupCache
+
+from .utils import ROOT
+from .utils import read_file
+from .utils import write_files
+
+
+# Length of the chain of internal classes leaked by the public API.
+CHAIN = 200
+
+
+def chain_package(length: int) -> Dict[str, str]:
+    """Return a package whose only public function leaks a chain of classes.
+
+    The class of each internal module is returned by a method of the class
+    of the previous one.
+    """
+    files = {
+        "mypy.ini": "[mypy]\nplugins = doxxie\n",
+        "pkg/__init__.py": (
+            "from pkg.internal.c0 import C0\n"
+            "def entry() -> C0:\n"
+            "    return C0()\n"
+        ),
+        "pkg/internal/__init__.py": "",
+    }
+    for i in range(length):
+        if i + 1 < length:
+            files["pkg/internal/c%d.py" % i] = (
+                "from pkg.internal.c{j} import C{j}\n"
+                "class C{i}:\n"
+                "    def next(self) -> C{j}:\n"
+                "        return C{j}()\n"
+            ).format(i=i, j=i + 1)
+        else:
+            files["pkg/internal/c%d.py" % i] = "class C%d:\n    pass\n" % i
+    return files
+
+
+def test_leak_chain(tmp_path: Path) -> None:
+    root = str(tmp_path)
+    write_files(root, chain_package(CHAIN))
+    env = dict(
+        os.environ,
+        PYTHONPATH=ROOT,
+        DOXXIE_INCLUDES="pkg",
+        DOXXIE_EXCLUDES="pkg.internal",
+        DOXXIE_OUTFILE=os.path.join(root, "api.txt"),
+        DOXXIE_DERIVE_OUTFILE=os.path.join(root, "derivations.txt"),
+    )
+    proc = subprocess.run(
+        [sys.executable, "-m", "mypy", "--no-incremental", "pkg"],
+        cwd=root,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+
+    expected = ["pkg.entry"]
+    for i in range(CHAIN):
+        expected.append("pkg.internal.c%d.C%d" % (i, i))
+        if i + 1 < CHAIN:
+            expected.append("pkg.internal.c%d.C%d.next" % (i, i))
+    api = read_file(os.path.join(root, "api.txt"))
+    assert api is not None
+    assert sorted(ast.literal_eval(api)) == sorted(expected)
+
+    # Each member is derived from the one before it in the chain.
+    text = read_file(os.path.join(root, "derivations.txt"))
+    assert text is not None
+    derivations: Dict[str, List[str]] = ast.literal_eval(text)
+    assert sorted(derivations) == sorted(expected)
+    last = expected[-1]
+    assert derivations[last] == expected
+    assert derivations["pkg.internal.c1.C1"] == expected[:4]
+
+
+def chain_module(length: int) -> MypyFile:
+    """Return a module of classes whose next attribute has the next class."""
+    infos = []
+    for i in range(length):
+        cls = ClassDef("C%d" % i, Block([]))
+        cls.fullname = "pkg.C%d" % i
+        info = TypeInfo(SymbolTable(), cls, "pkg")
+        info.mro = [info]
+        infos.append(info)
+    mod = MypyFile([], [])
+    mod.names = SymbolTable()
+    for i, info in enumerate(infos):
+        if i + 1 < length:
+            var = Var("next", Instance(infos[i + 1], []))
+            var._fullname = info.fullname + ".next"
+            info.names["next"] = SymbolTableNode(MDEF, var)
+        mod.names[info.name] = SymbolTableNode(GDEF, info)
+    return mod
+
+
+class CountingDeque(deque):  # type: ignore[type-arg]
+    pops = 0
+
+    def popleft(self) -> Any:
+        CountingDeque.pops += 1
+        return super().popleft()
+
+
+class CountingDict(Dict[str, Tuple[SymbolTableNode, Optional[str]]]):
+    lookups = 0
+
+    def __getitem__(self, key: str) -> Tuple[SymbolTableNode, Optional[str]]:
+        CountingDict.lookups += 1
+        return super().__getitem__(key)
+
+
+def expand_chain(
+    length: int, tmp_path: Path, monkeypatch: "pytest.MonkeyPatch"
+) -> Tuple[int, int, int]:
+    """Expand the API of a chain of classes and return the number of queue
+    pops, symbol lookups and parent pointers followed for the last class.
+    """
+    plugin = doxxie.MypyPlugin(Options(), includes="pkg", out=str(tmp_path / "api"))
+    atexit.unregister(plugin._done)
+    mod = chain_module(length)
+    plugin._lookup_cache = LookupCache({"pkg": mod})
+    monkeypatch.setattr(CountingDeque, "pops", 0)
+    monkeypatch.setattr(CountingDict, "lookups", 0)
+    monkeypatch.setattr(doxxie, "deque", CountingDeque)
+
+    public_api = plugin._expand_api({"pkg.C0": mod.names["C0"]})
+    assert len(public_api) == 2 * length - 1
+    # Only the parent of each member is stored, not its whole derivation.
+    assert all(
+        parent is None or parent in public_api for _, parent in public_api.values()
+    )
+    last = "pkg.C%d" % (length - 1)
+    assert len(doxxie._derivation(CountingDict(public_api), last)) == 2 * length - 1
+    lookups = plugin._lookup_cache.hits + plugin._lookup_cache.misses
+    return CountingDeque.pops, lookups, CountingDict.lookups
+
+
+def test_expand_api_is_linear(
+    tmp_path: Path, monkeypatch: "pytest.MonkeyPatch"
+) -> None:
+    # The work done for a chain of leaked classes grows linearly with its
+    # length: each member is queued and looked up a constant number of times
+    # and its derivation is found by following one parent pointer per step.
+    pops, lookups, parents = expand_chain(CHAIN, tmp_path, monkeypatch)
+    # The members are queued in a deque (list.pop(0) is linear).
+    assert pops > 0
+    assert parents == 2 * CHAIN - 1
+    # Four times the length takes about four times the work (sixteen if it
+    # were quadratic).
+    pops4, lookups4, parents4 = expand_chain(4 * CHAIN, tmp_path, monkeypatch)
+    assert pops4 < 5 * pops
+    assert lookups4 < 5 * lookups
+    assert parents4 < 5 * parents
+
+
+def test_derivation_cycle() -> None:
+    node = SymbolTableNode(GDEF, None)
+    api: Dict[str, Tuple[SymbolTableNode, Optional[str]]] = {
+        "a": (node, "c"),
+        "b": (node, "a"),
+        "c": (node, "b"),
+        "d": (node, "d"),
+        "e": (node, "c"),
+    }
+    assert doxxie._derivation(api, "c") == ["a", "b", "c"]
+    assert doxxie._derivation(api, "e") == ["a", "b", "c", "e"]
+    assert doxxie._derivation(api, "d") == ["d"]
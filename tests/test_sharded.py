@@ -0,0 +1,154 @@
+import os
+from pathlib import Path
+from typing import Dict
+from typing import Set
+
+from doxxie._sharded import find_imports
+from doxxie._sharded import make_shards
+from doxxie._sharded import strongly_connected_components
+from doxxie._stubgen import StubSource
+
+from .utils import run_doxxie
+from .utils import stub_tree
+from .utils import write_files
+
+
+# Two public modules, each leaking a class of its own internal module, which
+# both leak a class of a third one.
+PACKAGE = {
+    "pkg/__init__.py": "",
+    "pkg/a.py": "from pkg.internal.ia import IA\ndef a() -> IA:\n    return IA()\n",
+    "pkg/b.py": "from pkg.internal.ib import IB\ndef b() -> IB:\n    return IB()\n",
+    "pkg/internal/__init__.py": "",
+    "pkg/internal/ia.py": (
+        "from pkg.internal.common import Common\n"
+        "class IA:\n"
+        "    def common(self) -> Common:\n"
+        "        return Common()\n"
+    ),
+    "pkg/internal/ib.py": (
+        "from pkg.internal import common\n"
+        "class IB:\n"
+        "    def common(self) -> 'common.Common':\n"
+        "        return common.Common()\n"
+    ),
+    "pkg/internal/common.py": "class Common:\n    x: int = 0\n",
+}
+
+
+def test_find_imports(tmp_path: Path) -> None:
+    root = str(tmp_path)
+    write_files(
+        root,
+        {
+            "pkg/__init__.py": "",
+            "pkg/a.py": (
+                "import os\n"
+                "from . import b\n"
+                "from .sub import c as x\n"
+                "import pkg.sub.d\n"
+                "from typing import TYPE_CHECKING\n"
+                "if TYPE_CHECKING:\n"
+                "    from pkg.e import E\n"
+                "def f() -> None:\n"
+                "    from pkg import a\n"
+            ),
+            "pkg/bad.py": "def (\n",
+        },
+    )
+    modules = {
+        "pkg",
+        "pkg.a",
+        "pkg.b",
+        "pkg.sub",
+        "pkg.sub.c",
+        "pkg.sub.d",
+        "pkg.e",
+        "pkg.f",
+        "pkg.bad",
+    }
+
+    def imports(module: str) -> Set[str]:
+        path = os.path.join(root, *module.split(".")) + ".py"
+        return find_imports(StubSource(module, path), modules)
+
+    # Conditional, nested and relative imports are included, along with the
+    # parent packages; the module itself and modules outside of modules aren't.
+    assert imports("pkg.a") == {
+        "pkg",
+        "pkg.b",
+        "pkg.sub",
+        "pkg.sub.c",
+        "pkg.sub.d",
+        "pkg.e",
+    }
+    # A module which can't be parsed may import anything.
+    assert imports("pkg.bad") == modules
+    assert find_imports(StubSource("pkg.sub.c"), modules) == {"pkg", "pkg.sub"}
+
+
+def test_strongly_connected_components() -> None:
+    graph: Dict[str, Set[str]] = {
+        "a": {"b"},
+        "b": {"c"},
+        "c": {"a", "d"},
+        "d": {"d"},
+        "e": {"a", "f"},
+        "f": set(),
+        "g": set(),
+    }
+    sccs = strongly_connected_components(graph)
+    assert sorted(sorted(scc) for scc in sccs) == [
+        ["a", "b", "c"],
+        ["d"],
+        ["e"],
+        ["f"],
+        ["g"],
+    ]
+    # Components come after the ones they depend on.
+    position = {m: i for i, scc in enumerate(sccs) for m in scc}
+    for module, deps in graph.items():
+        for dep in deps:
+            assert position[dep] <= position[module]
+
+    # Long chains don't hit the recursion limit.
+    chain = {str(i): {str(i + 1)} for i in range(5000)}
+    chain["5000"] = {"0"}
+    assert [len(scc) for scc in strongly_connected_components(chain)] == [5001]
+
+
+def test_make_shards() -> None:
+    graph: Dict[str, Set[str]] = {
+        "a": {"b"},
+        "b": {"a"},
+        "c": set(),
+        "d": {"c"},
+        "e": set(),
+    }
+    sizes = {"a": 5, "b": 5, "c": 3, "d": 3, "e": 1}
+    shards = make_shards(graph, sizes, 2)
+    # Every module is in exactly one shard and cycles aren't split.
+    assert sorted(m for shard in shards for m in shard) == sorted(graph)
+    assert any({"a", "b"} <= shard for shard in shards)
+    assert sorted(sorted(shard) for shard in shards) == [["a", "b"], ["c", "d", "e"]]
+
+    # There are no empty shards.
+    assert sorted(sorted(s) for s in make_shards(graph, sizes, 10)) == [
+        ["a", "b"],
+        ["c"],
+        ["d"],
+        ["e"],
+    ]
+    assert make_shards(graph, sizes, 1) == [set(graph)]
+
+
+def test_sharded_output_is_the_same(tmp_path: Path) -> None:
+    root = str(tmp_path)
+    write_files(root, PACKAGE)
+    proc = run_doxxie(root, "--public-api-only", "pkg", "--sharded", "-j", "3", "-v")
+    assert proc.returncode == 0, proc.stderr
+    assert "Analyzing 7 modules in 3 shards" in proc.stdout
+
+    expected = stub_tree(root)
+    assert expected["pkg/internal/common.pyi"] == "class Common:\n    x: int = ...\n"
+    assert stub_tree(root, "--sharded", "-j", "3") == expected
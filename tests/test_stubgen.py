@@ -0,0 +1,527 @@
+import os
+from pathlib import Path
+import sys
+import tempfile
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from mypy.nodes import ClassDef
+from mypy.nodes import FuncDef
+from mypy.traverser import TraverserVisitor
+import pytest
+
+from doxxie._stubgen import IntrospectionCache
+from doxxie._stubgen import ModuleSummary
+from doxxie._stubgen import PublicAPIIndex
+from doxxie._stubgen import StubSource
+from doxxie._stubgen import find_defined_names
+from doxxie._stubgen import find_method_names
+from doxxie._stubgen import find_module_paths_using_imports
+from doxxie._stubgen import find_module_paths_using_search
+from doxxie._stubgen import find_referenced_names
+from doxxie._stubgen import find_self_initializers
+from doxxie._stubgen import generate_asts_for_modules
+from doxxie._stubgen import mypy_options
+from doxxie._stubgen import parse_options
+
+from .utils import copy_comprehensive
+from .utils import read_file
+from .utils import read_tree
+from .utils import run_doxxie
+from .utils import stub_tree
+from .utils import write_files
+
+
+PYVERSION = (sys.version_info[0], sys.version_info[1])
+
+
+def test_find_module_paths_using_search(tmp_path: Path) -> None:
+    root = str(tmp_path)
+    write_files(root, {"pkg/__init__.py": "", "pkg/a.py": ""})
+    sources = find_module_paths_using_search([], ["pkg"], [root], PYVERSION)
+    assert sorted((s.module, s.path) for s in sources) == [
+        ("pkg", os.path.join(root, "pkg", "__init__.py")),
+        ("pkg.a", os.path.join(root, "pkg", "a.py")),
+    ]
+
+    with pytest.raises(SystemExit):
+        find_module_paths_using_search([], ["missing"], [root], PYVERSION)
+
+
+def test_import_timeout(
+    tmp_path: Path,
+    monkeypatch: "pytest.MonkeyPatch",
+    capsys: "pytest.CaptureFixture[str]",
+) -> None:
+    root = str(tmp_path)
+    write_files(
+        root,
+        {
+            "slowimports/__init__.py": "",
+            "slowimports/a_slow.py": "import time\ntime.sleep(2)\n__all__ = ['a']\na = 0\n",
+            "slowimports/b_fast.py": "__all__ = ['b']\nb = 0\n",
+        },
+    )
+    monkeypatch.syspath_prepend(root)
+    modules = ["slowimports.a_slow", "slowimports.b_fast"]
+
+    # A single inspector is restarted after the timeout of a_slow and then
+    # imports b_fast.
+    py_modules, c_modules = find_module_paths_using_imports(
+        modules, [], "", PYVERSION, False, False, 1, 0.5, [root]
+    )
+    assert c_modules == []
+    assert [(s.module, s.path, s.runtime_all) for s in py_modules] == [
+        ("slowimports.a_slow", os.path.join(root, "slowimports", "a_slow.py"), None),
+        ("slowimports.b_fast", os.path.join(root, "slowimports", "b_fast.py"), ["b"]),
+    ]
+    err = capsys.readouterr().err
+    assert "warning: slowimports.a_slow: Import took longer than 0.5 seconds" in err
+    assert "slowimports.b_fast" not in err
+
+    # There is no timeout by default.
+    py_modules, c_modules = find_module_paths_using_imports(
+        modules, [], "", PYVERSION, False, False, 1
+    )
+    assert [s.runtime_all for s in py_modules] == [["a"], ["b"]]
+    assert capsys.readouterr().err == ""
+
+
+def test_any_is_imported_from_typing(tmp_path: Path) -> None:
+    # Types which can't be resolved turn into Any.
+    root = str(tmp_path)
+    write_files(
+        root,
+        {
+            "pkg/__init__.py": (
+                "from typing import Any, Optional\n"
+                "from missing_module import Thing  # type: ignore\n"
+                "def get(x: Any) -> Optional[Thing]:\n"
+                "    return None\n"
+            )
+        },
+    )
+    proc = run_doxxie(root, "--public-api-only", "pkg", "-o", "out", "-q")
+    assert proc.returncode == 0, proc.stderr
+    assert read_file(os.path.join(root, "out", "pkg", "__init__.pyi")) == (
+        "from missing_module import Thing as Thing\n"
+        "from typing import Any, Optional\n"
+        "\n"
+        "def get(x: Any) -> Optional[Thing]: ...\n"
+    )
+
+
+def test_same_named_annotations(tmp_path: Path) -> None:
+    # Printed annotations are reused for types of the same shape, which
+    # classes of the same name in different modules are not.
+    root = str(tmp_path)
+    write_files(
+        root,
+        {
+            "pkg/__init__.py": (
+                "from typing import List\n"
+                "from pkg import a, b\n"
+                "def f(x: a.Thing) -> b.Thing:\n"
+                "    return b.Thing()\n"
+                "class C:\n"
+                "    def __init__(self) -> None:\n"
+                "        self.x: a.Thing = a.Thing()\n"
+                "        self.y: b.Thing = b.Thing()\n"
+                "        self.ys: List[b.Thing] = []\n"
+            ),
+            "pkg/a.py": "class Thing:\n    pass\n",
+            "pkg/b.py": "class Thing:\n    pass\n",
+        },
+    )
+    proc = run_doxxie(root, "--public-api-only", "pkg", "-o", "out", "-q")
+    assert proc.returncode == 0, proc.stderr
+    assert read_file(os.path.join(root, "out", "pkg", "__init__.pyi")) == (
+        "from pkg import a, b\n"
+        "\n"
+        "def f(x: a.Thing) -> b.Thing: ...\n"
+        "\n"
+        "class C:\n"
+        "    x: pkg.a.Thing = ...\n"
+        "    y: pkg.b.Thing = ...\n"
+        "    ys: builtins.list[pkg.b.Thing] = ...\n"
+        "    def __init__(self) -> None: ...\n"
+    )
+
+
+def test_attribute_types(tmp_path: Path) -> None:
+    # The attributes initialized by the methods are emitted with the first
+    # method initializing them, with their declared types, except for those
+    # named like a method.
+    root = str(tmp_path)
+    write_files(
+        root,
+        {
+            "pkg/__init__.py": (
+                "from typing import List\n"
+                "class C:\n"
+                "    z: int = 0\n"
+                "    def __init__(self) -> None:\n"
+                "        self.a: int = 0\n"
+                "        self.b = ''\n"
+                "    def reset(self) -> None:\n"
+                "        self.c: List[str] = []\n"
+                "        self.a = 1\n"
+                "    def m(self) -> None:\n"
+                "        self.m = None\n"
+                "    class Nested:\n"
+                "        def __init__(self) -> None:\n"
+                "            self.a: str = ''\n"
+            )
+        },
+    )
+    proc = run_doxxie(root, "--public-api-only", "pkg", "-o", "out", "-q")
+    assert proc.returncode == 0, proc.stderr
+    assert read_file(os.path.join(root, "out", "pkg", "__init__.pyi")) == (
+        "class C:\n"
+        "    z: int = ...\n"
+        "    a: builtins.int = ...\n"
+        "    b: str = ...\n"
+        "    def __init__(self) -> None: ...\n"
+        "    c: builtins.list[builtins.str] = ...\n"
+        "    def reset(self) -> None: ...\n"
+        "    def m(self) -> None: ...\n"
+        "    class Nested:\n"
+        "        a: builtins.str = ...\n"
+        "        def __init__(self) -> None: ...\n"
+    )
+
+
+def test_incremental(tmp_path: Path) -> None:
+    root = str(tmp_path)
+    copy_comprehensive(root)
+    expected = stub_tree(root)
+    # The first run fills the cache, the second one uses it.
+    assert stub_tree(root, "--incremental") == expected
+    assert os.listdir(os.path.join(root, ".doxxie_cache", "mypy"))
+    assert stub_tree(root, "--incremental") == expected
+
+    # Edits to the package are picked up by the next run.
+    write_files(
+        root,
+        {
+            "pkg/__init__.py": (
+                "from pkg.internal import ExposedClass2\n"
+                "def func(a: int) -> ExposedClass2:\n"
+                "    return ExposedClass2()\n"
+            )
+        },
+    )
+    expected = stub_tree(root)
+    assert expected["pkg/__init__.pyi"] == (
+        "from pkg.internal import ExposedClass2\n"
+        "\n"
+        "def func(a: int) -> ExposedClass2: ...\n"
+    )
+    assert stub_tree(root, "--incremental") == expected
+
+
+# Functions whose bodies matter to their stubs.
+BODIES = {
+    "pkg/bodies.py": (
+        "import os\n"
+        "import sys\n"
+        "from typing import List\n"
+        "from pkg.internal import ExposedClass2, InternalClass\n"
+        "class Attrs:\n"
+        "    def __init__(self, flag):\n"
+        "        self.a = 0\n"
+        "        if flag:\n"
+        "            self.b: List[int] = []\n"
+        "        for i in range(2):\n"
+        "            self.c = ExposedClass2()\n"
+        "        try:\n"
+        "            self.d: InternalClass = InternalClass(1, '')\n"
+        "        except Exception:\n"
+        "            self.e = None\n"
+        "        with open(os.devnull) as f:\n"
+        "            self.f = f\n"
+        "        def helper(x: ExposedClass2) -> int:\n"
+        "            return 0\n"
+        "    def method(self):\n"
+        "        self.g = sys.argv\n"
+        "        return self.a\n"
+        "    def nothing(self):\n"
+        "        print(os.sep)\n"
+        "def gen():\n"
+        "    yield 1\n"
+        "def returns(x):\n"
+        "    if x:\n"
+        "        return x\n"
+    ),
+}
+
+
+def test_prune_bodies(tmp_path: Path) -> None:
+    root = str(tmp_path)
+    copy_comprehensive(root)
+    write_files(root, BODIES)
+    expected = stub_tree(root)
+    # Attributes and return types found in the bodies.
+    stub = str(expected["pkg/bodies.pyi"])
+    assert "    d: pkg.internal.InternalClass = ...\n" in stub
+    assert "    g: Any = ...\n" in stub
+    assert "    def nothing(self) -> None: ...\n" in stub
+    assert stub_tree(root, "--prune-bodies") == expected
+
+
+# Internal modules leaked directly, through another internal module, through
+# a module imported by name, and not at all.
+LAZY = {
+    "pkg/lazy.py": (
+        "import pkg._private\n"
+        "from pkg.internal.ia import IA\n"
+        "def a() -> IA:\n"
+        "    return IA()\n"
+        "def hidden() -> pkg._private.Hidden:\n"
+        "    return pkg._private.Hidden()\n"
+    ),
+    "pkg/_private.py": "class Hidden:\n    x: int = 0\n",
+    "pkg/internal/ia.py": (
+        "from pkg.internal.common import Common\n"
+        "class IA:\n"
+        "    def common(self) -> Common:\n"
+        "        return Common()\n"
+    ),
+    "pkg/internal/common.py": "class Common:\n    y: str = ''\n",
+    "pkg/internal/unused.py": "class Unused:\n    pass\n",
+}
+
+
+def test_lazy(tmp_path: Path) -> None:
+    root = str(tmp_path)
+    copy_comprehensive(root)
+    write_files(root, LAZY)
+    expected = stub_tree(root)
+    assert "pkg/internal/common.pyi" in expected
+    assert "pkg/_private.pyi" in expected
+    assert "pkg/internal/unused.pyi" not in expected
+    assert stub_tree(root, "--lazy") == expected
+
+    proc = run_doxxie(
+        root, "--public-api-only", "-e", "pkg.internal", "pkg", "--lazy", "-v"
+    )
+    assert proc.returncode == 0, proc.stderr
+    # pkg.internal.common is only found once pkg.internal.ia is analyzed.
+    assert [line for line in proc.stdout.splitlines() if line.startswith("Adding")] == [
+        "Adding 3 internal modules used by the public API",
+        "Adding 1 internal modules used by the public API",
+    ]
+
+
+def test_parallel_parse_only(tmp_path: Path) -> None:
+    root = str(tmp_path)
+    copy_comprehensive(root)
+
+    def run(*args: str) -> List[str]:
+        out = tempfile.mkdtemp(prefix="out-", dir=root)
+        proc = run_doxxie(root, "--parse-only", "pkg", "-o", out, "-v", *args)
+        assert proc.returncode == 0, proc.stderr
+        # Only the public API is written and it needs the semantic analysis, so
+        # nothing is written with --parse-only, in parallel or not.
+        assert read_tree(out) == {}
+        return [
+            line.replace(out, "out")
+            for line in proc.stdout.splitlines()
+            if line.startswith(("Processing pkg", "Created", "Processed", "Wrote"))
+        ]
+
+    serial = run()
+    assert "Processing pkg.internal" in serial
+    assert "Wrote 0 stubs, 0 unchanged, 0 removed" in serial
+    assert run("-j", "2") == serial
+
+
+def test_introspection_cache(
+    tmp_path: Path,
+    monkeypatch: "pytest.MonkeyPatch",
+    capsys: "pytest.CaptureFixture[str]",
+) -> None:
+    # The package has a name of its own since the inspector processes are
+    # forked from this one, which must not have imported it already.
+    root = str(tmp_path)
+    write_files(
+        root,
+        {
+            "cachedmods/__init__.py": "",
+            "cachedmods/a.py": "__all__ = ['a']\na = 0\nb = 0\n",
+            "cachedmods/sub/__init__.py": "",
+            "cachedmods/sub/c.py": "c = 0\n",
+        },
+    )
+    cache_path = os.path.join(root, "cache", "introspection.json")
+    path_a = os.path.join(root, "cachedmods", "a.py")
+    path_d = os.path.join(root, "cachedmods", "sub", "d.py")
+
+    def find(
+        cache: Optional[IntrospectionCache],
+    ) -> List[Tuple[str, Optional[str], Optional[List[str]]]]:
+        py_modules, c_modules = find_module_paths_using_imports(
+            [], ["cachedmods"], "", PYVERSION, True, False, 1, None, [root], cache
+        )
+        assert c_modules == []
+        return sorted((s.module, s.path, s.runtime_all) for s in py_modules)
+
+    def find_cached() -> List[Tuple[str, Optional[str], Optional[List[str]]]]:
+        cache = IntrospectionCache(cache_path)
+        result = find(cache)
+        cache.save()
+        return result
+
+    monkeypatch.syspath_prepend(root)
+    expected = find(None)
+    assert ("cachedmods.a", path_a, ["a"]) in expected
+    capsys.readouterr()
+    # The first run fills the cache, the second one uses it.
+    assert find_cached() == expected
+    assert "Using cached" not in capsys.readouterr().out
+    assert find_cached() == expected
+    out = capsys.readouterr().out
+    assert "Using cached runtime introspection of 'cachedmods.a'" in out
+    assert "Trying to import" not in out
+
+    # Edits to __all__ and new modules are picked up by the next run.
+    write_files(
+        root,
+        {
+            "cachedmods/a.py": "__all__ = ['a', 'b']\na = 0\nb = 0\n",
+            "cachedmods/sub/d.py": "__all__ = ['d']\nd = 0\n",
+        },
+    )
+    expected = find(None)
+    assert ("cachedmods.a", path_a, ["a", "b"]) in expected
+    assert ("cachedmods.sub.d", path_d, ["d"]) in expected
+    assert find_cached() == expected
+    assert find_cached() == expected
+
+    # So are the stubs written with the cache the same as without it.
+    def stubs(*args: str) -> Dict[str, Optional[str]]:
+        out = tempfile.mkdtemp(prefix="out-", dir=root)
+        proc = run_doxxie(
+            root, "--public-api-only", "-p", "cachedmods", "-o", out, *args
+        )
+        assert proc.returncode == 0, proc.stderr
+        return read_tree(out)
+
+    expected_stubs = stubs()
+    assert expected_stubs["cachedmods/a.pyi"] == "a: int\nb: int\n"
+    assert stubs("--incremental") == expected_stubs
+    assert stubs("--incremental") == expected_stubs
+
+
+def test_public_api_index() -> None:
+    modules = ["pkg", "pkg.a", "pkg.a.b", "pkg.c", "pkg.internal"]
+    index = PublicAPIIndex(
+        [
+            "pkg",
+            "pkg.a",
+            "pkg.a.f",
+            "pkg.a.C",
+            "pkg.a.C.Nested",
+            "pkg.a.C.Nested.g",
+            "pkg.a.b.x",
+            "pkg.internal.Leaked",
+            "other.Thing",
+        ],
+        modules,
+    )
+    # Parent packages need a stub even without items of their own.
+    assert [m for m in modules if index.requires(m)] == [
+        "pkg",
+        "pkg.a",
+        "pkg.a.b",
+        "pkg.internal",
+    ]
+    assert index.slice("pkg") == {}
+    assert index.slice("pkg.c") is None
+    # Items of submodules aren't part of the slice of their package.
+    assert index.slice("pkg.a") == {
+        "pkg.a": {"f", "C"},
+        "pkg.a.C": {"Nested"},
+        "pkg.a.C.Nested": {"g"},
+    }
+    assert index.slice("pkg.a.b") == {"pkg.a.b": {"x"}}
+    assert index.slice("pkg.internal") == {"pkg.internal": {"Leaked"}}
+    assert not index.requires("pkg.a.C.h")
+
+
+class DefinitionCollector(TraverserVisitor):
+    def __init__(self) -> None:
+        self.classes: List[ClassDef] = []
+        self.funcs: List[FuncDef] = []
+
+    def visit_class_def(self, o: ClassDef) -> None:
+        self.classes.append(o)
+        super().visit_class_def(o)
+
+    def visit_func_def(self, o: FuncDef) -> None:
+        self.funcs.append(o)
+        super().visit_func_def(o)
+
+
+def test_module_summary(tmp_path: Path) -> None:
+    # A single traversal finds what the separate finders do.
+    path = str(tmp_path / "summarized.py")
+    write_files(
+        str(tmp_path),
+        {
+            "summarized.py": (
+                "import sys\n"
+                "from typing import List\n"
+                "X: List[int] = []\n"
+                "def f(a: object) -> None:\n"
+                "    def inner(self) -> None:\n"
+                "        self.z = Inner()\n"
+                "    self = a\n"
+                "    self.w = 0\n"
+                "class C(Base):\n"
+                "    y = Other\n"
+                "    def __init__(self) -> None:\n"
+                "        self.a = Thing()\n"
+                "        if sys.version_info < (3,):\n"
+                "            self.b = Py2Only()\n"
+                "    @property\n"
+                "    def p(self) -> int:\n"
+                "        return 0\n"
+                "    class Nested:\n"
+                "        def m(self) -> None:\n"
+                "            self.n = 1\n"
+                "if sys.version_info < (3,):\n"
+                "    def old() -> None:\n"
+                "        unreachable_ref()\n"
+            )
+        },
+    )
+    mod = StubSource("summarized", path)
+    options = mypy_options(parse_options([path]))
+    generate_asts_for_modules([mod], False, options, False)
+    assert mod.ast is not None
+    summary = ModuleSummary(mod.ast)
+
+    assert summary.defined_names == find_defined_names(mod.ast)
+    assert {"f", "C", "old"} <= summary.defined_names
+    assert summary.referenced_names == find_referenced_names(mod.ast)
+    assert {"Base", "Other", "Thing", "Inner"} <= summary.referenced_names
+    assert "unreachable_ref" not in summary.referenced_names
+
+    collector = DefinitionCollector()
+    mod.ast.accept(collector)
+    methods = {c.name: summary.method_names(c) for c in collector.classes}
+    assert methods == {"C": {"__init__", "p"}, "Nested": {"m"}}
+    for cls in collector.classes:
+        assert summary.method_names(cls) == find_method_names(cls.defs.body)
+    inits = {
+        f.name: [n for n, _ in summary.self_initializers(f)] for f in collector.funcs
+    }
+    assert inits["f"] == ["z", "w"]
+    assert inits["inner"] == ["z"]
+    assert inits["__init__"] == ["a", "b"]
+    assert inits["m"] == ["n"]
+    for func in collector.funcs:
+        assert summary.self_initializers(func) == find_self_initializers(func)
@@ -0,0 +1,51 @@
+from doxxie._symgraph import FLAG_ROOT
+from doxxie._symgraph import SymbolGraph
+
+
+def test_intern() -> None:
+    g = SymbolGraph()
+    assert g.intern("pkg.f", FLAG_ROOT) == 0
+    assert g.intern("pkg.C") == 1
+    # Interning again returns the same id and keeps the first flags.
+    assert g.intern("pkg.C", FLAG_ROOT) == 1
+    assert g.intern("pkg.f") == 0
+    assert len(g) == 2
+    assert g.names == ["pkg.f", "pkg.C"]
+    assert g.ids == {"pkg.f": 0, "pkg.C": 1}
+    assert g.is_root(0)
+    assert not g.is_root(1)
+
+
+def test_expand_in_id_order() -> None:
+    g = SymbolGraph()
+    f = g.intern("pkg.f", FLAG_ROOT)
+    g.intern("pkg.g", FLAG_ROOT)
+    assert g.next_unexpanded() == 0
+    assert not g.is_complete()
+
+    a = g.intern("pkg.A")
+    b = g.intern("pkg.B")
+    # Duplicate references are recorded once, in order.
+    assert g.expand([b, a, b]) == f
+    assert g.next_unexpanded() == 1
+    assert g.expand([]) == 1
+    assert g.expand([g.intern("pkg.A.m"), a]) == a
+    assert g.expand([a]) == b
+    assert not g.is_complete()
+    assert g.expand([]) == 4
+    assert g.is_complete()
+
+    assert list(g.successors(f)) == [b, a]
+    assert list(g.successors(1)) == []
+    assert list(g.successors(a)) == [4, a]
+    assert list(g.edges()) == [(f, b), (f, a), (a, 4), (a, a), (b, a)]
+    assert list(g.offsets) == [0, 2, 2, 4, 5, 5]
+    assert list(g.targets) == [b, a, 4, a, a]
+
+
+def test_edges_of_partially_expanded_graph() -> None:
+    g = SymbolGraph()
+    g.intern("pkg.f", FLAG_ROOT)
+    g.expand([g.intern("pkg.A")])
+    assert not g.is_complete()
+    assert list(g.edges()) == [(0, 1)]
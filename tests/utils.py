@@ -0,0 +1,94 @@
+"""Helpers running doxxie on packages written to temporary directories."""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from typing import Dict
+from typing import Optional
+
+import doxxie
+
+
+# The checkout of doxxie under test, added to the path of the doxxie processes.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(doxxie.__file__)))
+
+# The package of the comprehensive test, with its internal modules.
+COMPREHENSIVE = os.path.join(ROOT, "tests", "comprehensive", "pkg")
+
+
+def write_files(root: str, files: Dict[str, str]) -> None:
+    """Write files given by their path relative to root and their content."""
+    for path, content in files.items():
+        path = os.path.join(root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+
+
+def read_file(path: str) -> Optional[str]:
+    """Return the content of the file at path or None if there is none."""
+    try:
+        with open(path) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def run_doxxie(
+    cwd: str, *args: str, env: Optional[Dict[str, str]] = None
+) -> "subprocess.CompletedProcess[str]":
+    """Run the doxxie command in cwd and return the completed process."""
+    environ = dict(os.environ, **(env or {}))
+    environ["PYTHONPATH"] = os.pathsep.join(
+        [ROOT] + ([environ["PYTHONPATH"]] if environ.get("PYTHONPATH") else [])
+    )
+    return subprocess.run(
+        [sys.executable, "-m", "doxxie._stubgen"] + list(args),
+        cwd=cwd,
+        env=environ,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+
+
+def read_tree(root: str) -> Dict[str, Optional[str]]:
+    """Return the content of the files under root by relative path."""
+    files = {}
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            files[os.path.relpath(path, root)] = read_file(path)
+    return files
+
+
+def copy_comprehensive(root: str) -> None:
+    """Copy the package of the comprehensive test to root/pkg."""
+    shutil.copytree(
+        COMPREHENSIVE,
+        os.path.join(root, "pkg"),
+        ignore=shutil.ignore_patterns("__pycache__"),
+    )
+
+
+def stub_tree(root: str, *args: str) -> Dict[str, Optional[str]]:
+    """Return the stubs of the public API of root/pkg written with args.
+
+    Everything under pkg.internal is internal. Each call writes to a new
+    output directory.
+    """
+    out = tempfile.mkdtemp(prefix="out-", dir=root)
+    proc = run_doxxie(
+        root,
+        "--public-api-only",
+        "--public-api-exclude",
+        "pkg.internal",
+        "pkg",
+        "-o",
+        out,
+        *args,
+    )
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+    return read_tree(out)